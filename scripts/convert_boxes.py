@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Generate at once the binary copies of all the box files ('.words') of the
+work directory (see paperwork.backend.boxfile). Otherwise, they are
+generated on-the-fly, the first time each page is read.
+"""
+
+import os
+import sys
+
+import paperwork.backend.boxfile as boxfile
+import paperwork.backend.config as config
+from paperwork.backend.img.page import ImgPage
+from paperwork.backend.pdf.doc import PDF_FILENAME
+
+
+def main():
+    pconfig = config.PaperworkConfig()
+    pconfig.read()
+    workdir = pconfig.settings['workdir'].value
+    if len(sys.argv) > 1:
+        workdir = sys.argv[1]
+    print("Converting box files (%s)" % workdir)
+    print("====================")
+
+    nb_converted = 0
+    nb_failed = 0
+    for (dirpath, dirnames, filenames) in os.walk(workdir):
+        if PDF_FILENAME in filenames:
+            # only image documents use the binary box files
+            continue
+        for filename in filenames:
+            if not filename.endswith("." + ImgPage.EXT_BOX):
+                continue
+            words_path = os.path.join(dirpath, filename)
+            box_path = (words_path[:-len(ImgPage.EXT_BOX)]
+                        + ImgPage.EXT_BOX_BIN)
+            try:
+                boxfile.convert_words_file(words_path, box_path)
+                nb_converted += 1
+            except (IOError, OSError), exc:
+                print("%s: %s" % (words_path, exc))
+                nb_failed += 1
+        sys.stdout.write("%d " % nb_converted)
+        sys.stdout.flush()
+
+    print("")
+    print("Box files converted: %d" % nb_converted)
+    print("Failures: %d" % nb_failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compact binary copies of the box files ('.words', hOCR).
+
+The '.words' files remain the reference (and the interchange format), but
+parsing them is slow. Next to each of them, a binary file with the same boxes
+is generated on-the-fly:
+
+    header (see HEADER_FORMAT)
+    lines: int32 array (nb_lines x LINE_FIELDS)
+        x0, y0, x1, y1, nb_words
+    words: int32 array (nb_words x WORD_FIELDS)
+        x0, y0, x1, y1, confidence, end of the content in the string table
+    string table: contents of all the words, UTF-8
+
+The header contains the modification time and the size of the '.words' file
+the binary file has been generated from. If they don't match anymore, the
+binary file is generated again.
+
+Binary files are memory-mapped, and kept in a bounded cache.
+"""
+
+import codecs
+import logging
+import mmap
+import os
+import struct
+
+import numpy
+import pyocr
+import pyocr.builders
+
+from paperwork.backend.util import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = "PWBX"
+VERSION = 1
+# magic, version, mtime of the .words file, size of the .words file,
+# nb lines, nb words, size of the string table
+HEADER_FORMAT = "<4sIdQIII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+LINE_FIELDS = 5
+WORD_FIELDS = 6
+
+# maximum total size of the box files kept in the cache (bytes)
+CACHE_MAX_SIZE = 16 * 1024 * 1024
+_CACHE = LRUCache(CACHE_MAX_SIZE, weigh=lambda box_file: box_file.size)
+
+
+def read_words_file(words_path):
+    """
+    Parse a '.words' file
+
+    Returns:
+        A list of line boxes
+
+    Raises:
+        IOError if the file can't be read
+    """
+    box_builder = pyocr.builders.LineBoxBuilder()
+    with codecs.open(words_path, 'r', encoding='utf-8') as file_desc:
+        boxes = box_builder.read_file(file_desc)
+    if boxes != []:
+        return boxes
+    # fallback: old format: word boxes
+    # shouldn't be used anymore ...
+    logger.warning("WARNING: '%s' uses old box format" % words_path)
+    box_builder = pyocr.builders.WordBoxBuilder()
+    with codecs.open(words_path, 'r', encoding='utf-8') as file_desc:
+        boxes = box_builder.read_file(file_desc)
+    return boxes
+
+
+def write_box_file(path, line_boxes, words_stats):
+    """
+    Write a binary box file. The file is replaced atomically.
+
+    Arguments:
+        line_boxes --- line boxes, as returned by read_words_file(). Word
+            boxes (old format) are written as lines of a single word.
+        words_stats --- os.stat() of the '.words' file containing the same
+            boxes
+    """
+    lines = []
+    words = []
+    strings = []
+    str_end = 0
+    for line_box in line_boxes:
+        word_boxes = getattr(line_box, 'word_boxes', [line_box])
+        ((x0, y0), (x1, y1)) = line_box.position
+        lines.append((x0, y0, x1, y1, len(word_boxes)))
+        for word_box in word_boxes:
+            content = word_box.content.encode('utf-8')
+            strings.append(content)
+            str_end += len(content)
+            ((x0, y0), (x1, y1)) = word_box.position
+            words.append((x0, y0, x1, y1,
+                          int(getattr(word_box, 'confidence', 0)), str_end))
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                         words_stats.st_mtime, words_stats.st_size,
+                         len(lines), len(words), str_end)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as file_desc:
+        file_desc.write(header)
+        file_desc.write(numpy.array(lines, dtype='<i4').tostring())
+        file_desc.write(numpy.array(words, dtype='<i4').tostring())
+        file_desc.write("".join(strings))
+    os.rename(tmp_path, path)
+
+
+class BoxFile(object):
+    """
+    Read-only, memory-mapped, binary box file
+    """
+
+    def __init__(self, path):
+        """
+        Raises:
+            IOError, ValueError if the file can't be read or is invalid
+        """
+        with open(path, 'rb') as file_desc:
+            self.size = os.fstat(file_desc.fileno()).st_size
+            if self.size < HEADER_SIZE:
+                raise ValueError("'%s': truncated file" % path)
+            # the mapping remains valid after closing the file
+            self.__map = mmap.mmap(file_desc.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        (magic, version, self.words_mtime, self.words_size,
+         nb_lines, nb_words, strtab_size) = struct.unpack(
+            HEADER_FORMAT, self.__map[:HEADER_SIZE])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("'%s': unknown format" % path)
+        strtab_offset = (HEADER_SIZE + 4 * LINE_FIELDS * nb_lines
+                         + 4 * WORD_FIELDS * nb_words)
+        if strtab_offset + strtab_size > self.size:
+            raise ValueError("'%s': truncated file" % path)
+        self.__lines = self.__map_array(HEADER_SIZE, nb_lines, LINE_FIELDS)
+        self.__words = self.__map_array(HEADER_SIZE + self.__lines.nbytes,
+                                        nb_words, WORD_FIELDS)
+        self.__strtab_offset = strtab_offset
+
+    def __map_array(self, offset, nb_rows, nb_fields):
+        if nb_rows <= 0:
+            return numpy.zeros((0, nb_fields), dtype='<i4')
+        return numpy.frombuffer(
+            self.__map, dtype='<i4', count=nb_rows * nb_fields,
+            offset=offset).reshape((nb_rows, nb_fields))
+
+    def matches(self, words_stats):
+        """
+        Returns:
+            True if this file has been generated from the '.words' file
+            with the given stats
+        """
+        return (self.words_mtime == words_stats.st_mtime
+                and self.words_size == words_stats.st_size)
+
+    def __get_contents(self):
+        ends = self.__words[:, WORD_FIELDS - 1].tolist()
+        start = 0
+        contents = []
+        for end in ends:
+            contents.append(self.__map[self.__strtab_offset + start:
+                                       self.__strtab_offset + end]
+                            .decode('utf-8'))
+            start = end
+        return contents
+
+    def get_text(self):
+        """
+        Returns:
+            The text of each line (same as ImgPage.text), without
+            instantiating any box
+        """
+        contents = self.__get_contents()
+        txt = []
+        word_idx = 0
+        for nb_words in self.__lines[:, LINE_FIELDS - 1].tolist():
+            txt.append(u"".join([u" " + content for content
+                                 in contents[word_idx:word_idx + nb_words]]))
+            word_idx += nb_words
+        return txt
+
+    def get_boxes(self):
+        """
+        Returns:
+            New line boxes (pyocr.builders.LineBox)
+        """
+        contents = self.__get_contents()
+        line_boxes = []
+        word_idx = 0
+        for line in self.__lines.tolist():
+            word_boxes = []
+            for word_nb in xrange(word_idx, word_idx + line[4]):
+                word = self.__words[word_nb].tolist()
+                word_box = pyocr.builders.Box(
+                    contents[word_nb],
+                    ((word[0], word[1]), (word[2], word[3])))
+                word_box.confidence = word[4]
+                word_boxes.append(word_box)
+            word_idx += line[4]
+            line_boxes.append(pyocr.builders.LineBox(
+                word_boxes, ((line[0], line[1]), (line[2], line[3]))))
+        return line_boxes
+
+
+def get_box_file(words_path, box_path):
+    """
+    Get the binary box file corresponding to a '.words' file. It is
+    (re)generated if required.
+
+    Returns:
+        A BoxFile, or None if the '.words' file doesn't exist or can't be
+        read
+
+    Raises:
+        IOError if the '.words' file can't be parsed
+    """
+    try:
+        words_stats = os.stat(words_path)
+    except OSError:
+        return None
+
+    box_file = _CACHE.get(box_path)
+    if box_file is not None and box_file.matches(words_stats):
+        return box_file
+
+    try:
+        box_file = BoxFile(box_path)
+        if box_file.matches(words_stats):
+            _CACHE.put(box_path, box_file)
+            return box_file
+    except (IOError, ValueError):
+        pass
+
+    convert_words_file(words_path, box_path)
+    try:
+        box_file = BoxFile(box_path)
+    except (IOError, ValueError), exc:
+        logger.warning("Unable to read '%s': %s" % (box_path, exc))
+        return None
+    _CACHE.put(box_path, box_file)
+    return box_file
+
+
+def convert_words_file(words_path, box_path):
+    """
+    (Re)generate the binary box file of a '.words' file
+
+    Raises:
+        IOError, OSError
+    """
+    words_stats = os.stat(words_path)
+    line_boxes = read_words_file(words_path)
+    try:
+        write_box_file(box_path, line_boxes, words_stats)
+    except (IOError, OSError), exc:
+        logger.warning("Unable to write '%s': %s" % (box_path, exc))
+
+
+def forget_box_file(box_path):
+    """
+    Drop a binary box file from the cache (when it's been replaced)
+    """
+    _CACHE.pop(box_path)
@@ -0,0 +1,194 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Document catalog: a compact summary of all the indexed documents, stored next
+to the Whoosh index. It allows rebuilding the document list at startup without
+touching the files of each document.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from paperwork.backend.util import get_dir_stats
+
+
+logger = logging.getLogger(__name__)
+
+# Files (re)generated by Paperwork itself on-the-fly. They don't change the
+# content of the document, so they are not taken into account in fingerprints
+FINGERPRINT_IGNORED_SUFFIXES = (
+    ".thumb.jpg",
+    ".boxes",  # see boxfile
+    ".pdf.info",  # see pdf.doc.PDF_INFO_FILENAME
+)
+# Same, but only for the files of the pages ('paper.<page>.<ext>'): the
+# document itself may contain other '.txt' files (see BasicDoc.extra_text)
+PAGE_FILE_PREFIX = "paper."
+FINGERPRINT_IGNORED_PAGE_SUFFIXES = (
+    ".txt",  # see ImgPage.EXT_TXT
+)
+
+
+def get_doc_fingerprint(file_stats):
+    """
+    Compute the fingerprint of a document directory. If any file of the
+    document is added, removed or modified, the fingerprint changes.
+
+    Arguments:
+        file_stats --- see util.get_dir_stats()
+    """
+    fingerprint = hashlib.sha1()
+    for filename in sorted(file_stats.keys()):
+        if filename.lower().endswith(FINGERPRINT_IGNORED_SUFFIXES):
+            continue
+        if (filename.lower().startswith(PAGE_FILE_PREFIX)
+                and filename.lower().endswith(
+                    FINGERPRINT_IGNORED_PAGE_SUFFIXES)):
+            continue
+        (mtime, size) = file_stats[filename]
+        if not isinstance(filename, unicode):
+            filename = filename.decode('utf-8', 'replace')
+        line = u"%s:%r:%d\n" % (filename, mtime, size)
+        fingerprint.update(line.encode('utf-8'))
+    return unicode(fingerprint.hexdigest())
+
+
+class DocCatalog(object):
+    """
+    Map docid --> basic informations about the document:
+        - doctype
+        - date ("YYYY-MM-DD")
+        - nb_pages (None if unknown)
+        - labels ([(name, color), ...])
+        - last_mod (timestamp)
+        - docfilehash (hexadecimal string, as stored in the index)
+        - fingerprint (see get_doc_fingerprint() ; None if unknown)
+
+    The catalog is only valid for a given generation of the Whoosh index.
+    If the generations don't match, the catalog must be rebuilt.
+    """
+    FILENAME = "doc_catalog.json"
+    VERSION = 2
+    FIELDS = ('doctype', 'date', 'nb_pages', 'labels', 'last_mod',
+              'docfilehash', 'fingerprint')
+
+    def __init__(self, indexdir):
+        self.path = os.path.join(indexdir, self.FILENAME)
+        self.generation = None
+        self.entries = {}  # docid --> dict
+
+    @staticmethod
+    def make_entry(doc, docfilehash, last_mod):
+        """
+        Build a catalog entry for the given document.
+
+        Arguments:
+            docfilehash --- hash of the document, as stored in the index
+            last_mod --- timestamp of the last modification
+        """
+        file_stats = get_dir_stats(doc.path)
+        fingerprint = None
+        if file_stats is not None:
+            fingerprint = get_doc_fingerprint(file_stats)
+        return {
+            'doctype': doc.doctype,
+            'date': doc.date.strftime("%Y-%m-%d"),
+            'nb_pages': doc.nb_pages,
+            'labels': [(label.name, label.get_color_str())
+                       for label in doc.labels],
+            'last_mod': last_mod,
+            'docfilehash': docfilehash,
+            'fingerprint': fingerprint,
+        }
+
+    def load(self, generation):
+        """
+        Load the catalog from the disk.
+
+        Returns:
+            True if the catalog was loaded and matches the given generation
+            of the index. False otherwise (the catalog is then empty).
+        """
+        self.entries = {}
+        self.generation = None
+        try:
+            with open(self.path, 'r') as file_desc:
+                content = json.load(file_desc)
+        except (IOError, ValueError), exc:
+            logger.warning("Unable to read document catalog '%s': %s"
+                           % (self.path, exc))
+            return False
+        if content.get('version') != self.VERSION:
+            logger.info("Document catalog version is not up to date")
+            return False
+        if content.get('generation') != generation:
+            logger.info("Document catalog doesn't match the index"
+                        " (generation %s != %s)"
+                        % (content.get('generation'), generation))
+            return False
+        for (docid, row) in content['docs'].iteritems():
+            self.entries[docid] = dict(zip(self.FIELDS, row))
+        self.generation = generation
+        logger.info("Document catalog loaded: %d documents"
+                    % len(self.entries))
+        return True
+
+    def save(self, generation):
+        """
+        Write the catalog on the disk. The file is replaced atomically.
+        """
+        docs = {}
+        for (docid, entry) in self.entries.iteritems():
+            docs[docid] = [entry[field] for field in self.FIELDS]
+        content = {
+            'version': self.VERSION,
+            'generation': generation,
+            'docs': docs,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file_desc:
+            json.dump(content, file_desc, separators=(',', ':'))
+        os.rename(tmp_path, self.path)
+        self.generation = generation
+
+    def destroy(self):
+        """
+        Forget everything, including what was stored on the disk
+        """
+        self.entries = {}
+        self.generation = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __contains__(self, docid):
+        return docid in self.entries
+
+    def __getitem__(self, docid):
+        return self.entries[docid]
+
+    def __setitem__(self, docid, entry):
+        self.entries[docid] = entry
+
+    def __delitem__(self, docid):
+        self.entries.pop(docid, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def iteritems(self):
+        return self.entries.iteritems()
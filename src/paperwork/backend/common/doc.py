@@ -21,12 +21,18 @@ import logging
 import os.path
 import time
 import hashlib
+import json
 
 from scipy import sparse
-from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.externals import joblib
 from sklearn.preprocessing import normalize
 
+from paperwork.backend.catalog import get_doc_fingerprint
+from paperwork.backend.features import extract_text_features
+from paperwork.backend.filehash import get_file_hash_cache
 from paperwork.backend.labels import Label
+from paperwork.backend.util import get_dir_stats
+from paperwork.backend.util import mkdir_p
 from paperwork.backend.util import rm_rf
 
 
@@ -41,6 +47,8 @@ class BasicDoc(object):
     FEATURES_DIR = "features"
     FEATURES_FILE = "features.jbl"
     FEATURES_VER = 1
+    # texts of all the pages, stored in FEATURES_DIR (see get_page_texts())
+    PAGE_TEXTS_FILE = "page_texts.json"
 
     pages = []
     can_edit = False
@@ -75,6 +83,16 @@ class BasicDoc(object):
     def drop_cache(self):
         self.__cache = {}
 
+    def preload_cache(self, nb_pages=None, labels=None):
+        """
+        Fill in the cache with values already known (see DocCatalog), so
+        they don't have to be read from the document files.
+        """
+        if nb_pages is not None:
+            self.__cache['nb_pages'] = nb_pages
+        if labels is not None:
+            self.__cache['labels'] = labels
+
     def __str__(self):
         return self.__docid
 
@@ -177,10 +195,72 @@ class BasicDoc(object):
 
     labels = property(__get_labels)
 
-    def get_index_text(self):
-        txt = u""
-        for page in self.pages:
-            txt += u"\n".join([unicode(line) for line in page.text])
+    def __get_page_texts_key(self):
+        """
+        Returns:
+            The fingerprint of the document directory (see
+            catalog.get_doc_fingerprint()). None if the directory doesn't
+            exist.
+        """
+        file_stats = get_dir_stats(self.path)
+        if file_stats is None:
+            return None
+        return get_doc_fingerprint(file_stats)
+
+    def __load_page_texts(self, key):
+        path = os.path.join(self.path, self.FEATURES_DIR,
+                            self.PAGE_TEXTS_FILE)
+        try:
+            with open(path, 'r') as file_desc:
+                content = json.load(file_desc)
+        except (IOError, ValueError):
+            return None
+        if content.get('key') != key:
+            return None
+        return content['pages']
+
+    def __save_page_texts(self, key, page_texts):
+        path = os.path.join(self.path, self.FEATURES_DIR,
+                            self.PAGE_TEXTS_FILE)
+        tmp_path = path + ".tmp"
+        try:
+            mkdir_p(os.path.dirname(path))
+            with open(tmp_path, 'w') as file_desc:
+                json.dump({'key': key, 'pages': page_texts}, file_desc,
+                          separators=(',', ':'))
+            os.rename(tmp_path, path)
+        except (IOError, OSError), exc:
+            logger.warning("%s: Failed to store page texts in '%s': %s"
+                           % (str(self), path, exc))
+
+    def get_page_texts(self):
+        """
+        The texts are stored in the document directory (see
+        PAGE_TEXTS_FILE). They are read from the pages again only if a
+        file of the document changed.
+
+        Returns:
+            The text of each page (one unicode string per page)
+        """
+        key = self.__get_page_texts_key()
+        if key is not None:
+            page_texts = self.__load_page_texts(key)
+            if page_texts is not None:
+                return page_texts
+        page_texts = [u"\n".join([unicode(line) for line in page.text])
+                      for page in self.pages]
+        if key is not None:
+            self.__save_page_texts(key, page_texts)
+        return page_texts
+
+    def get_index_text(self, page_texts=None):
+        """
+        Arguments:
+            page_texts --- if already known, see get_page_texts()
+        """
+        if page_texts is None:
+            page_texts = self.get_page_texts()
+        txt = u"".join(page_texts)
         extra_txt = self.extra_text
         if extra_txt != u"":
             txt += extra_txt + u"\n"
@@ -191,39 +271,118 @@ class BasicDoc(object):
         return txt
 
     def _get_text(self):
-        txt = u""
-        for page in self.pages:
-            txt += u"\n".join([unicode(line) for line in page.text])
-        txt = txt.strip()
-        return txt
+        return u"".join(self.get_page_texts()).strip()
 
     text = property(_get_text)
 
-    def get_features(self):
+    def __get_features_path(self):
+        return os.path.join(self.path, self.FEATURES_DIR, self.FEATURES_FILE)
+
+    def __load_features(self, features_key):
+        """
+        Load the features stored with the document, if they were computed
+        for the same content
+
+        Returns:
+            A sparse matrix, or None
+        """
+        features_path = self.__get_features_path()
+        if not os.path.exists(features_path):
+            return None
+        try:
+            stored = joblib.load(features_path)
+            if stored['key'] != features_key:
+                logger.info("%s: Stored features are outdated" % str(self))
+                return None
+            return sparse.csr_matrix(
+                (stored['data'], stored['indices'], stored['indptr']),
+                shape=stored['shape'])
+        except Exception, exc:
+            logger.warning("%s: Failed to load features from '%s': %s"
+                           % (str(self), features_path, exc))
+            return None
+
+    def __save_features(self, features_key, features):
+        features_path = self.__get_features_path()
+        tmp_path = features_path + ".tmp"
+        try:
+            mkdir_p(os.path.dirname(features_path))
+            joblib.dump({
+                'key': features_key,
+                'data': features.data,
+                'indices': features.indices,
+                'indptr': features.indptr,
+                'shape': features.shape,
+            }, tmp_path, compress=3)
+            os.rename(tmp_path, features_path)
+        except Exception, exc:
+            logger.warning("%s: Failed to store features in '%s': %s"
+                           % (str(self), features_path, exc))
+
+    def __get_features_key(self, index_text):
+        return (
+            self.FEATURES_VER,
+            u"%X" % self.get_docfilehash(),
+            unicode(hashlib.sha1(index_text.encode('utf-8')).hexdigest()),
+        )
+
+    def get_cached_features(self):
+        """
+        Returns:
+            The features of this document if they are already known (in
+            memory or stored in the document directory). None otherwise.
+        """
+        if 'features' in self.__cache:
+            return self.__cache['features']
+        return self.__get_stored_features(self.get_index_text())
+
+    def __get_stored_features(self, index_text):
+        features = self.__load_features(self.__get_features_key(index_text))
+        if features is not None:
+            self.__cache['features'] = features
+        return features
+
+    def get_features(self, text_features=None, img_features=None):
         """
         return an array of features extracted from this doc for the sklearn
         estimators. Concatenate features from the text and the image
+
+        The features are stored in the document directory (see FEATURES_DIR)
+        and are only computed again if the content of the document changed.
+
+        Arguments:
+            text_features --- features of the text of the document, if
+                already computed (see features.extract_text_features())
+            img_features --- features of the image of the first page, if
+                already extracted (see features.extract_pages_img_features())
         """
         if 'features' in self.__cache:
             return self.__cache['features']
 
+        index_text = self.get_index_text()
+        features = self.__get_stored_features(index_text)
+        if features is not None:
+            return features
+
+        features_key = self.__get_features_key(index_text)
         features = []
 
-        # add the words count. norm='l2', analyzer='char_wb', ngram_range=(3,3)
-        # are empirical
-        hash_vectorizer = HashingVectorizer(norm='l2', analyzer='char_wb',
-                                            ngram_range=(3, 3))
-        feature = hash_vectorizer.fit_transform([self.get_index_text()])
-        features.append(feature)
+        # add the words count
+        if text_features is None:
+            text_features = extract_text_features([index_text])
+        features.append(text_features)
 
         # add image info
-        image_features = normalize(self.pages[0].extract_features(), norm='l1')
+        if img_features is None:
+            img_features = self.pages[0].extract_features()
+        image_features = normalize(img_features, norm='l1')
         features.append(image_features*0.3)
 
         # concatenate all the features
         features = sparse.hstack(features)
         features = features.tocsr()
 
+        self.__save_features(features_key, features)
         self.__cache['features'] = features
 
         return features
@@ -401,5 +560,8 @@ class BasicDoc(object):
 
     @staticmethod
     def hash_file(path):
-        dochash = hashlib.sha256(open(path, 'rb').read()).hexdigest()
-        return int(dochash, 16)
+        """
+        Returns:
+            The SHA256 of the file, as an integer (see filehash)
+        """
+        return get_file_hash_cache().get_hash(path)
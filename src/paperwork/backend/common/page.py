@@ -18,12 +18,7 @@ from copy import copy
 import PIL.Image
 import os.path
 
-import numpy
-from scipy import sparse
-from scipy.sparse.csr import csr_matrix
-from skimage import feature
-from sklearn.preprocessing import normalize
-
+from paperwork.backend.features import extract_img_features
 from paperwork.backend.util import split_words
 
 
@@ -178,6 +173,26 @@ class BasicPage(object):
         self.__thumbnail_cache = (thumbnail, (width, height))
         return thumbnail
 
+    def get_thumbnail_path(self, width, height):
+        """
+        Make sure the thumbnail file is up-to-date (it is only generated
+        again if required).
+
+        Returns:
+            The path of the thumbnail file
+        """
+        thumb_path = self._get_thumb_path()
+        try:
+            if (os.path.getmtime(self.get_doc_file_path()) <
+                    os.path.getmtime(thumb_path)):
+                return thumb_path
+        except OSError:
+            pass
+        thumbnail = self.__make_thumbnail(width, height)
+        thumbnail.save(thumb_path)
+        self.__thumbnail_cache = (thumbnail, (width, height))
+        return thumb_path
+
     def drop_cache(self):
         self.__thumbnail_cache = (None, 0)
         self.__text_cache = None
@@ -241,45 +256,11 @@ class BasicPage(object):
     def extract_features(self):
         """
         compute image data to present features for the estimators
+        (see features.extract_img_features())
         """
         image = self.get_thumbnail(BasicPage.DEFAULT_THUMB_WIDTH,
                                    BasicPage.DEFAULT_THUMB_HEIGHT)
-        image = image.convert('RGB')
-
-        # use the first two channels of color histogram
-        histogram = image.histogram()
-        separated_histo = []
-        separated_histo.append(histogram[0:256])
-        separated_histo.append(histogram[256:256*2])
-        # use the grayscale histogram with a weight of 2
-        separated_histo.append([i*2 for i in image.convert('L').histogram()])
-        separated_flat_histo = []
-        for histo in separated_histo:
-            # flatten histograms
-            window_len = 4
-            s = numpy.r_[
-                histo[window_len-1:0:-1],
-                histo,
-                histo[-1:-window_len:-1]
-            ]
-            w = numpy.ones(window_len, 'd')
-            separated_flat_histo.append(csr_matrix(
-                numpy.convolve(w/w.sum(), s, mode='valid'))
-                .astype(numpy.float64))
-        flat_histo = normalize(sparse.hstack(separated_flat_histo), norm='l1')
-
-        # hog feature extraction
-        # must resize to multiple of 8 because of skimage hog bug
-        hog_features = feature.hog(numpy.array(image.resize((144, 144))
-                                               .convert('L')),
-                                   normalise=False)
-        hog_features = csr_matrix(hog_features).astype(numpy.float64)
-        hog_features = normalize(hog_features, norm='l1')
-
-        # concatenate
-        features = sparse.hstack([flat_histo, hog_features * 3])
-
-        return features
+        return extract_img_features(image)
 
 
 class DummyPage(object):
@@ -27,6 +27,7 @@ from gi.repository import Gio
 from gi.repository import Poppler
 from PIL import Image
 
+from paperwork.backend.filehash import get_file_hash_cache
 from paperwork.backend.pdf.doc import PdfDoc
 from paperwork.backend.img.doc import ImgDoc
 
@@ -119,10 +120,16 @@ class MultiplePdfImporter(object):
 
         idx = 0
 
-        for child in MultiplePdfImporter.__get_all_children(parent):
-            if not child.get_basename().lower().endswith(".pdf"):
-                continue
-            if docsearch.is_hash_in_index(PdfDoc.hash_file(child.get_path())):
+        children = [
+            child
+            for child in MultiplePdfImporter.__get_all_children(parent)
+            if child.get_basename().lower().endswith(".pdf")
+        ]
+        filehashes = get_file_hash_cache().get_hashes(
+            [child.get_path() for child in children])
+
+        for (child, filehash) in zip(children, filehashes):
+            if docsearch.is_hash_in_index(filehash):
                 logger.info("Document %s already found in the index. Skipped"
                             % (child.get_path()))
                 continue
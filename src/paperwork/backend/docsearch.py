@@ -22,13 +22,15 @@ suggestions)
 import logging
 import copy
 import datetime
+import heapq
 import os.path
+import sys
+import threading
 import time
 
 from gi.repository import GObject
 
 import numpy
-from sklearn.externals import joblib
 from sklearn.linear_model.passive_aggressive import PassiveAggressiveClassifier
 
 import whoosh.fields
@@ -37,16 +39,33 @@ import whoosh.qparser
 import whoosh.query
 import whoosh.sorting
 
+from paperwork.backend.catalog import DocCatalog
+from paperwork.backend.catalog import get_doc_fingerprint
 from paperwork.backend.common.doc import BasicDoc
+from paperwork.backend.duplicates import compute_minhash
+from paperwork.backend.duplicates import DEFAULT_THRESHOLD
+from paperwork.backend.duplicates import NearDuplicateIndex
+from paperwork.backend.features import get_docs_features
+from paperwork.backend.filehash import get_file_hash_cache
 from paperwork.backend.img.doc import ImgDoc
 from paperwork.backend.img.doc import is_img_doc
+from paperwork.backend.img.page import ImgPage
+from paperwork.backend.labelestimators import LabelEstimatorStore
+from paperwork.backend.labels import Label
 from paperwork.backend.pdf.doc import PdfDoc
 from paperwork.backend.pdf.doc import is_pdf_doc
+from paperwork.backend.pdf.doc import PDF_FILENAME
+from paperwork.backend.similarity import get_similarity_vectors
+from paperwork.backend.similarity import SimilarityIndex
+from paperwork.backend.util import BloomFilter
 from paperwork.backend.util import dummy_progress_cb
+from paperwork.backend.util import get_dir_stats
+from paperwork.backend.util import LRUCache
 from paperwork.backend.util import MIN_KEYWORD_LEN
 from paperwork.backend.util import mkdir_p
 from paperwork.backend.util import rm_rf
 from paperwork.backend.util import strip_accents
+from paperwork.backend.workerpool import WorkerPool
 
 
 logger = logging.getLogger(__name__)
@@ -57,6 +76,124 @@ DOC_TYPE_LIST = [
 ]
 
 
+def guess_doctype(filenames):
+    """
+    Guess the type of a document based on the names of its files.
+    Same as is_pdf_doc() and is_img_doc(), but without listing the
+    directory again.
+
+    Returns:
+        The doctype name, or None if the directory doesn't look like a
+        document
+    """
+    if PDF_FILENAME in filenames:
+        return PdfDoc.doctype
+    for filename in filenames:
+        filename = filename.lower()
+        if (filename.endswith(ImgPage.EXT_IMG)
+                and not filename.endswith(ImgPage.EXT_THUMB)):
+            return ImgDoc.doctype
+    return None
+
+
+def get_doc_index_data(doc):
+    """
+    Extract from a document everything that must be written in the index
+    and in the document catalog.
+
+    Returns:
+        A dict (see DocIndexUpdater._write_doc_index_data())
+    """
+    last_mod = doc.last_mod
+    docfilehash = (u"%X" % doc.get_docfilehash())
+    page_texts = doc.get_page_texts()
+    content = strip_accents(doc.get_index_text(page_texts))
+    return {
+        'docid': unicode(doc.docid),
+        'doctype': doc.doctype,
+        'docfilehash': docfilehash,
+        'content': content,
+        'minhash': compute_minhash(content),
+        'similarity_vector': get_doc_similarity_vector(doc),
+        'pages': [strip_accents(page_text) for page_text in page_texts],
+        'label': strip_accents(doc.get_index_labels()),
+        'date': doc.date,
+        'last_mod': last_mod,
+        'catalog_entry': DocCatalog.make_entry(doc, docfilehash, last_mod),
+    }
+
+
+def get_doc_similarity_vector(doc):
+    """
+    Returns:
+        The vector used to find similar documents (see
+        similarity.get_similarity_vectors()). None if the features of the
+        document can't be computed.
+    """
+    if doc.nb_pages <= 0:
+        return None
+    try:
+        return get_similarity_vectors(doc.get_features())[0]
+    except Exception, exc:
+        logger.warning("Failed to compute the features of %s: %s"
+                       % (doc, exc))
+        return None
+
+
+def _extract_doc_index_data(args):
+    """
+    Run in the worker processes of DocIndexUpdater.add_docs()
+
+    Arguments:
+        args --- (docpath, docid, doctype)
+
+    Returns:
+        (docid, data) --- data is None if the document couldn't be read
+    """
+    (docpath, docid, doctype) = args
+    get_file_hash_cache().track_new_entries = True
+    try:
+        for (is_doc_type, doc_type_name, doc_type) in DOC_TYPE_LIST:
+            if doc_type_name == doctype:
+                data = get_doc_index_data(doc_type(docpath, docid))
+                # let the main process remember the file hashes
+                data['file_hashes'] = get_file_hash_cache().pop_new_entries()
+                return (docid, data)
+        logger.warning("Unknown doc type for doc '%s': %s"
+                       % (docid, doctype))
+    except Exception, exc:
+        logger.exception("Unable to index doc '%s': %s" % (docid, exc))
+    return (docid, None)
+
+
+def fuse_ranked_lists(ranked_lists, limit=None, k=60):
+    """
+    Merge lists of document ids, each sorted from the best match to the
+    worst, using reciprocal rank fusion: a document gets
+    sum(1 / (k + rank)) over the lists it appears in.
+
+    Arguments:
+        ranked_lists --- lists of document ids
+        limit --- maximum number of document ids to return
+        k --- the higher it is, the less the first ranks weight
+
+    Returns:
+        A list of document ids, without duplicates, from the best match to
+        the worst. Ties keep their order of first appearance.
+    """
+    scores = {}
+    order = []
+    for ranked_list in ranked_lists:
+        for (rank, docid) in enumerate(ranked_list):
+            if docid not in scores:
+                scores[docid] = 0.0
+                order.append(docid)
+            scores[docid] += 1.0 / (k + rank + 1)
+    if limit is not None:
+        return heapq.nlargest(limit, order, key=lambda docid: scores[docid])
+    return sorted(order, key=lambda docid: scores[docid], reverse=True)
+
+
 class DummyDocSearch(object):
     """
     Dummy doc search object.
@@ -91,6 +228,16 @@ class DummyDocSearch(object):
         """ Do nothing """
         return []
 
+    @staticmethod
+    def find_documents_page(*args, **kwargs):
+        """ Do nothing """
+        return ([], 0)
+
+    @staticmethod
+    def find_pages(*args, **kwargs):
+        """ Do nothing """
+        return None
+
     @staticmethod
     def create_label(*args, **kwargs):
         """ Do nothing """
@@ -126,23 +273,54 @@ class DummyDocSearch(object):
         """ Do nothing """
         assert()
 
+    @staticmethod
+    def find_near_duplicates(*args, **kwargs):
+        """ Do nothing """
+        return []
+
+    @staticmethod
+    def find_duplicate_clusters(*args, **kwargs):
+        """ Do nothing """
+        return []
+
+    @staticmethod
+    def find_similar(*args, **kwargs):
+        """ Do nothing """
+        return []
+
     @staticmethod
     def predict_label_list(*args, **kwargs):
         """ Do nothing """
         return []
 
+    @staticmethod
+    def predict_label_lists(docs, *args, **kwargs):
+        """ Do nothing """
+        return [[] for doc in docs]
+
+    @staticmethod
+    def predict_label_scores(docs, *args, **kwargs):
+        """ Do nothing """
+        return [[] for doc in docs]
+
 
 class DocDirExaminer(GObject.GObject):
     """
     Examine a directory containing documents. It looks for new documents,
     modified documents, or deleted documents.
+
+    Each document directory is looked at only once (see
+    util.get_dir_stats()). Its fingerprint is compared to the one stored in
+    the document catalog, and the document is instantiated only if they
+    don't match.
     """
+
+    # tolerance when comparing modification times (timestamps)
+    LAST_MOD_TOLERANCE = 0.001
+
     def __init__(self, docsearch):
         GObject.GObject.__init__(self)
         self.docsearch = docsearch
-        # we may be run in an independent thread --> use an independent
-        # searcher
-        self.__searcher = docsearch.index.searcher()
 
     def examine_rootdir(self,
                         on_new_doc,
@@ -154,43 +332,62 @@ class DocDirExaminer(GObject.GObject):
         Calls on_new_doc(doc), on_doc_modified(doc), on_doc_deleted(docid)
         every time a new, modified, or deleted document is found
         """
-        # getting the doc list from the index
-        query = whoosh.query.Every()
-        results = self.__searcher.search(query, limit=None)
-        old_doc_list = [result['docid'] for result in results]
-        old_doc_infos = {}
-        for result in results:
-            old_doc_infos[result['docid']] = (result['doctype'],
-                                              result['last_read'])
-        old_doc_list = set(old_doc_list)
+        catalog = self.docsearch.catalog
+        old_doc_list = set(catalog.entries.keys())
+        # docid --> (fingerprint, nb_pages), for documents that changed on
+        # the disk without actually being modified (or whose catalog entry
+        # was incomplete, see DocSearch.__rebuild_catalog())
+        new_fingerprints = {}
 
-        # and compare it to the current directory content
         docdirs = os.listdir(self.docsearch.rootdir)
         progress = 0
         for docdir in docdirs:
-            old_infos = old_doc_infos.get(docdir)
-            doctype = None
-            if old_infos is not None:
-                doctype = old_infos[0]
-            doc = self.docsearch.get_doc_from_docid(docdir, doctype)
-            if doc is None:
+            progress_cb(progress, len(docdirs),
+                        DocSearch.INDEX_STEP_CHECKING)
+            progress += 1
+
+            docpath = os.path.join(self.docsearch.rootdir, docdir)
+            file_stats = get_dir_stats(docpath)
+            if file_stats is None:
                 continue
-            if docdir in old_doc_list:
+            fingerprint = get_doc_fingerprint(file_stats)
+
+            entry = None
+            if docdir in catalog:
+                entry = catalog[docdir]
                 old_doc_list.remove(docdir)
-                assert(old_infos is not None)
-                last_mod = datetime.datetime.fromtimestamp(doc.last_mod)
-                if old_infos[1] != last_mod:
-                    on_doc_modified(doc)
+                if entry['fingerprint'] == fingerprint:
+                    continue
+                doctype = entry['doctype']
             else:
+                doctype = guess_doctype(file_stats.keys())
+                if doctype is None:
+                    continue
+
+            doc = self.docsearch.get_doc_from_docid(docdir, doctype)
+            if doc is None:
+                continue
+            # the document may have been instantiated from its catalog entry,
+            # with its page count and labels preloaded: they must be read
+            # again from its files
+            doc.drop_cache()
+            if entry is None:
                 on_new_doc(doc)
-            progress_cb(progress, len(docdirs),
-                        DocSearch.INDEX_STEP_CHECKING, doc)
-            progress += 1
+            elif (abs(entry['last_mod'] - doc.last_mod)
+                  > self.LAST_MOD_TOLERANCE):
+                on_doc_modified(doc)
+            else:
+                new_fingerprints[docdir] = (fingerprint, doc.nb_pages)
 
         # remove all documents from the index that don't exist anymore
         for old_doc in old_doc_list:
             on_doc_deleted(old_doc)
 
+        if new_fingerprints:
+            logger.info("%d documents changed without being modified"
+                        % len(new_fingerprints))
+            self.docsearch.update_catalog_fingerprints(new_fingerprints)
+
         progress_cb(1, 1, DocSearch.INDEX_STEP_CHECKING)
 
 
@@ -199,21 +396,41 @@ class DocIndexUpdater(GObject.GObject):
     Update the index content.
     Don't forget to call commit() to apply the changes
     """
-    def __init__(self, docsearch, optimize, progress_cb=dummy_progress_cb):
+    def __init__(self, docsearch, optimize, progress_cb=dummy_progress_cb,
+                 procs=1):
+        """
+        Arguments:
+            procs --- number of processes to use. If > 1, add_docs() extracts
+                the content of the documents in parallel, with procs - 1
+                worker processes (see workerpool). The current process
+                writes the index.
+        """
         self.docsearch = docsearch
         self.optimize = optimize
+        self.procs = procs
+        # Whoosh multi-process writers fork the current process, which is
+        # not safe when it runs GLib threads: the index is written by this
+        # process only
         self.writer = docsearch.index.writer()
+        self.page_writer = docsearch.page_index.writer()
+        self.__pool = None
         self.progress_cb = progress_cb
         self.__need_reload = False
-
-    def _update_doc_in_index(self, index_writer, doc,
-                             fit_label_estimator=True):
+        # docid --> catalog entry (None if the document has been deleted)
+        self.__catalog_changes = {}
+        # docid --> (fingerprint, MinHash signature) (None if the document
+        # has been deleted)
+        self.__near_duplicate_changes = {}
+        # docid --> (fingerprint, similarity vector) (None if the document
+        # has been deleted)
+        self.__similarity_changes = {}
+
+    def _update_labels(self, doc_labels, fit_label_estimator=True):
         """
-        Add/Update a document in the index
+        Add to the label list the labels that weren't known yet
         """
         all_labels = set(self.docsearch.label_list)
-        doc_labels = set(doc.labels)
-        new_labels = doc_labels.difference(all_labels)
+        new_labels = set(doc_labels).difference(all_labels)
 
         if new_labels != set():
             for label in new_labels:
@@ -222,23 +439,43 @@ class DocIndexUpdater(GObject.GObject):
             if fit_label_estimator:
                 self.docsearch.fit_label_estimator(labels=new_labels)
 
-        if fit_label_estimator:
-            self.docsearch.fit_label_estimator([doc])
-        last_mod = datetime.datetime.fromtimestamp(doc.last_mod)
-        docid = unicode(doc.docid)
-
-        dochash = doc.get_docfilehash()
-        dochash = (u"%X" % dochash)
-
+    def _write_doc_index_data(self, index_writer, data):
+        """
+        Add/Update a document in the index, based on the data returned by
+        get_doc_index_data()
+        """
+        self.__catalog_changes[data['docid']] = data['catalog_entry']
+        self.__near_duplicate_changes[data['docid']] = (
+            data['catalog_entry']['fingerprint'], data['minhash'])
+        self.__similarity_changes[data['docid']] = (
+            data['catalog_entry']['fingerprint'], data['similarity_vector'])
+        self.page_writer.delete_by_term('docid', data['docid'])
+        for (page_nb, page_text) in enumerate(data['pages']):
+            self.page_writer.add_document(
+                pageid=u"%s/%d" % (data['docid'], page_nb),
+                docid=data['docid'],
+                page_nb=page_nb,
+                content=page_text
+            )
         index_writer.update_document(
-            docid=docid,
-            doctype=doc.doctype,
-            docfilehash=dochash,
-            content=strip_accents(doc.get_index_text()),
-            label=strip_accents(doc.get_index_labels()),
-            date=doc.date,
-            last_read=last_mod
+            docid=data['docid'],
+            doctype=data['doctype'],
+            docfilehash=data['docfilehash'],
+            content=data['content'],
+            label=data['label'],
+            date=data['date'],
+            last_read=datetime.datetime.fromtimestamp(data['last_mod'])
         )
+
+    def _update_doc_in_index(self, index_writer, doc,
+                             fit_label_estimator=True):
+        """
+        Add/Update a document in the index
+        """
+        self._update_labels(doc.labels, fit_label_estimator)
+        if fit_label_estimator:
+            self.docsearch.fit_label_estimator([doc])
+        self._write_doc_index_data(index_writer, get_doc_index_data(doc))
         return True
 
     @staticmethod
@@ -266,6 +503,49 @@ class DocIndexUpdater(GObject.GObject):
         self._update_doc_in_index(self.writer, doc,
                                   fit_label_estimator=fit_label_estimator)
 
+    def add_docs(self, docs, fit_label_estimator=True,
+                 progress_cb=dummy_progress_cb):
+        """
+        Add or update many documents at once. Their content is extracted by
+        a pool of 'procs' processes.
+        """
+        docs = list(docs)
+        docs_by_id = {doc.docid: doc for doc in docs}
+        if self.__pool is None:
+            self.__pool = WorkerPool(max(1, self.procs - 1))
+        args = [(doc.path, doc.docid, doc.doctype) for doc in docs]
+
+        indexed = []
+        doc_labels = set()
+        results = self.__pool.imap_unordered(_extract_doc_index_data, args)
+        try:
+            for (progression, (docid, data)) in enumerate(results):
+                doc = docs_by_id[docid]
+                progress_cb(progression, len(docs),
+                            DocSearch.INDEX_STEP_READING, doc)
+                if data is None:
+                    continue
+                logger.info("Indexing doc: %s" % doc)
+                get_file_hash_cache().update(data['file_hashes'])
+                for (name, color) in data['catalog_entry']['labels']:
+                    doc_labels.add(Label(name=name, color=color))
+                self._write_doc_index_data(self.writer, data)
+                indexed.append(doc)
+        finally:
+            # stops the workers if the results have not all been read
+            results.close()
+
+        self._update_labels(doc_labels, fit_label_estimator)
+        if fit_label_estimator and indexed:
+            self.docsearch.fit_label_estimator(indexed)
+        self.__need_reload = True
+
+    def __close_pool(self):
+        if self.__pool is None:
+            return
+        self.__pool.close()
+        self.__pool = None
+
     def del_doc(self, docid, fit_label_estimator=True):
         """
         Delete a document
@@ -274,6 +554,12 @@ class DocIndexUpdater(GObject.GObject):
         """
         logger.info("Removing doc from the index: %s" % docid)
         self._delete_doc_from_index(self.writer, docid)
+        self.page_writer.delete_by_term('docid', unicode(docid))
+        get_file_hash_cache().forget(
+            os.path.join(self.docsearch.rootdir, docid))
+        self.__catalog_changes[docid] = None
+        self.__near_duplicate_changes[docid] = None
+        self.__similarity_changes[docid] = None
         self.__need_reload = True
 
     def commit(self):
@@ -281,9 +567,19 @@ class DocIndexUpdater(GObject.GObject):
         Apply the changes to the index
         """
         logger.info("Index: Commiting changes and saving estimators")
+        self.__close_pool()
         self.docsearch.save_label_estimators()
+        get_file_hash_cache().save(self.docsearch.rootdir)
         self.writer.commit()
+        self.page_writer.commit()
         del self.writer
+        del self.page_writer
+        self.docsearch.update_catalog(self.__catalog_changes)
+        self.__catalog_changes = {}
+        self.docsearch.update_near_duplicates(self.__near_duplicate_changes)
+        self.__near_duplicate_changes = {}
+        self.docsearch.update_similarity_index(self.__similarity_changes)
+        self.__similarity_changes = {}
         self.docsearch.reload_searcher()
         if self.__need_reload:
             logger.info("Index: Reloading ...")
@@ -294,8 +590,11 @@ class DocIndexUpdater(GObject.GObject):
         Forget about the changes
         """
         logger.info("Index: Index update cancelled")
+        self.__close_pool()
         self.writer.cancel()
+        self.page_writer.cancel()
         del self.writer
+        del self.page_writer
 
 
 class DocSearch(object):
@@ -323,17 +622,34 @@ class DocSearch(object):
         date=whoosh.fields.DATETIME(stored=True),
         last_read=whoosh.fields.DATETIME(stored=True),
     )
+    # One entry per page. Used to find the pages matching a search in a
+    # given document
+    PAGE_WHOOSH_SCHEMA = whoosh.fields.Schema(
+        pageid=whoosh.fields.ID(stored=True, unique=True),
+        docid=whoosh.fields.ID(stored=True),
+        page_nb=whoosh.fields.NUMERIC(stored=True),
+        content=whoosh.fields.TEXT(),
+    )
     LABEL_ESTIMATOR_TEMPLATE = PassiveAggressiveClassifier(n_iter=50)
+    # maximum number of documents given at once to an estimator
+    FIT_BATCH_SIZE = 1000
+    # maximum memory used by the search results cache (bytes)
+    QUERY_CACHE_MAX_SIZE = 4 * 1024 * 1024
 
     """
-    Label_estimators is a dict with one estimator per label.
+    Label_estimators is a dict-like store with one estimator per label
+    (see labelestimators.LabelEstimatorStore).
     Each label is predicted with its own estimator (OneVsAll strategy)
     We cannot use directly OneVsAllClassifier sklearn class because
     it doesn't support online learning (partial_fit)
+    For prediction, they are consolidated in a single coefficient matrix
+    (see __get_label_model())
     """
     label_estimators = {}
 
-    def __init__(self, rootdir, callback=dummy_progress_cb):
+    def __init__(self, rootdir, callback=dummy_progress_cb,
+                 query_cache_max_size=QUERY_CACHE_MAX_SIZE,
+                 docfilehash_bloom_filter=False):
         """
         Index files in rootdir (see constructor)
 
@@ -345,8 +661,26 @@ class DocSearch(object):
                 total : number of elements to do
                 document (only if step == DocSearch.INDEX_STEP_READING): file
                     being read
+            query_cache_max_size --- memory used by the search results cache
+                (bytes). 0 disables it.
+            docfilehash_bloom_filter --- if True, the file hashes of the
+                documents are kept in memory in a Bloom filter instead of a
+                set (see is_hash_in_index())
         """
         self.rootdir = rootdir
+        self.__docfilehash_bloom_filter = docfilehash_bloom_filter
+        self.__docfilehashes = None  # loaded on-the-fly
+        self.__docfilehashes_lock = threading.Lock()
+        # all the label estimators in a single matrix (see
+        # __get_label_model()). Rebuilt on-the-fly when they change
+        self.__label_model = None
+        # the model is built and reset from different threads
+        self.__label_model_lock = threading.Lock()
+        # bumped each time the searcher is reloaded. Search results cached
+        # for previous generations are never used.
+        self.__generation = 0
+        self.query_cache = LRUCache(query_cache_max_size,
+                                    weigh=self.__weigh_query_cache_entry)
         base_indexdir = os.getenv("XDG_DATA_HOME",
                                   os.path.expanduser("~/.local/share"))
         self.indexdir = os.path.join(base_indexdir, "paperwork", "index")
@@ -354,6 +688,22 @@ class DocSearch(object):
 
         self.__docs_by_id = {}  # docid --> doc
         self.label_list = []
+        self.catalog = DocCatalog(self.indexdir)
+        # loaded on-the-fly (see __get_near_duplicates())
+        self.near_duplicates = NearDuplicateIndex(self.indexdir)
+        self.__near_duplicates_loaded = False
+        self.__near_duplicates_lock = threading.Lock()
+        # loaded on-the-fly (see __get_similarity_index())
+        self.similarity_index = SimilarityIndex(self.indexdir,
+                                                BasicDoc.FEATURES_VER)
+        self.__similarity_index_loaded = False
+        self.__similarity_index_lock = threading.Lock()
+        # generation for which the missing vectors have been computed (see
+        # __refresh_similarity_index())
+        self.__similarity_generation = None
+        # docid --> fingerprint of the documents whose similarity vector
+        # can't be computed. They are not tried again until they change.
+        self.__similarity_failures = {}
 
         need_index_rewrite = True
         try:
@@ -368,13 +718,42 @@ class DocSearch(object):
             logger.warning("Failed to open index '%s'" % self.indexdir)
             logger.warning("Exception was: %s" % str(exc))
 
+        self.page_indexdir = os.path.join(base_indexdir, "paperwork",
+                                          "page_index")
+        mkdir_p(self.page_indexdir)
+        try:
+            logger.info("Opening page index dir '%s' ..." % self.page_indexdir)
+            self.page_index = whoosh.index.open_dir(self.page_indexdir)
+            if str(self.page_index.schema) != str(self.PAGE_WHOOSH_SCHEMA):
+                raise whoosh.index.EmptyIndexError("Schema not up-to-date")
+        except whoosh.index.EmptyIndexError, exc:
+            logger.warning("Failed to open page index '%s'"
+                           % self.page_indexdir)
+            logger.warning("Exception was: %s" % str(exc))
+            self.page_index = whoosh.index.create_in(self.page_indexdir,
+                                                     self.PAGE_WHOOSH_SCHEMA)
+            # the pages of the documents already indexed are missing
+            need_index_rewrite = True
+
         if need_index_rewrite:
             logger.info("Creating a new index")
             self.index = whoosh.index.create_in(self.indexdir,
                                                 self.WHOOSH_SCHEMA)
+            self.page_index = whoosh.index.create_in(self.page_indexdir,
+                                                     self.PAGE_WHOOSH_SCHEMA)
+            self.catalog.destroy()
+            self.near_duplicates.destroy()
+            self.__near_duplicates_loaded = True
+            self.similarity_index.destroy()
+            self.__similarity_index_loaded = True
             logger.info("Index '%s' created" % self.indexdir)
 
         self.__searcher = self.index.searcher()
+        self.__page_searcher = self.page_index.searcher()
+        self.__page_query_parser = whoosh.qparser.QueryParser(
+            "content", schema=self.page_index.schema,
+            termclass=whoosh.query.Prefix, group=whoosh.qparser.OrGroup)
+        self.__correctors = {}  # fieldname --> corrector
 
         class CustomFuzzy(whoosh.qparser.query.FuzzyTerm):
             def __init__(self, fieldname, text, boost=1.0, maxdist=1,
@@ -387,6 +766,13 @@ class DocSearch(object):
         facets = [whoosh.sorting.ScoreFacet(),
                   whoosh.sorting.FieldFacet("date", reverse=True)]
 
+        # sortings available for find_documents_page(): sort name --> None
+        # (keep the order of find_documents()) or arguments of sorted()
+        self.search_sortings = {
+            'relevance': None,
+            'scan_date': {'reverse': True},  # document ids are scan dates
+        }
+
         self.search_param_list = {
             'full': [
                 {
@@ -417,37 +803,18 @@ class DocSearch(object):
 
         self.label_estimators_dir = os.path.join(
             base_indexdir, "paperwork", "label_estimators")
-        self.label_estimators_file = os.path.join(
-            self.label_estimators_dir, "label_estimators.jbl")
-        try:
-            logger.info("Opening label_estimators file '%s' ..." %
-                        self.label_estimators_file)
-            (l_estimators, ver) = joblib.load(self.label_estimators_file)
-            if ver != BasicDoc.FEATURES_VER:
-                logger.info("Estimator version is not up to date")
-                self.label_estimators = {}
-            else:
-                self.label_estimators = l_estimators
-
-            # check that the label_estimators are up to date for their class
-            for label_name in self.label_estimators:
-                params = self.label_estimators[label_name].get_params()
-                if params != self.LABEL_ESTIMATOR_TEMPLATE.get_params():
-                    raise IndexError('label_estimators params are not up to'
-                                     + ' date')
-        except Exception, exc:
-            logger.error(("Failed to open label_estimator file '%s', or bad"
-                          + " label_estimator structure") % self.indexdir)
-            logger.error("Exception was: %s" % exc)
-            logger.info("Will create new label_estimators")
-            self.label_estimators = {}
+        logger.info("Opening label estimators in '%s' ..." %
+                    self.label_estimators_dir)
+        self.label_estimators = LabelEstimatorStore(
+            self.label_estimators_dir, BasicDoc.FEATURES_VER,
+            self.LABEL_ESTIMATOR_TEMPLATE)
+        self.__reset_label_model()
 
     def save_label_estimators(self):
-        if not os.path.exists(self.label_estimators_dir):
-            os.mkdir(self.label_estimators_dir)
-        joblib.dump((self.label_estimators, BasicDoc.FEATURES_VER),
-                    self.label_estimators_file,
-                    compress=0)
+        """
+        Write the label estimators that changed on the disk
+        """
+        self.label_estimators.save()
 
     def check_workdir(self):
         """
@@ -462,7 +829,7 @@ class DocSearch(object):
         """
         return DocDirExaminer(self)
 
-    def get_index_updater(self, optimize=True):
+    def get_index_updater(self, optimize=True, procs=1):
         """
         Return an object useful to update the content of the index
 
@@ -470,8 +837,12 @@ class DocSearch(object):
         made to modify the documents themselves.
         Some helper methods, with more specific goals, may be available for
         what you want to do.
+
+        Arguments:
+            procs --- number of processes to use for bulk updates (see
+                DocIndexUpdater.add_docs())
         """
-        return DocIndexUpdater(self, optimize)
+        return DocIndexUpdater(self, optimize, procs=procs)
 
     def fit_label_estimator(self, docs=None, removed_label=None, labels=None,
                             callback=dummy_progress_cb):
@@ -506,73 +877,178 @@ class DocSearch(object):
                     DocSearch.LABEL_ESTIMATOR_TEMPLATE
                 )
 
-        i = 0
-        total = len(docs)
-        for doc in docs:
-            logger.info("Fitting estimator with doc: %s " % doc)
-            callback(i, total, step=self.LABEL_STEP_UPDATING, doc=doc)
+        # gather the features of all the documents first, and then fit each
+        # estimator with a few big batches
+        # fit only with labelled documents
+        labelled_docs = [doc for doc in docs if doc.labels]
+        unlabelled_docs = []
+        if removed_label:
+            unlabelled_docs = [doc for doc in docs if not doc.labels]
+
+        def features_cb(progression, total, step=None, doc=None):
+            callback(progression, total, step=self.LABEL_STEP_UPDATING,
+                     doc=doc)
+
+        # Don't use True or False for the classes as it raises a casting bug
+        # in underlying library
+        classes = numpy.array(['labelled', 'unlabelled'])
+
+        if labelled_docs:
+            logger.info("Fitting estimators with %d docs"
+                        % len(labelled_docs))
+            features = get_docs_features(labelled_docs,
+                                         progress_cb=features_cb)
+            labelled_docs_labels = [
+                set([label.name for label in doc.labels])
+                for doc in labelled_docs
+            ]
+            for label_name in label_name_set:
+                # check for this estimator if each document is labelled
+                # or not
+                targets = numpy.array([
+                    'labelled' if label_name in doc_labels else 'unlabelled'
+                    for doc_labels in labelled_docs_labels
+                ])
+                self.__partial_fit(self.label_estimators[label_name],
+                                   features, targets, classes)
+                self.label_estimators.mark_dirty(label_name)
+
+        if unlabelled_docs:
+            features = get_docs_features(unlabelled_docs,
+                                         progress_cb=features_cb)
+            targets = numpy.array(['unlabelled'] * features.shape[0])
+            self.__partial_fit(self.label_estimators[removed_label.name],
+                               features, targets, classes)
+            self.label_estimators.mark_dirty(removed_label.name)
+
+        self.__reset_label_model()
+
+    def __partial_fit(self, estimator, features, targets, classes):
+        """
+        Fit an estimator with batches of at most FIT_BATCH_SIZE documents
+        """
+        for start in xrange(0, features.shape[0], self.FIT_BATCH_SIZE):
+            end = start + self.FIT_BATCH_SIZE
+            estimator.partial_fit(features[start:end], targets[start:end],
+                                  classes)
             time.sleep(0)  # give CPU time to other threads
-            i += 1
-            # fit only with labelled documents
-            if doc.labels:
-                for label_name in label_name_set:
-                    # check for this estimator if the document is labelled
-                    # or not
-                    doc_has_label = 'unlabelled'
-                    for label in doc.labels:
-                        if label.name == label_name:
-                            doc_has_label = 'labelled'
-                            break
-
-                    # fit the estimators with the model class (labelled
-                    # or unlabelled). Don't use True or False for the classes
-                    # as it raises a casting bug in underlying library
-                    l_estimator = self.label_estimators[label_name]
-                    l_estimator.partial_fit(
-                        doc.get_features(), [doc_has_label],
-                        numpy.array(['labelled', 'unlabelled'])
-                    )
-            elif removed_label:
-                l_estimator = self.label_estimators[removed_label.name]
-                l_estimator.partial_fit(
-                    doc.get_features(), ['unlabelled'],
-                    numpy.array(['labelled', 'unlabelled'])
-                )
 
-    def predict_label_list(self, doc, progress_cb=dummy_progress_cb):
+    def __reset_label_model(self):
         """
-        return a prediction of label names
+        Must be called each time the label estimators change
         """
-        if doc.nb_pages <= 0:
-            return []
+        with self.__label_model_lock:
+            self.__label_model = None
+
+    def __get_label_model(self):
+        """
+        Consolidate all the fitted label estimators in a single model, so
+        the labels of many documents can be predicted with a single matrix
+        product.
+
+        Returns:
+            (label_names, coefs, intercepts), or None if prediction is not
+            possible. 'coefs' is a (nb_features x nb_labels) matrix. A
+            positive score means the document should have the label.
+        """
+        with self.__label_model_lock:
+            if self.__label_model is None:
+                self.__label_model = self.__build_label_model()
+            return self.__label_model
 
+    def __build_label_model(self):
+        """
+        See __get_label_model()
+        """
         # if there is only one label, or not enough document fitted prediction
         # is not possible
         if len(self.label_estimators) < 2:
-            return []
-
-        predicted_label_list = []
-        label_names = self.label_estimators.keys()
-
-        for label_name_idx in xrange(0, len(label_names)):
-            progress_cb(label_name_idx, len(label_names))
+            return None
 
-            label_name = label_names[label_name_idx]
-            features = doc.get_features()
+        label_names = []
+        coefs = []
+        intercepts = []
+        for (label_name, estimator) in self.label_estimators.iteritems():
             # check that the estimator will not throw an error because its
             # not fitted
-            if self.label_estimators[label_name].coef_ is None:
+            if getattr(estimator, 'coef_', None) is None:
                 logger.warning("Label estimator '%s' not fitted yet"
                                % label_name)
                 continue
-            prediction = self.label_estimators[label_name].predict(features)
-            if prediction == 'labelled':
-                predicted_label_list.append(label_name)
-            logger.debug("%s %s %s with decision %s "
-                         % (doc, prediction, label_name,
-                            self.label_estimators[label_name].
-                            decision_function(features)))
-        return predicted_label_list
+            if coefs and estimator.coef_.shape[1] != coefs[0].shape[0]:
+                logger.warning("Label estimator '%s' doesn't use the same"
+                               " features as the others" % label_name)
+                continue
+            # decision_function() > 0 means classes_[1]
+            sign = 1.0 if estimator.classes_[1] == 'labelled' else -1.0
+            label_names.append(label_name)
+            coefs.append(sign * estimator.coef_[0])
+            intercepts.append(sign * estimator.intercept_[0])
+
+        if not label_names:
+            return None
+
+        return (label_names, numpy.column_stack(coefs),
+                numpy.array(intercepts))
+
+    def predict_label_scores(self, docs, progress_cb=dummy_progress_cb):
+        """
+        Score each label for each of the given documents
+
+        Arguments:
+            docs --- a list of documents
+            progress_cb --- called with (current, total) while gathering
+                the features of the documents
+
+        Returns:
+            One list per document: [(label_name, score), ...], sorted by
+            decreasing score. A positive score means the label is
+            probably appropriate.
+        """
+        scores = [[] for doc in docs]
+        model = self.__get_label_model()
+        if model is None:
+            return scores
+        (label_names, coefs, intercepts) = model
+
+        doc_idxs = [doc_idx for (doc_idx, doc) in enumerate(docs)
+                    if doc.nb_pages > 0]
+        if not doc_idxs:
+            return scores
+
+        def features_cb(progression, total, step=None, doc=None):
+            progress_cb(progression, total)
+
+        features = get_docs_features([docs[doc_idx] for doc_idx in doc_idxs],
+                                     progress_cb=features_cb)
+        doc_scores = numpy.asarray(features.dot(coefs)) + intercepts
+
+        for (row, doc_idx) in enumerate(doc_idxs):
+            label_scores = [(label_name, float(score))
+                            for (label_name, score)
+                            in zip(label_names, doc_scores[row])]
+            label_scores.sort(key=lambda x: x[1], reverse=True)
+            logger.debug("%s: label scores: %s" % (docs[doc_idx],
+                                                   label_scores))
+            scores[doc_idx] = label_scores
+        return scores
+
+    def predict_label_lists(self, docs, progress_cb=dummy_progress_cb):
+        """
+        Returns:
+            One list of predicted label names per document (best ones
+            first)
+        """
+        return [
+            [label_name for (label_name, score) in label_scores if score > 0]
+            for label_scores in self.predict_label_scores(docs, progress_cb)
+        ]
+
+    def predict_label_list(self, doc, progress_cb=dummy_progress_cb):
+        """
+        return a prediction of label names
+        """
+        return self.predict_label_lists([doc], progress_cb)[0]
 
     def __inst_doc(self, docid, doc_type_name=None):
         """
@@ -616,9 +1092,100 @@ class DocSearch(object):
         self.__docs_by_id[docid] = doc
         return doc
 
+    def __inst_doc_from_catalog(self, docid, entry):
+        """
+        Instantiate a document based on its catalog entry. Doesn't touch
+        the document files.
+        """
+        docpath = os.path.join(self.rootdir, docid)
+        doc = None
+        for (is_doc_type, doc_type_name, doc_type) in DOC_TYPE_LIST:
+            if doc_type_name == entry['doctype']:
+                doc = doc_type(docpath, docid)
+                break
+        if doc is None:
+            logger.warning(("Warning: unknown doc type found in the catalog:"
+                            + " %s") % entry['doctype'])
+            return self.__inst_doc(docid)
+        labels = [Label(name=name, color=color)
+                  for (name, color) in entry['labels']]
+        doc.preload_cache(nb_pages=entry['nb_pages'], labels=labels)
+        return doc
+
+    def __rebuild_catalog(self, progress_cb=dummy_progress_cb):
+        """
+        Rebuild the document catalog from the content of the index.
+        Slow: each document must be looked at.
+        """
+        logger.info("Rebuilding the document catalog ...")
+        self.catalog.entries = {}
+
+        query = whoosh.query.Every()
+        results = self.__searcher.search(query, limit=None)
+
+        nb_results = len(results)
+        progress = 0
+
+        for result in results:
+            docid = result['docid']
+            doc = self.__inst_doc(docid, result['doctype'])
+            if doc is None:
+                continue
+            progress_cb(progress, nb_results, self.INDEX_STEP_LOADING, doc)
+            self.catalog[docid] = {
+                'doctype': doc.doctype,
+                'date': result['date'].strftime("%Y-%m-%d"),
+                # unknown ; would require opening the doc. Will be set when
+                # examined (see update_catalog_fingerprints())
+                'nb_pages': None,
+                'labels': [(label.name, label.get_color_str())
+                           for label in doc.labels],
+                'last_mod': (time.mktime(result['last_read'].timetuple())
+                             + (result['last_read'].microsecond / 1e6)),
+                'docfilehash': result['docfilehash'],
+                'fingerprint': None,  # unknown ; will be set when examined
+            }
+            progress += 1
+
+        self.catalog.save(self.index.latest_generation())
+
+    def update_catalog_fingerprints(self, fingerprints):
+        """
+        Update the fingerprints (and the numbers of pages) of documents that
+        haven't been modified (see DocDirExaminer) and write the catalog on
+        the disk.
+
+        Arguments:
+            fingerprints --- dict: docid --> (fingerprint, nb_pages)
+        """
+        for (docid, (fingerprint, nb_pages)) in fingerprints.iteritems():
+            if docid in self.catalog:
+                self.catalog[docid]['fingerprint'] = fingerprint
+                self.catalog[docid]['nb_pages'] = nb_pages
+        self.catalog.save(self.catalog.generation)
+
+    def update_catalog(self, changes):
+        """
+        Apply changes to the document catalog and write it on the disk.
+        Must be called each time the index has been commited.
+
+        Arguments:
+            changes --- dict: docid --> catalog entry (None if the document
+                        has been deleted)
+        """
+        for (docid, entry) in changes.iteritems():
+            if entry is None:
+                del self.catalog[docid]
+            else:
+                self.catalog[docid] = entry
+                if self.__docfilehashes is not None:
+                    self.__docfilehashes.add(entry['docfilehash'])
+        self.catalog.save(self.index.latest_generation())
+
     def reload_index(self, progress_cb=dummy_progress_cb):
         """
-        Read the index, and load the document list from it
+        Read the document catalog (or the index if the catalog is not up to
+        date), and load the document list from it
         """
         docs_by_id = self.__docs_by_id
         self.__docs_by_id = {}
@@ -626,20 +1193,20 @@ class DocSearch(object):
             doc.drop_cache()
         del docs_by_id
 
-        query = whoosh.query.Every()
-        results = self.__searcher.search(query, limit=None)
+        generation = self.index.latest_generation()
+        if (self.catalog.generation != generation
+                and not self.catalog.load(generation)):
+            self.__rebuild_catalog(progress_cb)
 
-        nb_results = len(results)
+        nb_docs = len(self.catalog)
         progress = 0
         labels = set()
 
-        for result in results:
-            docid = result['docid']
-            doctype = result['doctype']
-            doc = self.__inst_doc(docid, doctype)
+        for (docid, entry) in self.catalog.iteritems():
+            doc = self.__inst_doc_from_catalog(docid, entry)
             if doc is None:
                 continue
-            progress_cb(progress, nb_results, self.INDEX_STEP_LOADING, doc)
+            progress_cb(progress, nb_docs, self.INDEX_STEP_LOADING, doc)
             self.__docs_by_id[docid] = doc
             for label in doc.labels:
                 labels.add(label)
@@ -696,14 +1263,104 @@ class DocSearch(object):
         Returns:
             An array of document (doc objects)
         """
-        sentence = sentence.strip()
+        sentence = u" ".join(sentence.split())
         sentence = strip_accents(sentence)
 
         if sentence == u"":
             return self.docs
 
-        result_list_list = []
-        total_results = 0
+        docids = self.__get_docids(sentence, limit, must_sort, search_type)
+        docs = [self.__docs_by_id.get(docid) for docid in docids]
+        return [doc for doc in docs if doc is not None]
+
+    def find_documents_page(self, sentence, page_nb=0, page_len=100,
+                            sort='relevance', search_type='full'):
+        """
+        Returns only one page of the documents matching the given keywords.
+        Pages are cut out of the results of find_documents() (cached until
+        the searcher is reloaded), so only the documents of the requested
+        page are instantiated.
+
+        Arguments:
+            sentence --- a sentenced query
+            page_nb --- page to return (starts at 0)
+            page_len --- number of documents per page
+            sort --- 'relevance' or 'scan_date' (see search_sortings). If
+                the sentence is empty, documents are always sorted by scan
+                date.
+        Returns:
+            (documents, total number of matching documents)
+        """
+        sentence = u" ".join(sentence.split())
+        sentence = strip_accents(sentence)
+
+        if sentence == u"":
+            docids = sorted(self.__docs_by_id.keys(), reverse=True)
+        else:
+            sorting = self.search_sortings[sort]
+            docids = self.__get_docids(sentence, None, True, search_type)
+            if sorting is not None:
+                cache_key = (self.__generation, sentence, search_type, sort)
+                sorted_docids = self.query_cache.get(cache_key)
+                if sorted_docids is None:
+                    sorted_docids = tuple(sorted(docids, **sorting))
+                    self.query_cache.put(cache_key, sorted_docids)
+                docids = sorted_docids
+
+        total = len(docids)
+        docids = docids[page_nb * page_len:(page_nb + 1) * page_len]
+        docs = [self.__docs_by_id.get(docid) for docid in docids]
+        return ([doc for doc in docs if doc is not None], total)
+
+    def find_pages(self, sentence, doc):
+        """
+        Look for the pages of a document matching at least one of the given
+        keywords.
+
+        Returns:
+            A sorted list of page numbers, or None if the document is not
+            indexed
+        """
+        if doc.docid not in self.catalog:
+            return None
+        sentence = strip_accents(sentence.strip())
+        if sentence == u"":
+            return []
+        query = self.__page_query_parser.parse(sentence)
+        results = self.__page_searcher.search(
+            query, limit=None,
+            filter=whoosh.query.Term("docid", unicode(doc.docid)))
+        return sorted([result['page_nb'] for result in results])
+
+    @staticmethod
+    def __weigh_query_cache_entry(docids):
+        return (sys.getsizeof(docids)
+                + sum([sys.getsizeof(docid) for docid in docids]))
+
+    def __get_docids(self, sentence, limit, must_sort, search_type):
+        """
+        Look for the documents matching the given sentence, or get them from
+        the search results cache.
+
+        Returns:
+            A tuple of document ids
+        """
+        cache_key = (self.__generation, sentence, search_type, must_sort,
+                     limit)
+        docids = self.query_cache.get(cache_key)
+        if docids is None:
+            docids = self.__find_documents(sentence, limit, must_sort,
+                                           search_type)
+            self.query_cache.put(cache_key, docids)
+        return docids
+
+    def __find_documents(self, sentence, limit, must_sort, search_type):
+        """
+        Returns:
+            A tuple of document ids
+        """
+        ranked_lists = []
+        found = set()
 
         for query_parser in self.search_param_list[search_type]:
             query = query_parser["query_parser"].parse(sentence)
@@ -714,65 +1371,124 @@ class DocSearch(object):
                 result_list = self.__searcher.search(
                     query, limit=limit)
 
-            result_list_list.append(result_list)
-            total_results += len(result_list)
+            docids = [result['docid'] for result in result_list]
+            docids = [docid for docid in docids if docid in self.__docs_by_id]
+            ranked_lists.append(docids)
+            found.update(docids)
 
-            if not must_sort and total_results >= limit:
+            if (not must_sort and limit is not None
+                    and len(found) >= limit):
                 break
 
-        # merging results
-        results = result_list_list[0]
-        for result_intermediate in result_list_list[1:]:
-            results.extend(result_intermediate)
+        if must_sort:
+            return tuple(fuse_ranked_lists(ranked_lists, limit))
 
-        docs = [self.__docs_by_id.get(result['docid']) for result in results]
-        try:
-            while True:
-                docs.remove(None)
-        except ValueError:
-            pass
-        assert (None not in docs)
+        # no specific order required: simply concatenate the lists
+        docids = []
+        seen = set()
+        for ranked_list in ranked_lists:
+            for docid in ranked_list:
+                if docid in seen:
+                    continue
+                seen.add(docid)
+                docids.append(docid)
+                if limit is not None and len(docids) >= limit:
+                    return tuple(docids)
+        return tuple(docids)
 
-        if limit is not None:
-            docs = docs[:limit]
+    def __get_corrector(self, fieldname):
+        """
+        Correctors are kept until the searcher is reloaded
+        """
+        if fieldname not in self.__correctors:
+            self.__correctors[fieldname] = self.__searcher.corrector(fieldname)
+        return self.__correctors[fieldname]
 
-        return docs
+    def __get_keyword_docnums(self, keyword, cache):
+        """
+        Look for the documents matching a single keyword (same rules as a
+        'fast' search).
+
+        Arguments:
+            cache --- dict keyword --> result. Avoid looking twice for the
+                same keyword.
+
+        Returns:
+            A set of document numbers (see Whoosh), or None if the keyword
+            doesn't restrict the search (empty keyword, stop word, ...)
+        """
+        if keyword in cache:
+            return cache[keyword]
+        query_parser = self.search_param_list['fast'][0]["query_parser"]
+        query = query_parser.parse(strip_accents(keyword))
+        if query is whoosh.query.NullQuery:
+            docnums = None
+        else:
+            docnums = set(self.__searcher.docs_for_query(query))
+        cache[keyword] = docnums
+        return docnums
 
     def find_suggestions(self, sentence):
         """
         Search all possible suggestions. Suggestions returned always have at
         least one document matching.
 
+        Each keyword is looked up only once in the index. Suggestions are
+        validated by intersecting the sets of documents matching each of
+        their keywords.
+
         Arguments:
             sentence --- keywords (single strings) for which we want
                 suggestions
         Return:
             An array of sets of keywords. Each set of keywords (-> one string)
-            is a suggestion.
+            is a suggestion. The suggestions matching the most documents come
+            first.
         """
         keywords = sentence.split(" ")
-        final_suggestions = []
+        cache = {}
+        keywords_docnums = [self.__get_keyword_docnums(keyword, cache)
+                            for keyword in keywords]
+        suggestions = {}  # suggestion --> number of matching documents
 
-        corrector = self.__searcher.corrector("content")
-        label_corrector = self.__searcher.corrector("label")
+        corrector = self.__get_corrector("content")
+        label_corrector = self.__get_corrector("label")
         for keyword_idx in range(0, len(keywords)):
             keyword = keywords[keyword_idx]
             if (len(keyword) <= MIN_KEYWORD_LEN):
                 continue
+
+            # documents matching all the other keywords
+            others_docnums = None
+            for (idx, docnums) in enumerate(keywords_docnums):
+                if idx == keyword_idx or docnums is None:
+                    continue
+                if others_docnums is None:
+                    others_docnums = docnums
+                else:
+                    others_docnums = others_docnums.intersection(docnums)
+            if others_docnums is not None and len(others_docnums) <= 0:
+                continue
+
             keyword_suggestions = label_corrector.suggest(keyword, limit=2)[:]
             keyword_suggestions += corrector.suggest(keyword, limit=5)[:]
             for keyword_suggestion in keyword_suggestions:
+                docnums = self.__get_keyword_docnums(keyword_suggestion,
+                                                     cache)
+                if docnums is None:
+                    continue
+                if others_docnums is not None:
+                    docnums = docnums.intersection(others_docnums)
+                if len(docnums) <= 0:
+                    continue
                 new_suggestion = keywords[:]
                 new_suggestion[keyword_idx] = keyword_suggestion
                 new_suggestion = u" ".join(new_suggestion)
+                suggestions[new_suggestion] = len(docnums)
 
-                docs = self.find_documents(new_suggestion, limit=1,
-                                           must_sort=False, search_type='fast')
-                if len(docs) <= 0:
-                    continue
-                final_suggestions.append(new_suggestion)
-        final_suggestions.sort()
-        return final_suggestions
+        return sorted(suggestions.keys(),
+                      key=lambda suggestion: (-suggestions[suggestion],
+                                              suggestion))
 
     def create_label(self, label, doc=None, callback=dummy_progress_cb):
         """
@@ -831,9 +1547,10 @@ class DocSearch(object):
         assert(old_label)
         assert(new_label)
         self.label_list.remove(old_label)
-        if old_label.name in self.label_estimators:
-            estimator = self.label_estimators.pop(old_label.name)
+        estimator = self.label_estimators.pop(old_label.name, None)
+        if estimator is not None:
             self.label_estimators[new_label.name] = estimator
+            self.__reset_label_model()
         if new_label not in self.label_list:
             self.label_list.append(new_label)
             self.label_list.sort()
@@ -857,7 +1574,8 @@ class DocSearch(object):
         """
         assert(label)
         self.label_list.remove(label)
-        self.label_estimators.pop(label.name)
+        self.label_estimators.pop(label.name, None)
+        self.__reset_label_model()
         current = 0
         docs = self.docs
         total = len(docs)
@@ -881,6 +1599,11 @@ class DocSearch(object):
         """
         searcher = self.__searcher
         self.__searcher = self.index.searcher()
+        self.__page_searcher = self.page_index.searcher()
+        self.__correctors = {}
+        self.__generation += 1
+        logger.info("Search results cache: %s" % self.query_cache.get_stats())
+        self.query_cache.clear()
         del(searcher)
 
     def destroy_index(self):
@@ -890,14 +1613,259 @@ class DocSearch(object):
         """
         logger.info("Destroying the index ...")
         rm_rf(self.indexdir)
+        rm_rf(self.page_indexdir)
         rm_rf(self.label_estimators_dir)
         logger.info("Done")
 
+    def __get_docfilehashes(self):
+        """
+        Returns:
+            All the file hashes found in the index (a set or a BloomFilter)
+        """
+        with self.__docfilehashes_lock:
+            if self.__docfilehashes is not None:
+                return self.__docfilehashes
+            reader = self.__searcher.reader()
+            if self.__docfilehash_bloom_filter:
+                docfilehashes = BloomFilter(2 * reader.doc_count() + 1024)
+            else:
+                docfilehashes = set()
+            for docfilehash in reader.field_terms('docfilehash'):
+                docfilehashes.add(docfilehash)
+            self.__docfilehashes = docfilehashes
+            return docfilehashes
+
     def is_hash_in_index(self, filehash):
         """
         Check if there is a document using this file hash
+
+        Most of the time, the answer comes from memory. The index is only
+        searched to confirm a positive answer (the lexicon may still contain
+        the hashes of deleted documents, and Bloom filters may give false
+        positives).
         """
         filehash = (u"%X" % filehash)
+        if filehash not in self.__get_docfilehashes():
+            return False
         results = self.__searcher.search(
             whoosh.query.Term('docfilehash', filehash))
+        return not results.is_empty()
+
+    def __get_near_duplicates(self):
+        """
+        Returns:
+            The NearDuplicateIndex, loaded from the disk if required
+        """
+        with self.__near_duplicates_lock:
+            if not self.__near_duplicates_loaded:
+                self.near_duplicates.load()
+                self.__near_duplicates_loaded = True
+            return self.near_duplicates
+
+    def update_near_duplicates(self, changes):
+        """
+        Apply changes to the near-duplicate index and write it on the disk.
+        Must be called each time the index has been commited.
+
+        Arguments:
+            changes --- dict: docid --> (fingerprint, MinHash signature)
+                        (None if the document has been deleted)
+        """
+        if not changes:
+            return
+        near_duplicates = self.__get_near_duplicates()
+        for (docid, entry) in changes.iteritems():
+            if entry is None:
+                near_duplicates.remove(docid)
+            else:
+                near_duplicates.set(docid, entry[0], entry[1])
+        near_duplicates.save()
+
+    def __get_doc_signature(self, doc):
+        """
+        Returns:
+            The MinHash signature of the document. It is taken from the
+            near-duplicate index if it's up-to-date, and computed again
+            otherwise.
+        """
+        near_duplicates = self.__get_near_duplicates()
+        if doc.docid in self.catalog and doc.docid in near_duplicates.entries:
+            fingerprint = self.catalog[doc.docid]['fingerprint']
+            if near_duplicates.get_fingerprint(doc.docid) == fingerprint:
+                return near_duplicates.get_signature(doc.docid)
+        return compute_minhash(strip_accents(doc.get_index_text()))
+
+    def find_near_duplicates(self, doc, threshold=DEFAULT_THRESHOLD):
+        """
+        Find the documents whose text is almost the same than the one of
+        the given document (the document itself doesn't have to be indexed)
+
+        Returns:
+            [(doc, estimated similarity), ...], most similar first
+        """
+        signature = self.__get_doc_signature(doc)
+        if signature is None:
+            return []
+        near_duplicates = self.__get_near_duplicates()
+        results = []
+        for (docid, similarity) in near_duplicates.find_near_duplicates(
+                signature, threshold, exclude=doc.docid):
+            if docid not in self.catalog:
+                continue
+            duplicate = self.get_doc_from_docid(docid)
+            if duplicate is not None:
+                results.append((duplicate, similarity))
+        return results
+
+    def find_duplicate_clusters(self, threshold=DEFAULT_THRESHOLD,
+                                progress_cb=dummy_progress_cb):
+        """
+        Group together all the documents that are near-duplicates of each
+        other. The signatures that are missing or outdated are computed
+        first.
+
+        Returns:
+            A list of clusters (lists of documents, oldest first)
+        """
+        near_duplicates = self.__get_near_duplicates()
+        outdated = [
+            docid for (docid, entry) in self.catalog.iteritems()
+            if near_duplicates.get_fingerprint(docid) != entry['fingerprint']
+            or docid not in near_duplicates.entries
+        ]
+        changes = {}
+        for (progression, docid) in enumerate(outdated):
+            doc = self.get_doc_from_docid(docid)
+            progress_cb(progression, len(outdated), doc=doc)
+            if doc is None:
+                continue
+            changes[docid] = (
+                self.catalog[docid]['fingerprint'],
+                compute_minhash(strip_accents(doc.get_index_text())))
+        for docid in near_duplicates.entries.keys():
+            if docid not in self.catalog:
+                changes[docid] = None
+        self.update_near_duplicates(changes)
+
+        clusters = []
+        for cluster in near_duplicates.find_clusters(threshold):
+            docs = [self.get_doc_from_docid(docid) for docid in cluster]
+            docs = [doc for doc in docs if doc is not None]
+            if len(docs) > 1:
+                docs.sort(key=lambda doc: doc.docid)
+                clusters.append(docs)
+        return clusters
+
+    def __get_similarity_index(self):
+        """
+        Returns:
+            The SimilarityIndex, loaded from the disk if required
+        """
+        with self.__similarity_index_lock:
+            if not self.__similarity_index_loaded:
+                self.similarity_index.load()
+                self.__similarity_index_loaded = True
+            return self.similarity_index
+
+    def update_similarity_index(self, changes):
+        """
+        Apply changes to the similarity index and write it on the disk.
+        Must be called each time the index has been commited.
+
+        Arguments:
+            changes --- dict: docid --> (fingerprint, similarity vector)
+                        (None if the document has been deleted)
+        """
+        if not changes:
+            return
+        similarity_index = self.__get_similarity_index()
+        for (docid, entry) in changes.iteritems():
+            if entry is None or entry[1] is None:
+                similarity_index.remove(docid)
+            else:
+                similarity_index.set(docid, entry[0], entry[1])
+            if entry is not None and entry[1] is None:
+                self.__similarity_failures[docid] = entry[0]
+            else:
+                self.__similarity_failures.pop(docid, None)
+        similarity_index.save()
+
+    def __refresh_similarity_index(self, progress_cb=dummy_progress_cb):
+        """
+        Compute the similarity vectors that are missing or outdated (for
+        instance, right after an upgrade of the features). The documents
+        indexed since are handled by update_similarity_index(), so this is
+        done only once per generation of the index.
+        """
+        generation = self.__generation
+        if self.__similarity_generation == generation:
+            return
+        similarity_index = self.__get_similarity_index()
+        failures = self.__similarity_failures
+        docs = []
+        changes = {}
+        for (docid, entry) in self.catalog.iteritems():
+            fingerprint = entry['fingerprint']
+            if (docid in similarity_index and
+                    similarity_index.fingerprints[docid] == fingerprint):
+                continue
+            if docid in failures and failures[docid] == fingerprint:
+                continue
+            if entry['nb_pages'] == 0:
+                # None means unknown (see __rebuild_catalog())
+                changes[docid] = (fingerprint, None)
+                continue
+            doc = self.get_doc_from_docid(docid)
+            if doc is not None and doc.nb_pages > 0:
+                docs.append(doc)
+            else:
+                changes[docid] = (fingerprint, None)
+        for docid in similarity_index.fingerprints.keys():
+            if docid not in self.catalog:
+                changes[docid] = None
+        if docs:
+            logger.info("Computing the similarity vectors of %d documents"
+                        % len(docs))
+            try:
+                vectors = get_similarity_vectors(
+                    get_docs_features(docs, progress_cb=progress_cb))
+            except Exception, exc:
+                logger.warning("Failed to compute the similarity vectors:"
+                               " %s" % exc)
+                vectors = [None] * len(docs)
+            for (doc, vector) in zip(docs, vectors):
+                changes[doc.docid] = (
+                    self.catalog[doc.docid]['fingerprint'], vector)
+        self.update_similarity_index(changes)
+        self.__similarity_generation = generation
+
+    def find_similar(self, doc, k=10, progress_cb=dummy_progress_cb):
+        """
+        Find the documents that look the most like the given one ("more like
+        this"). The document itself doesn't have to be indexed.
+
+        The first call may have to compute the vectors of the documents
+        indexed by older versions of Paperwork.
+
+        Returns:
+            The 'k' most similar documents: [(doc, similarity), ...], most
+            similar first
+        """
+        self.__refresh_similarity_index(progress_cb)
+        similarity_index = self.__get_similarity_index()
+        vector = similarity_index.get_vector(doc.docid)
+        if vector is None:
+            if (doc.docid in self.__similarity_failures and doc.docid in
+                    self.catalog and self.__similarity_failures[doc.docid]
+                    == self.catalog[doc.docid]['fingerprint']):
+                return []
+            vector = get_doc_similarity_vector(doc)
+            if vector is None:
+                return []
+        results = []
+        for (docid, similarity) in similarity_index.find_similar(
+                vector, k, exclude=doc.docid):
+            similar = self.get_doc_from_docid(docid)
+            if similar is not None:
+                results.append((similar, similarity))
         return results
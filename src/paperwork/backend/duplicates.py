@@ -0,0 +1,286 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Near-duplicate detection: documents with almost the same text (the same
+letter scanned twice, PDFs differing only by their metadata, etc).
+
+Each document gets a MinHash signature computed from the word shingles of
+its text. Signatures are split in bands, and documents sharing at least one
+band end up in the same bucket (locality-sensitive hashing): only the
+documents of a same bucket have to be compared.
+"""
+
+import logging
+import os
+import zlib
+
+import numpy
+from sklearn.externals import joblib
+
+
+logger = logging.getLogger(__name__)
+
+# number of consecutive words in a shingle
+SHINGLE_LEN = 3
+NB_HASHES = 64
+# NB_BANDS * ROWS_PER_BAND == NB_HASHES. With 16 bands of 4 rows, documents
+# with a similarity of 0.8 share a bucket with a probability > 0.999, and
+# documents with a similarity of 0.3 with a probability < 0.13
+NB_BANDS = 16
+ROWS_PER_BAND = NB_HASHES / NB_BANDS
+# minimum estimated similarity between near-duplicates
+DEFAULT_THRESHOLD = 0.8
+
+# hash functions: h(x) = (a * x + b) mod p
+_PRIME = (1 << 31) - 1
+_RANDOM = numpy.random.RandomState(0x5EED)
+_HASH_A = _RANDOM.randint(1, _PRIME, NB_HASHES).astype(numpy.int64)
+_HASH_B = _RANDOM.randint(0, _PRIME, NB_HASHES).astype(numpy.int64)
+# number of shingles hashed at once (bounds the memory used)
+_SHINGLE_CHUNK_SIZE = 4096
+
+
+def get_shingles(text):
+    """
+    Returns:
+        The set of the hashes of all the shingles of the text (32 bits
+        integers)
+    """
+    words = text.lower().split()
+    shingles = set()
+    for idx in xrange(0, len(words) - SHINGLE_LEN + 1):
+        shingle = u" ".join(words[idx:idx + SHINGLE_LEN])
+        shingles.add(zlib.crc32(shingle.encode('utf-8')) & 0x7FFFFFFF)
+    return shingles
+
+
+def compute_minhash(text):
+    """
+    Compute the MinHash signature of a text
+
+    Returns:
+        An array of NB_HASHES integers. None if the text is too short to
+        have a meaningful signature
+    """
+    shingles = get_shingles(text)
+    if not shingles:
+        return None
+    shingles = numpy.fromiter(shingles, dtype=numpy.int64,
+                              count=len(shingles))
+    signature = numpy.empty(NB_HASHES, dtype=numpy.int64)
+    signature.fill(_PRIME)
+    for start in xrange(0, len(shingles), _SHINGLE_CHUNK_SIZE):
+        chunk = shingles[start:start + _SHINGLE_CHUNK_SIZE]
+        hashes = (numpy.outer(_HASH_A, chunk) + _HASH_B[:, None]) % _PRIME
+        signature = numpy.minimum(signature, hashes.min(axis=1))
+    return signature.astype(numpy.uint32)
+
+
+def estimate_similarity(signature_a, signature_b):
+    """
+    Returns:
+        An estimation of the Jaccard similarity between the shingles of the
+        two documents (between 0.0 and 1.0)
+    """
+    return float(numpy.count_nonzero(signature_a == signature_b)) / NB_HASHES
+
+
+class NearDuplicateIndex(object):
+    """
+    MinHash signatures of all the documents, and the locality-sensitive hash
+    table built from them. Stored beside the Whoosh index.
+
+    Each signature is stored with the fingerprint of the document (see
+    catalog.get_doc_fingerprint()) it was computed from, so outdated
+    signatures can be detected.
+
+    Only the signatures are written on the disk: the hash table is rebuilt
+    from them when loading.
+    """
+    FILENAME = "near_duplicates.jbl"
+    VERSION = 1
+    # biggest buckets are not compared pair by pair: each of their documents
+    # is only compared with the first one (see find_clusters())
+    MAX_BUCKET_PAIRWISE = 32
+
+    def __init__(self, indexdir):
+        self.path = os.path.join(indexdir, self.FILENAME)
+        self.entries = {}  # docid --> (fingerprint, signature)
+        self.__buckets = {}  # (band, band content) --> set of docids
+
+    @staticmethod
+    def __get_bucket_keys(signature):
+        return [(band, signature[band * ROWS_PER_BAND:
+                                 (band + 1) * ROWS_PER_BAND].tostring())
+                for band in xrange(0, NB_BANDS)]
+
+    def load(self):
+        self.entries = {}
+        self.__buckets = {}
+        try:
+            content = joblib.load(self.path)
+        except Exception, exc:
+            logger.info("No near-duplicate signatures loaded from '%s': %s"
+                        % (self.path, exc))
+            return
+        if content.get('version') != self.VERSION:
+            return
+        for (docid, fingerprint, has_signature, signature) in zip(
+                content['docids'], content['fingerprints'],
+                content['has_signatures'], content['signatures']):
+            self.set(docid, fingerprint,
+                     signature if has_signature else None)
+        logger.info("Near-duplicate signatures loaded: %d documents"
+                    % len(self.entries))
+
+    def save(self):
+        """
+        Write the signatures on the disk. The file is replaced atomically.
+        """
+        docids = self.entries.keys()
+        signatures = numpy.zeros((len(docids), NB_HASHES), dtype=numpy.uint32)
+        has_signatures = []
+        for (idx, docid) in enumerate(docids):
+            signature = self.entries[docid][1]
+            has_signatures.append(signature is not None)
+            if signature is not None:
+                signatures[idx] = signature
+        content = {
+            'version': self.VERSION,
+            'docids': docids,
+            'fingerprints': [self.entries[docid][0] for docid in docids],
+            'has_signatures': has_signatures,
+            'signatures': signatures,
+        }
+        tmp_path = self.path + ".tmp"
+        # compressed: joblib then writes a single file, which can be renamed
+        joblib.dump(content, tmp_path, compress=3)
+        os.rename(tmp_path, self.path)
+
+    def destroy(self):
+        self.entries = {}
+        self.__buckets = {}
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def get_fingerprint(self, docid):
+        """
+        Returns:
+            The fingerprint of the document when its signature was computed.
+            None if the document has no signature.
+        """
+        if docid not in self.entries:
+            return None
+        return self.entries[docid][0]
+
+    def get_signature(self, docid):
+        if docid not in self.entries:
+            return None
+        return self.entries[docid][1]
+
+    def set(self, docid, fingerprint, signature):
+        """
+        Arguments:
+            signature --- see compute_minhash(). If None, the document is
+                only remembered as having no signature.
+        """
+        self.remove(docid)
+        self.entries[docid] = (fingerprint, signature)
+        if signature is None:
+            return
+        for key in self.__get_bucket_keys(signature):
+            self.__buckets.setdefault(key, set()).add(docid)
+
+    def remove(self, docid):
+        entry = self.entries.pop(docid, None)
+        if entry is None or entry[1] is None:
+            return
+        for key in self.__get_bucket_keys(entry[1]):
+            bucket = self.__buckets[key]
+            bucket.discard(docid)
+            if not bucket:
+                del self.__buckets[key]
+
+    def find_near_duplicates(self, signature, threshold=DEFAULT_THRESHOLD,
+                             exclude=None):
+        """
+        Returns:
+            [(docid, estimated similarity), ...], most similar first
+        """
+        candidates = set()
+        for key in self.__get_bucket_keys(signature):
+            candidates.update(self.__buckets.get(key, ()))
+        candidates.discard(exclude)
+        results = []
+        for docid in candidates:
+            similarity = estimate_similarity(signature,
+                                             self.entries[docid][1])
+            if similarity >= threshold:
+                results.append((docid, similarity))
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results
+
+    def find_clusters(self, threshold=DEFAULT_THRESHOLD):
+        """
+        Group all the near-duplicates together. Only the documents sharing
+        a bucket are compared, so the cost depends on the number of
+        near-duplicates, not on the square of the number of documents.
+
+        Returns:
+            A list of clusters (sets of docids). Documents without
+            near-duplicates are not part of any cluster.
+        """
+        parents = {}  # union-find
+
+        def find(docid):
+            root = docid
+            while parents.get(root, root) != root:
+                root = parents[root]
+            while docid != root:
+                (parents[docid], docid) = (root, parents[docid])
+            return root
+
+        compared = set()
+
+        def compare(docid_a, docid_b):
+            pair = (min(docid_a, docid_b), max(docid_a, docid_b))
+            if pair in compared:
+                return
+            compared.add(pair)
+            if find(docid_a) == find(docid_b):
+                return
+            similarity = estimate_similarity(self.entries[docid_a][1],
+                                             self.entries[docid_b][1])
+            if similarity >= threshold:
+                parents[find(docid_a)] = find(docid_b)
+
+        for bucket in self.__buckets.itervalues():
+            if len(bucket) < 2:
+                continue
+            bucket = sorted(bucket)
+            if len(bucket) <= self.MAX_BUCKET_PAIRWISE:
+                for (idx, docid_a) in enumerate(bucket):
+                    for docid_b in bucket[idx + 1:]:
+                        compare(docid_a, docid_b)
+            else:
+                for docid in bucket[1:]:
+                    compare(bucket[0], docid)
+
+        clusters = {}
+        for docid in set(parents.keys()).union(parents.values()):
+            clusters.setdefault(find(docid), set()).add(docid)
+        return [cluster for cluster in clusters.itervalues()
+                if len(cluster) > 1]
@@ -0,0 +1,237 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Features given to the label estimators. Text features of many documents can
+be computed in a single call, and image features of many pages can be
+extracted at once by a pool of processes (see workerpool).
+"""
+
+import logging
+import multiprocessing
+import threading
+
+import numpy
+import PIL.Image
+from scipy import sparse
+from scipy.sparse.csr import csr_matrix
+from skimage import feature
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from paperwork.backend.util import dummy_progress_cb
+from paperwork.backend.workerpool import WorkerPool
+
+
+logger = logging.getLogger(__name__)
+
+# below this number of pages, the features are extracted by the current
+# process: starting the worker processes would take longer
+MIN_PAGES_FOR_POOL = 8
+# number of text features. Changing it changes the features of all the
+# documents: BasicDoc.FEATURES_VER must be increased too
+TEXT_N_FEATURES = 2 ** 20
+
+_TEXT_VECTORIZERS = {}  # n_features --> HashingVectorizer
+_TEXT_VECTORIZERS_LOCK = threading.Lock()
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _get_pool():
+    """
+    Returns:
+        The pool of worker processes extracting image features. Its workers
+        are started the first time it's used, and kept until the end of the
+        process.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = WorkerPool(multiprocessing.cpu_count())
+        return _POOL
+
+
+def get_text_vectorizer(n_features=TEXT_N_FEATURES):
+    """
+    Returns:
+        The text vectorizer shared by the whole process. HashingVectorizer
+        keeps no state, so a single instance can be used for all the
+        documents.
+    """
+    with _TEXT_VECTORIZERS_LOCK:
+        vectorizer = _TEXT_VECTORIZERS.get(n_features)
+        if vectorizer is None:
+            # norm='l2', analyzer='char_wb', ngram_range=(3,3) are empirical
+            vectorizer = HashingVectorizer(norm='l2', analyzer='char_wb',
+                                           ngram_range=(3, 3),
+                                           n_features=n_features)
+            _TEXT_VECTORIZERS[n_features] = vectorizer
+        return vectorizer
+
+
+def extract_text_features(texts, n_features=TEXT_N_FEATURES):
+    """
+    Compute the text features of many documents at once
+
+    Arguments:
+        texts --- an iterable of unicode strings. It can be a generator: the
+            texts are then never all in memory at the same time
+
+    Returns:
+        A sparse matrix with one row per text
+    """
+    return get_text_vectorizer(n_features).transform(texts).tocsr()
+
+
+def extract_img_features(image):
+    """
+    compute image data to present features for the estimators
+
+    Arguments:
+        image --- page thumbnail (PIL image)
+
+    Returns:
+        A sparse matrix with a single row
+    """
+    image = image.convert('RGB')
+
+    # use the first two channels of color histogram
+    histogram = image.histogram()
+    separated_histo = []
+    separated_histo.append(histogram[0:256])
+    separated_histo.append(histogram[256:256*2])
+    # use the grayscale histogram with a weight of 2
+    separated_histo.append([i*2 for i in image.convert('L').histogram()])
+    separated_flat_histo = []
+    for histo in separated_histo:
+        # flatten histograms
+        window_len = 4
+        s = numpy.r_[
+            histo[window_len-1:0:-1],
+            histo,
+            histo[-1:-window_len:-1]
+        ]
+        w = numpy.ones(window_len, 'd')
+        separated_flat_histo.append(csr_matrix(
+            numpy.convolve(w/w.sum(), s, mode='valid'))
+            .astype(numpy.float64))
+    flat_histo = normalize(sparse.hstack(separated_flat_histo), norm='l1')
+
+    # hog feature extraction
+    # must resize to multiple of 8 because of skimage hog bug
+    hog_features = feature.hog(numpy.array(image.resize((144, 144))
+                                           .convert('L')),
+                               normalise=False)
+    hog_features = csr_matrix(hog_features).astype(numpy.float64)
+    hog_features = normalize(hog_features, norm='l1')
+
+    # concatenate
+    features = sparse.hstack([flat_histo, hog_features * 3])
+
+    return features.tocsr()
+
+
+def _extract_img_features_from_file(args):
+    """
+    Run in the worker processes of extract_pages_img_features()
+
+    Arguments:
+        args --- (page index, thumbnail path)
+
+    Returns:
+        (page index, features). Features are None if the thumbnail couldn't
+        be read
+    """
+    (page_idx, thumb_path) = args
+    try:
+        return (page_idx, extract_img_features(PIL.Image.open(thumb_path)))
+    except Exception, exc:
+        logger.warning("Failed to extract features from '%s': %s"
+                       % (thumb_path, exc))
+        return (page_idx, None)
+
+
+def extract_pages_img_features(pages, procs=None,
+                               progress_cb=dummy_progress_cb):
+    """
+    Extract the image features of many pages at once.
+
+    The thumbnails are (re)generated if required by the calling process,
+    and the features are computed by a pool of worker processes shared by
+    the whole process. Only a few pages per worker are queued at any time.
+
+    Arguments:
+        pages --- a list of pages
+        procs --- if <= 1, the features are extracted by the current
+            process. Otherwise (or if None), the shared pool is used
+            (if there are at least MIN_PAGES_FOR_POOL pages)
+
+    Returns:
+        A sparse matrix with one row per page (same order as 'pages')
+    """
+    pages = list(pages)
+    if not pages:
+        return None
+
+    if (procs is not None and procs <= 1) or len(pages) < MIN_PAGES_FOR_POOL:
+        features = []
+        for (progression, page) in enumerate(pages):
+            progress_cb(progression, len(pages), doc=page.doc)
+            features.append(page.extract_features())
+        return sparse.vstack(features).tocsr()
+
+    args = ((page_idx, page.get_thumbnail_path(page.DEFAULT_THUMB_WIDTH,
+                                               page.DEFAULT_THUMB_HEIGHT))
+            for (page_idx, page) in enumerate(pages))
+    features = [None] * len(pages)
+    results = _get_pool().imap_unordered(_extract_img_features_from_file,
+                                         args)
+    try:
+        for (progression, (page_idx, page_features)) in enumerate(results):
+            page = pages[page_idx]
+            progress_cb(progression, len(pages), doc=page.doc)
+            if page_features is None:
+                page_features = page.extract_features()
+            features[page_idx] = page_features
+    finally:
+        results.close()
+
+    return sparse.vstack(features).tocsr()
+
+
+def get_docs_features(docs, procs=None, progress_cb=dummy_progress_cb):
+    """
+    Get the features of many documents at once (see
+    BasicDoc.get_features()). For the documents whose features are not
+    stored yet, the text features are computed in a single call, and the
+    image features are extracted with extract_pages_img_features().
+
+    Returns:
+        A sparse matrix with one row per document (same order as 'docs')
+    """
+    missing = [doc for doc in docs
+               if doc.nb_pages > 0 and doc.get_cached_features() is None]
+    if missing:
+        logger.info("Extracting features of %d documents" % len(missing))
+        text_features = extract_text_features(
+            doc.get_index_text() for doc in missing)
+        img_features = extract_pages_img_features(
+            [doc.pages[0] for doc in missing], procs, progress_cb)
+        for (row, doc) in enumerate(missing):
+            doc.get_features(text_features=text_features[row],
+                             img_features=img_features[row])
+    return sparse.vstack([doc.get_features() for doc in docs]).tocsr()
@@ -0,0 +1,237 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+File hashing. Files are read by chunks, and their hashes are remembered
+(on the disk too) as long as their size and modification time don't change.
+
+The hashes are stored in the Paperwork data directory
+($XDG_DATA_HOME/paperwork), beside the index directory: they are kept when
+the index is rebuilt. Only the hashes of the files in the work directory are
+written (see FileHashCache.save()).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+from paperwork.backend.util import mkdir_p
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file_content(path):
+    """
+    Compute the SHA256 of a file, without loading it whole in memory
+
+    Returns:
+        The hexadecimal digest
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file_desc:
+        while True:
+            chunk = file_desc.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FileHashCache(object):
+    """
+    Map file path --> (size, mtime, SHA256 hex digest)
+    """
+    FILENAME = "file_hashes.json"
+    VERSION = 1
+    NB_THREADS = 4
+
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__entries = None  # loaded on-the-fly
+        # see pop_new_entries(). Only tracked in the indexing workers
+        self.track_new_entries = False
+        self.__new_entries = {}
+        self.__dirty = False
+        self.__pool = None  # see get_hashes()
+
+    def __load(self):
+        if self.__entries is not None:
+            return
+        self.__entries = {}
+        try:
+            with open(self.path, 'r') as file_desc:
+                content = json.load(file_desc)
+        except (IOError, ValueError), exc:
+            logger.info("No file hashes loaded from '%s': %s"
+                        % (self.path, exc))
+            return
+        if content.get('version') != self.VERSION:
+            return
+        for (path, entry) in content['files'].iteritems():
+            self.__entries[path] = tuple(entry)
+
+    def save(self, rootdir=None):
+        """
+        Write the known hashes on the disk (if they changed)
+
+        Arguments:
+            rootdir --- if not None, the hashes of the files outside of this
+                directory (files imported from elsewhere, for instance) are
+                forgotten: only the hashes of the work directory are kept
+                from one run to the next.
+        """
+        with self.__lock:
+            if not self.__dirty:
+                return
+            if rootdir is not None and self.__entries:
+                prefix = self.__path_key(rootdir) + os.sep
+                self.__entries = dict(
+                    (path, entry)
+                    for (path, entry) in self.__entries.iteritems()
+                    if path.startswith(prefix))
+            content = {
+                'version': self.VERSION,
+                'files': self.__entries,
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as file_desc:
+                json.dump(content, file_desc, separators=(',', ':'))
+            os.rename(tmp_path, self.path)
+            self.__dirty = False
+
+    def __put(self, path, stats, hexdigest):
+        entry = (stats.st_size, stats.st_mtime, hexdigest)
+        with self.__lock:
+            self.__entries[path] = entry
+            if self.track_new_entries:
+                self.__new_entries[path] = entry
+            self.__dirty = True
+
+    @staticmethod
+    def __path_key(path):
+        path = os.path.abspath(path)
+        if not isinstance(path, unicode):
+            path = path.decode('utf-8', 'replace')
+        return path
+
+    def get_hash(self, path):
+        """
+        Returns:
+            The SHA256 of the file, as an integer
+        """
+        with self.__lock:
+            self.__load()
+        key = self.__path_key(path)
+        stats = os.stat(path)
+        entry = self.__entries.get(key)
+        if (entry is not None
+                and entry[0] == stats.st_size and entry[1] == stats.st_mtime):
+            return int(entry[2], 16)
+        hexdigest = hash_file_content(path)
+        self.__put(key, stats, hexdigest)
+        return int(hexdigest, 16)
+
+    def get_hashes(self, paths):
+        """
+        Hash many files at once, using a pool of threads for the files whose
+        hash is not known yet.
+
+        Returns:
+            An array of integers (same order as 'paths')
+        """
+        if len(paths) <= 1:
+            return [self.get_hash(path) for path in paths]
+        with self.__lock:
+            if self.__pool is None:
+                self.__pool = ThreadPool(self.NB_THREADS)
+        return self.__pool.map(self.get_hash, paths)
+
+    def record_copy(self, src_path, dst_path):
+        """
+        The file 'src_path' has been copied to 'dst_path': if the hash of
+        the source is known, no need to compute the one of the copy.
+        """
+        with self.__lock:
+            self.__load()
+        try:
+            src_stats = os.stat(src_path)
+            dst_stats = os.stat(dst_path)
+        except OSError:
+            return
+        entry = self.__entries.get(self.__path_key(src_path))
+        if (entry is None or entry[0] != src_stats.st_size
+                or entry[1] != src_stats.st_mtime
+                or dst_stats.st_size != src_stats.st_size):
+            return
+        self.__put(self.__path_key(dst_path), dst_stats, entry[2])
+
+    def forget(self, dirpath):
+        """
+        Forget the hashes of all the files in the given directory
+        """
+        with self.__lock:
+            self.__load()
+            prefix = self.__path_key(dirpath) + os.sep
+            for path in self.__entries.keys():
+                if path.startswith(prefix):
+                    self.__entries.pop(path)
+                    self.__dirty = True
+
+    def pop_new_entries(self):
+        """
+        Returns:
+            The hashes computed since the last call (only if
+            'track_new_entries' is True). They can be given to another
+            process with update()
+        """
+        with self.__lock:
+            entries = self.__new_entries
+            self.__new_entries = {}
+            return entries
+
+    def update(self, entries):
+        with self.__lock:
+            self.__load()
+            self.__entries.update(entries)
+            if entries:
+                self.__dirty = True
+
+
+_FILE_HASH_CACHE = None
+_FILE_HASH_CACHE_LOCK = threading.Lock()
+
+
+def get_file_hash_cache():
+    """
+    Returns:
+        The FileHashCache shared by the whole process
+    """
+    global _FILE_HASH_CACHE
+    with _FILE_HASH_CACHE_LOCK:
+        if _FILE_HASH_CACHE is None:
+            base_dir = os.getenv("XDG_DATA_HOME",
+                                 os.path.expanduser("~/.local/share"))
+            cache_dir = os.path.join(base_dir, "paperwork")
+            mkdir_p(cache_dir)
+            _FILE_HASH_CACHE = FileHashCache(
+                os.path.join(cache_dir, FileHashCache.FILENAME))
+        return _FILE_HASH_CACHE
@@ -29,6 +29,7 @@ import PIL.Image
 from gi.repository import Poppler
 
 from paperwork.backend.common.doc import BasicDoc
+from paperwork.backend.filehash import get_file_hash_cache
 from paperwork.backend.img.page import ImgPage
 from paperwork.backend.util import image2surface
 from paperwork.backend.util import surface2image
@@ -311,8 +312,9 @@ class ImgDoc(BasicDoc):
             dochash = ''
         else:
             dochash = 0
-            for page in self.pages:
-                dochash ^= page.get_docfilehash()
+            paths = [page.get_doc_file_path() for page in self.pages]
+            for filehash in get_file_hash_cache().get_hashes(paths):
+                dochash ^= filehash
         return dochash
 
     def add_page(self, img, boxes):
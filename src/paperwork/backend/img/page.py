@@ -28,6 +28,10 @@ import logging
 import pyocr
 import pyocr.builders
 
+from paperwork.backend.boxfile import forget_box_file
+from paperwork.backend.boxfile import get_box_file
+from paperwork.backend.boxfile import read_words_file
+from paperwork.backend.boxfile import write_box_file
 from paperwork.backend.common.page import BasicPage
 from paperwork.backend.util import image2surface
 
@@ -43,6 +47,12 @@ class ImgPage(BasicPage):
 
     FILE_PREFIX = "paper."
     EXT_BOX = "words"
+    # binary copy of the box file (see boxfile)
+    EXT_BOX_BIN = "boxes"
+    # plain text of the page, one line per box line. Written with the box
+    # file. The first line contains the modification time and the size of
+    # the box file the text comes from
+    EXT_TXT = "txt"
     EXT_IMG = "jpg"
 
     KEYWORD_HIGHLIGHT = 3
@@ -63,6 +73,69 @@ class ImgPage(BasicPage):
 
     __box_path = property(__get_box_path)
 
+    def __get_box_bin_path(self):
+        """
+        Returns the file path of the binary copy of the box list
+        """
+        return self._get_filepath(self.EXT_BOX_BIN)
+
+    def __get_txt_path(self):
+        """
+        Returns the file path of the plain text of this page
+        """
+        return self._get_filepath(self.EXT_TXT)
+
+    def __read_txt_file(self):
+        """
+        Returns:
+            The lines of the text file, or None if it's missing or if it
+            doesn't come from the current box file
+        """
+        txt_path = self.__get_txt_path()
+        try:
+            words_stats = os.stat(self.__box_path)
+            with codecs.open(txt_path, 'r', encoding='utf-8') as file_desc:
+                txt = file_desc.read()
+        except (IOError, OSError):
+            return None
+        txt = txt.split(u"\n")
+        try:
+            (words_mtime, words_size) = txt[0].split(u" ")
+            if (float(words_mtime) != words_stats.st_mtime
+                    or int(words_size) != words_stats.st_size):
+                return None
+        except ValueError:
+            return None
+        return txt[1:]
+
+    def __write_txt_file(self, txt, words_stats):
+        """
+        Arguments:
+            words_stats --- os.stat() of the box file the text comes from
+        """
+        txt_path = self.__get_txt_path()
+        tmp_path = txt_path + ".tmp"
+        header = u"%r %d" % (words_stats.st_mtime, words_stats.st_size)
+        try:
+            with codecs.open(tmp_path, 'w', encoding='utf-8') as file_desc:
+                file_desc.write(u"\n".join([header] + txt))
+            os.rename(tmp_path, txt_path)
+        except (IOError, OSError), exc:
+            logger.warning("Unable to write '%s': %s" % (txt_path, exc))
+
+    def __get_box_file(self):
+        """
+        Returns:
+            The boxfile.BoxFile of this page. None if it can't be read.
+        """
+        try:
+            return get_box_file(self.__get_box_path(),
+                                self.__get_box_bin_path())
+        except (IOError, OSError), exc:
+            logger.error("Unable to get boxes for '%s': %s"
+                         % (self.doc.docid, exc))
+            return None
+
     def __get_img_path(self):
         """
         Returns the file path of the image corresponding to this page
@@ -89,35 +162,34 @@ class ImgPage(BasicPage):
         """
         Get the text corresponding to this page
         """
-        boxes = self.boxes
-        txt = []
-        for line in boxes:
-            txt_line = u""
-            for box in line.word_boxes:
-                txt_line += u" " + box.content
-            txt.append(txt_line)
+        txt = self.__read_txt_file()
+        if txt is not None:
+            return txt
+        try:
+            words_stats = os.stat(self.__box_path)
+        except OSError:
+            words_stats = None
+        box_file = self.__get_box_file()
+        if box_file is not None:
+            txt = box_file.get_text()
+        else:
+            txt = [u"".join([u" " + box.content for box in line.word_boxes])
+                   for line in self.boxes]
+        if words_stats is not None:
+            self.__write_txt_file(txt, words_stats)
         return txt
 
     def __get_boxes(self):
         """
         Get all the word boxes of this page.
         """
-        boxfile = self.__box_path
+        box_file = self.__get_box_file()
+        if box_file is not None:
+            return box_file.get_boxes()
 
+        # the binary copy can't be written: read the box file directly
         try:
-            box_builder = pyocr.builders.LineBoxBuilder()
-            with codecs.open(boxfile, 'r', encoding='utf-8') as file_desc:
-                boxes = box_builder.read_file(file_desc)
-            if boxes != []:
-                return boxes
-            # fallback: old format: word boxes
-            # shouldn't be used anymore ...
-            logger.warning("WARNING: Doc %s uses old box format" %
-                           (str(self.doc)))
-            box_builder = pyocr.builders.WordBoxBuilder()
-            with codecs.open(boxfile, 'r', encoding='utf-8') as file_desc:
-                boxes = box_builder.read_file(file_desc)
-            return boxes
+            return read_words_file(self.__box_path)
         except IOError, exc:
             logger.error("Unable to get boxes for '%s': %s"
                          % (self.doc.docid, exc))
@@ -127,6 +199,15 @@ class ImgPage(BasicPage):
         boxfile = self.__box_path
         with codecs.open(boxfile, 'w', encoding='utf-8') as file_desc:
             pyocr.builders.LineBoxBuilder().write_file(file_desc, boxes)
+        box_bin_path = self.__get_box_bin_path()
+        forget_box_file(box_bin_path)
+        try:
+            write_box_file(box_bin_path, boxes, os.stat(boxfile))
+        except (IOError, OSError), exc:
+            logger.warning("Unable to write '%s': %s" % (box_bin_path, exc))
+        self.__write_txt_file(
+            [u"".join([u" " + box.content for box in line.word_boxes])
+             for line in boxes], os.stat(boxfile))
         self.drop_cache()
         self.doc.drop_cache()
 
@@ -201,6 +282,8 @@ class ImgPage(BasicPage):
         """
         src = {}
         src["box"] = self.__get_box_path()
+        src["box_bin"] = self.__get_box_bin_path()
+        src["txt"] = self.__get_txt_path()
         src["img"] = self.__get_img_path()
         src["thumb"] = self._get_thumb_path()
 
@@ -216,6 +299,8 @@ class ImgPage(BasicPage):
 
         dst = {}
         dst["box"] = self.__get_box_path()
+        dst["box_bin"] = self.__get_box_bin_path()
+        dst["txt"] = self.__get_txt_path()
         dst["img"] = self.__get_img_path()
         dst["thumb"] = self._get_thumb_path()
 
@@ -275,6 +360,8 @@ class ImgPage(BasicPage):
         current_doc_nb_pages = self.doc.nb_pages
         paths = [
             self.__get_box_path(),
+            self.__get_box_bin_path(),
+            self.__get_txt_path(),
             self.__get_img_path(),
             self._get_thumb_path(),
         ]
@@ -301,12 +388,23 @@ class ImgPage(BasicPage):
             (other_page.__get_img_path(), self.__get_img_path()),
             (other_page._get_thumb_path(), self._get_thumb_path())
         ]
-        for (src, dst) in to_move:
+        # generated on-the-fly: may not exist
+        to_move_if_present = [
+            (other_page.__get_box_bin_path(), self.__get_box_bin_path()),
+            (other_page.__get_txt_path(), self.__get_txt_path()),
+        ]
+        for (src, dst) in to_move_if_present:
+            if not os.access(src, os.F_OK) and os.access(dst, os.F_OK):
+                # outdated
+                os.unlink(dst)
+        to_move_if_present = [(src, dst) for (src, dst) in to_move_if_present
+                              if os.access(src, os.F_OK)]
+        for (src, dst) in to_move + to_move_if_present:
             # sanity check
             if os.access(dst, os.F_OK):
                 logger.error("Error, file already exists: %s" % dst)
                 assert(0)
-        for (src, dst) in to_move:
+        for (src, dst) in to_move + to_move_if_present:
             logger.info("%s --> %s" % (src, dst))
             os.rename(src, dst)
 
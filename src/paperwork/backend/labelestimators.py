@@ -0,0 +1,240 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Storage of the label estimators: one file per label. Only the estimators that
+changed are written back on the disk, and each estimator is only loaded when
+required.
+"""
+
+import logging
+import os
+import threading
+
+from sklearn.externals import joblib
+
+from paperwork.backend.util import mkdir_p
+
+
+logger = logging.getLogger(__name__)
+
+
+class LabelEstimatorStore(object):
+    """
+    Map label name --> estimator, backed by a directory with one file per
+    label.
+
+    Estimators are fitted in-place, so the store can't know by itself when
+    they change: call mark_dirty() after fitting one of them.
+    """
+    FILE_EXTENSION = ".jbl"
+    # single file where all the estimators were stored by older versions
+    LEGACY_FILENAME = "label_estimators.jbl"
+
+    def __init__(self, dirpath, version, template):
+        """
+        Arguments:
+            dirpath --- directory containing the estimator files
+            version --- version of the features used by the estimators.
+                Estimators stored with another version are dropped
+            template --- estimators whose parameters don't match the ones
+                of the template are dropped
+        """
+        self.dirpath = dirpath
+        self.version = version
+        self.template_params = template.get_params()
+
+        self.__lock = threading.RLock()
+        self.__estimators = {}  # label name --> estimator (None = not loaded)
+        self.__dirty = set()  # label names
+        self.__deleted = set()  # label names
+
+        if os.path.isdir(dirpath):
+            for filename in os.listdir(dirpath):
+                label_name = self.__get_label_name(filename)
+                if label_name is not None:
+                    self.__estimators[label_name] = None
+        self.__migrate_legacy_file()
+
+    def __get_path(self, label_name):
+        # label names may contain any character, including '/'
+        if isinstance(label_name, unicode):
+            label_name = label_name.encode('utf-8')
+        filename = label_name.encode('hex')
+        return os.path.join(self.dirpath, filename + self.FILE_EXTENSION)
+
+    def __get_label_name(self, filename):
+        if not filename.endswith(self.FILE_EXTENSION):
+            return None
+        if filename == self.LEGACY_FILENAME:
+            return None
+        try:
+            filename = filename[:-len(self.FILE_EXTENSION)]
+            return filename.decode('hex').decode('utf-8')
+        except (TypeError, UnicodeDecodeError):
+            return None
+
+    def __is_valid(self, estimator, version):
+        if version != self.version:
+            logger.info("Estimator version is not up to date")
+            return False
+        if estimator.get_params() != self.template_params:
+            logger.info("Estimator params are not up to date")
+            return False
+        return True
+
+    def __migrate_legacy_file(self):
+        legacy_path = os.path.join(self.dirpath, self.LEGACY_FILENAME)
+        if not os.path.exists(legacy_path):
+            return
+        logger.info("Migrating label estimators from '%s' ..." % legacy_path)
+        try:
+            (estimators, version) = joblib.load(legacy_path)
+            for (label_name, estimator) in estimators.iteritems():
+                if not self.__is_valid(estimator, version):
+                    continue
+                if label_name not in self.__estimators:
+                    self[label_name] = estimator
+            self.save()
+        except Exception, exc:
+            logger.error("Failed to migrate label estimators from '%s': %s"
+                         % (legacy_path, exc))
+            return
+        os.unlink(legacy_path)
+
+    def __load(self, label_name):
+        path = self.__get_path(label_name)
+        logger.info("Loading label estimator '%s' from '%s' ..."
+                    % (label_name, path))
+        try:
+            (estimator, version) = joblib.load(path)
+            if self.__is_valid(estimator, version):
+                return estimator
+        except Exception, exc:
+            logger.error("Failed to load label estimator '%s': %s"
+                         % (path, exc))
+        return None
+
+    def __ensure_loaded(self, label_name):
+        """
+        Load the estimator if it's not loaded yet. If its file is unusable,
+        the estimator is forgotten (so the file is not read again), and the
+        file will be removed on the next save().
+
+        Returns:
+            The estimator, or None if it can't be loaded
+        """
+        estimator = self.__estimators[label_name]
+        if estimator is not None:
+            return estimator
+        estimator = self.__load(label_name)
+        if estimator is None:
+            self.__estimators.pop(label_name)
+            self.__dirty.discard(label_name)
+            self.__deleted.add(label_name)
+            return None
+        self.__estimators[label_name] = estimator
+        return estimator
+
+    def __getitem__(self, label_name):
+        with self.__lock:
+            if label_name not in self.__estimators:
+                raise KeyError(label_name)
+            estimator = self.__ensure_loaded(label_name)
+            if estimator is None:
+                raise KeyError(label_name)
+            return estimator
+
+    def __setitem__(self, label_name, estimator):
+        with self.__lock:
+            self.__estimators[label_name] = estimator
+            self.__dirty.add(label_name)
+            self.__deleted.discard(label_name)
+
+    def __contains__(self, label_name):
+        # the estimator is loaded to make sure it's actually usable
+        try:
+            self[label_name]
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return len(self.__estimators)
+
+    def get(self, label_name, default=None):
+        try:
+            return self[label_name]
+        except KeyError:
+            return default
+
+    def pop(self, label_name, *args):
+        with self.__lock:
+            if (label_name not in self.__estimators
+                    or self.__ensure_loaded(label_name) is None):
+                if args:
+                    return args[0]
+                raise KeyError(label_name)
+            estimator = self.__estimators.pop(label_name)
+            self.__dirty.discard(label_name)
+            self.__deleted.add(label_name)
+            return estimator
+
+    def keys(self):
+        return self.__estimators.keys()
+
+    def iteritems(self):
+        """
+        Iterate on all the estimators. They are all loaded.
+        """
+        for label_name in self.keys():
+            estimator = self.get(label_name)
+            if estimator is not None:
+                yield (label_name, estimator)
+
+    def mark_dirty(self, label_name):
+        """
+        The estimator of the given label has been modified and must be
+        written back on the disk on the next call to save()
+        """
+        with self.__lock:
+            if label_name in self.__estimators:
+                self.__dirty.add(label_name)
+
+    def save(self):
+        """
+        Write the modified estimators on the disk, and remove the files
+        of the deleted ones. Each file is replaced atomically.
+        """
+        with self.__lock:
+            if not self.__dirty and not self.__deleted:
+                return
+            mkdir_p(self.dirpath)
+            for label_name in self.__deleted:
+                path = self.__get_path(label_name)
+                if os.path.exists(path):
+                    os.unlink(path)
+            for label_name in self.__dirty:
+                path = self.__get_path(label_name)
+                tmp_path = path + ".tmp"
+                # compressed: joblib then writes a single file, which can
+                # be renamed
+                joblib.dump((self.__estimators[label_name], self.version),
+                            tmp_path, compress=3)
+                os.rename(tmp_path, path)
+            logger.info("Label estimators: %d saved, %d removed"
+                        % (len(self.__dirty), len(self.__deleted)))
+            self.__dirty = set()
+            self.__deleted = set()
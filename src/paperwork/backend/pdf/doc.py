@@ -21,13 +21,18 @@ import urllib
 
 from gi.repository import GLib
 from gi.repository import Gio
-from gi.repository import Poppler
 
 from paperwork.backend.common.doc import BasicDoc
+from paperwork.backend.filehash import get_file_hash_cache
+from paperwork.backend.pdf.docpool import get_poppler_doc_pool
+from paperwork.backend.pdf.docpool import read_nb_pages
+from paperwork.backend.pdf.docpool import write_nb_pages
 from paperwork.backend.pdf.page import PdfPage
 
 
 PDF_FILENAME = "doc.pdf"
+# number of pages of the PDF file (see docpool.write_nb_pages())
+PDF_INFO_FILENAME = "doc.pdf.info"
 logger = logging.getLogger(__name__)
 
 
@@ -133,12 +138,16 @@ class PdfDoc(BasicDoc):
     def get_pdf_file_path(self):
         return ("%s/%s" % (self.path, PDF_FILENAME))
 
+    def __get_info_path(self):
+        return os.path.join(self.path, PDF_INFO_FILENAME)
+
     def _open_pdf(self):
-        self.__pdf = Poppler.Document.new_from_file(
-            ("file://%s/%s" % (urllib.quote(self.path), PDF_FILENAME)),
-            password=None)
-        self.__nb_pages = self.pdf.get_n_pages()
+        pdfpath = self.get_pdf_file_path()
+        self.__pdf = get_poppler_doc_pool().get(pdfpath)
+        self.__nb_pages = self.__pdf.get_n_pages()
         self.__pages = PdfPages(self)
+        if read_nb_pages(self.__get_info_path(), pdfpath) != self.__nb_pages:
+            write_nb_pages(self.__get_info_path(), pdfpath, self.__nb_pages)
 
     def __get_pdf(self):
         if self.__pdf is None:
@@ -159,6 +168,10 @@ class PdfDoc(BasicDoc):
             if self.is_new:
                 # happens when a doc was recently deleted
                 return 0
+            nb_pages = read_nb_pages(self.__get_info_path(),
+                                     self.get_pdf_file_path())
+            if nb_pages is not None:
+                return nb_pages
             self._open_pdf()
         return self.__nb_pages
 
@@ -182,6 +195,11 @@ class PdfDoc(BasicDoc):
         f.copy(dest,
                0,  # TODO(Jflesch): Missing flags: don't keep attributes
                None, None, None)
+        if f.get_path() is not None:
+            # the hash of the source file may already be known (see
+            # MultiplePdfImporter)
+            get_file_hash_cache().record_copy(f.get_path(), dest.get_path())
+        get_poppler_doc_pool().forget(self.get_pdf_file_path())
         self._open_pdf()
 
     @staticmethod
@@ -0,0 +1,144 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Opened Poppler documents, shared by the whole process.
+
+Opening a PDF file means parsing it, and PdfDoc drops its cache (and so its
+Poppler document) quite often. The documents are kept in a bounded pool
+instead, as long as their file doesn't change.
+
+Documents dropped from the pool are not closed: Poppler pages keep a
+reference on their document, so the pages still in use remain valid.
+"""
+
+import json
+import logging
+import os
+import threading
+import urllib
+
+from gi.repository import Poppler
+
+from paperwork.backend.util import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+# maximum number of documents kept open
+MAX_OPEN_DOCS = 16
+
+
+class PopplerDocPool(object):
+    """
+    Map file path --> (mtime, size, Poppler.Document)
+    """
+
+    def __init__(self, max_docs=MAX_OPEN_DOCS):
+        self.__docs = LRUCache(max_docs)
+        self.__lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Returns:
+            The Poppler document of the given file. It is opened only if it
+            is not in the pool yet, or if the file has been modified.
+
+        Raises:
+            OSError if the file doesn't exist, GLib.GError if it can't be
+            parsed
+        """
+        stats = os.stat(path)
+        with self.__lock:
+            entry = self.__docs.get(path)
+            if (entry is not None and entry[0] == stats.st_mtime
+                    and entry[1] == stats.st_size):
+                return entry[2]
+            logger.debug("Opening PDF '%s'" % path)
+            doc = Poppler.Document.new_from_file(
+                "file://%s" % urllib.quote(os.path.abspath(path)),
+                password=None)
+            self.__docs.put(path, (stats.st_mtime, stats.st_size, doc))
+            return doc
+
+    def forget(self, path):
+        """
+        Drop the document of the given file from the pool (when the file
+        has been replaced or deleted)
+        """
+        self.__docs.pop(path)
+
+    def get_stats(self):
+        """
+        Returns:
+            (hits, misses)
+        """
+        return (self.__docs.hits, self.__docs.misses)
+
+
+_POPPLER_DOC_POOL = None
+_POPPLER_DOC_POOL_LOCK = threading.Lock()
+
+
+def get_poppler_doc_pool():
+    """
+    Returns:
+        The PopplerDocPool shared by the whole process
+    """
+    global _POPPLER_DOC_POOL
+    with _POPPLER_DOC_POOL_LOCK:
+        if _POPPLER_DOC_POOL is None:
+            _POPPLER_DOC_POOL = PopplerDocPool()
+        return _POPPLER_DOC_POOL
+
+
+def read_nb_pages(info_path, pdf_path):
+    """
+    Read the number of pages stored by write_nb_pages()
+
+    Returns:
+        The number of pages, or None if it is unknown or if the PDF file
+        changed since it was stored
+    """
+    try:
+        stats = os.stat(pdf_path)
+        with open(info_path, 'r') as file_desc:
+            content = json.load(file_desc)
+    except (IOError, OSError, ValueError):
+        return None
+    if (content.get('mtime') != stats.st_mtime
+            or content.get('size') != stats.st_size):
+        return None
+    return content.get('nb_pages')
+
+
+def write_nb_pages(info_path, pdf_path, nb_pages):
+    """
+    Remember the number of pages of a PDF file, so it doesn't have to be
+    opened next time. The file is replaced atomically.
+    """
+    tmp_path = info_path + ".tmp"
+    try:
+        stats = os.stat(pdf_path)
+        content = {
+            'mtime': stats.st_mtime,
+            'size': stats.st_size,
+            'nb_pages': nb_pages,
+        }
+        with open(tmp_path, 'w') as file_desc:
+            json.dump(content, file_desc, separators=(',', ':'))
+        os.rename(tmp_path, info_path)
+    except (IOError, OSError), exc:
+        logger.warning("Unable to write '%s': %s" % (info_path, exc))
@@ -21,7 +21,10 @@ import logging
 import pyocr
 import pyocr.builders
 
+from paperwork.backend.boxfile import BoxFile
+from paperwork.backend.boxfile import write_box_file
 from paperwork.backend.common.page import BasicPage
+from paperwork.backend.pdf.rendercache import get_render_cache
 from paperwork.backend.util import split_words
 from paperwork.backend.util import surface2image
 
@@ -58,9 +61,79 @@ class PdfLineBox(object):
                               * PDF_RENDER_FACTOR)))
 
 
+def _get_position(x1, y1, x2, y2):
+    """
+    Convert PDF coordinates (top left origin) into box coordinates
+    """
+    return ((int(x1 * PDF_RENDER_FACTOR), int(y1 * PDF_RENDER_FACTOR)),
+            (int(x2 * PDF_RENDER_FACTOR), int(y2 * PDF_RENDER_FACTOR)))
+
+
+def _union(rect_a, rect_b):
+    """
+    Arguments:
+        rect_a --- (x1, y1, x2, y2), or None
+        rect_b --- (x1, y1, x2, y2)
+    """
+    if rect_a is None:
+        return rect_b
+    return (min(rect_a[0], rect_b[0]), min(rect_a[1], rect_b[1]),
+            max(rect_a[2], rect_b[2]), max(rect_a[3], rect_b[3]))
+
+
+def get_layout_boxes(text, rectangles):
+    """
+    Group the characters of a page into words and lines, in a single pass.
+
+    Arguments:
+        text --- text of the page (unicode), as returned by
+            Poppler.Page.get_text()
+        rectangles --- bounding box of each character of the text, as
+            returned by Poppler.Page.get_text_layout()
+
+    Returns:
+        A list of line boxes (pyocr.builders.LineBox)
+    """
+    line_boxes = []
+    word_boxes = []
+    word = []
+    word_rect = None
+    line_rect = None
+
+    for (char, rect) in zip(text, rectangles):
+        if not char.isspace():
+            rect = (rect.x1, rect.y1, rect.x2, rect.y2)
+            word.append(char)
+            word_rect = _union(word_rect, rect)
+            continue
+        if word:
+            word_boxes.append(pyocr.builders.Box(u"".join(word),
+                                                 _get_position(*word_rect)))
+            line_rect = _union(line_rect, word_rect)
+            word = []
+            word_rect = None
+        if char == u"\n" and word_boxes:
+            line_boxes.append(pyocr.builders.LineBox(
+                word_boxes, _get_position(*line_rect)))
+            word_boxes = []
+            line_rect = None
+
+    if word:
+        word_boxes.append(pyocr.builders.Box(u"".join(word),
+                                             _get_position(*word_rect)))
+        line_rect = _union(line_rect, word_rect)
+    if word_boxes:
+        line_boxes.append(pyocr.builders.LineBox(
+            word_boxes, _get_position(*line_rect)))
+    return line_boxes
+
+
 class PdfPage(BasicPage):
     EXT_TXT = "txt"
     EXT_BOX = "words"
+    # boxes extracted from the text layout of the PDF (see boxfile). Only
+    # used if there is no box file from OCR
+    EXT_LAYOUT = "layout.boxes"
 
     def __init__(self, doc, page_nb):
         BasicPage.__init__(self, doc, page_nb)
@@ -69,7 +142,6 @@ class PdfPage(BasicPage):
         size = self.pdf_page.get_size()
         self._size = (int(size[0]), int(size[1]))
         self.__boxes = None
-        self.__img_cache = {}
         doc = doc
 
     def get_doc_file_path(self):
@@ -84,6 +156,9 @@ class PdfPage(BasicPage):
     def __get_box_path(self):
         return self._get_filepath(self.EXT_BOX)
 
+    def __get_layout_path(self):
+        return self._get_filepath(self.EXT_LAYOUT)
+
     def __get_last_mod(self):
         try:
             return os.stat(self.__get_box_path()).st_mtime
@@ -155,9 +230,11 @@ class PdfPage(BasicPage):
             pass
 
         # fall back on what libpoppler tells us
+        self.__boxes = self.__get_layout_boxes()
+        if self.__boxes is not None:
+            return self.__boxes
 
-        # TODO: Line support !
-
+        # no layout: no line support
         txt = self.pdf_page.get_text()
         pdf_size = self.pdf_page.get_size()
         words = set()
@@ -172,6 +249,38 @@ class PdfPage(BasicPage):
                 self.__boxes.append(line_box)
         return self.__boxes
 
+    def __get_layout_boxes(self):
+        """
+        Get the boxes from the text layout of the PDF. They are extracted
+        once, and then stored in a binary box file.
+
+        Returns:
+            A list of line boxes, or None if the layout is not available
+        """
+        layout_path = self.__get_layout_path()
+        pdf_stats = os.stat(self.get_doc_file_path())
+        try:
+            box_file = BoxFile(layout_path)
+            if box_file.matches(pdf_stats):
+                return box_file.get_boxes()
+        except (IOError, ValueError):
+            pass
+
+        (has_layout, rectangles) = self.pdf_page.get_text_layout()
+        if not has_layout:
+            return None
+        txt = unicode(self.pdf_page.get_text(), encoding='utf-8')
+        if len(txt) != len(rectangles):
+            logger.warning("%s: Text layout doesn't match the text"
+                           " (%d characters, %d rectangles)"
+                           % (str(self), len(txt), len(rectangles)))
+        boxes = get_layout_boxes(txt, rectangles)
+        try:
+            write_box_file(layout_path, boxes, pdf_stats)
+        except (IOError, OSError), exc:
+            logger.warning("Unable to write '%s': %s" % (layout_path, exc))
+        return boxes
+
     def __set_boxes(self, boxes):
         boxfile = self.__get_box_path()
         with codecs.open(boxfile, 'w', encoding='utf-8') as file_desc:
@@ -186,7 +295,11 @@ class PdfPage(BasicPage):
         # we should draw directly on the GtkImage.window.cairo_create()
         # context. It would be much more efficient.
 
-        if factor not in self.__img_cache:
+        render_cache = get_render_cache()
+        key = (self.doc.docid, self.page_nb, factor,
+               os.stat(self.get_doc_file_path()).st_mtime)
+        img = render_cache.get(key)
+        if img is None:
             logger.debug('Building img from pdf with factor: %s'
                          % factor)
             width = int(factor * self._size[0])
@@ -196,8 +309,9 @@ class PdfPage(BasicPage):
             ctx = cairo.Context(surface)
             ctx.scale(factor, factor)
             self.pdf_page.render(ctx)
-            self.__img_cache[factor] = surface2image(surface)
-        return self.__img_cache[factor]
+            img = surface2image(surface)
+            render_cache.put(key, img)
+        return img
 
     def __get_img(self):
         return self.__render_img(PDF_RENDER_FACTOR)
@@ -0,0 +1,219 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Images rendered from the PDF pages, shared by the whole process.
+
+Rendered images are kept in memory within a byte budget. When the budget is
+exceeded, the least recently used images are dropped or, if a spill
+directory has been set, written there as raw rasters (reading them back is
+much faster than rendering the page again). The spill directory has its own
+budget.
+
+The cache keeps its own copies of the images: the images returned can be
+modified by the caller (see util.image2surface()).
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import struct
+import threading
+
+import PIL.Image
+
+from paperwork.backend.util import LRUCache
+from paperwork.backend.util import mkdir_p
+from paperwork.backend.util import rm_rf
+
+
+logger = logging.getLogger(__name__)
+
+# maximum total size of the images kept in memory (bytes)
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# maximum total size of the images spilled on the disk (bytes)
+DEFAULT_MAX_DISK_SIZE = 1024 * 1024 * 1024
+
+# width, height (the images are RGB)
+_SPILL_HEADER_FORMAT = "<II"
+_SPILL_HEADER_SIZE = struct.calcsize(_SPILL_HEADER_FORMAT)
+
+
+def _weigh_img(img):
+    return img.size[0] * img.size[1] * len(img.getbands())
+
+
+class RenderCache(object):
+    """
+    Map (docid, page_nb, factor, mtime of the PDF file) --> PIL image
+
+    Images of modified PDF files are never returned (their mtime changed):
+    they just end up being dropped like any other image.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE,
+                 max_disk_size=DEFAULT_MAX_DISK_SIZE):
+        self.__imgs = LRUCache(max_size, weigh=_weigh_img,
+                               on_evict=self.__spill)
+        # key --> size of the file (only the files written by this process)
+        self.__spilled = LRUCache(max_disk_size, weigh=lambda size: size,
+                                  on_evict=self.__unspill)
+        self.__spill_dir = None
+        self.__lock = threading.Lock()
+        self.disk_hits = 0
+
+    def set_spill_dir(self, spill_dir):
+        """
+        Arguments:
+            spill_dir --- directory where the images dropped from memory are
+                written. Its content is deleted. None to disable spilling.
+                The previous spill directory is deleted.
+        """
+        with self.__lock:
+            self.__spilled.clear()
+            if self.__spill_dir is not None:
+                rm_rf(self.__spill_dir)
+            if spill_dir is not None:
+                rm_rf(spill_dir)
+                mkdir_p(spill_dir)
+            self.__spill_dir = spill_dir
+
+    def __get_spill_path(self, key):
+        name = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(self.__spill_dir, name + ".raw")
+
+    def __spill(self, key, img):
+        """
+        Called when an image is dropped from memory (by LRUCache.put(),
+        without self.__lock held)
+        """
+        if img.mode != "RGB":
+            return
+        # get() may be reading the spilled image of the same key
+        with self.__lock:
+            if self.__spill_dir is None:
+                return
+            path = self.__get_spill_path(key)
+            tmp_path = path + ".tmp"
+            try:
+                with open(tmp_path, 'wb') as file_desc:
+                    file_desc.write(struct.pack(_SPILL_HEADER_FORMAT,
+                                                img.size[0], img.size[1]))
+                    file_desc.write(img.tobytes())
+                os.rename(tmp_path, path)
+            except (IOError, OSError), exc:
+                logger.warning("Unable to write '%s': %s" % (path, exc))
+                return
+            self.__spilled.put(key, _SPILL_HEADER_SIZE + _weigh_img(img))
+
+    def __unspill(self, key, size):
+        try:
+            os.unlink(self.__get_spill_path(key))
+        except OSError:
+            pass
+
+    def __read_spilled(self, key):
+        if self.__spilled.pop(key) is None:
+            return None
+        path = self.__get_spill_path(key)
+        try:
+            with open(path, 'rb') as file_desc:
+                (width, height) = struct.unpack(
+                    _SPILL_HEADER_FORMAT, file_desc.read(_SPILL_HEADER_SIZE))
+                data = file_desc.read()
+            os.unlink(path)
+            return PIL.Image.frombytes("RGB", (width, height), data)
+        except (IOError, OSError, struct.error, ValueError), exc:
+            logger.warning("Unable to read '%s': %s" % (path, exc))
+            return None
+
+    def get(self, key):
+        """
+        Returns:
+            A copy of the image, or None if it must be rendered
+        """
+        img = self.__imgs.get(key)
+        if img is not None:
+            return img.copy()
+        if self.__spill_dir is None:
+            return None
+        with self.__lock:
+            img = self.__read_spilled(key)
+        if img is None:
+            return None
+        self.disk_hits += 1
+        self.__imgs.put(key, img)
+        return img.copy()
+
+    def put(self, key, img):
+        """
+        Store a copy of the image
+        """
+        self.__imgs.put(key, img.copy())
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict: memory hits, misses, disk hits, bytes in memory, bytes
+            on the disk
+        """
+        return {
+            'hits': self.__imgs.hits,
+            'misses': self.__imgs.misses,
+            'disk_hits': self.disk_hits,
+            'size': self.__imgs.size,
+            'disk_size': self.__spilled.size,
+        }
+
+
+def get_default_spill_dir():
+    """
+    Returns:
+        A spill directory for the current process, in the user cache
+        directory. The spill directories of the processes that are not
+        running anymore are deleted.
+    """
+    base_dir = os.getenv("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    renders_dir = os.path.join(base_dir, "paperwork", "renders")
+    if os.path.isdir(renders_dir):
+        for name in os.listdir(renders_dir):
+            try:
+                os.kill(int(name), 0)
+                continue
+            except ValueError:
+                pass
+            except OSError, exc:
+                if exc.errno != errno.ESRCH:
+                    continue
+            rm_rf(os.path.join(renders_dir, name))
+    return os.path.join(renders_dir, str(os.getpid()))
+
+
+_RENDER_CACHE = None
+_RENDER_CACHE_LOCK = threading.Lock()
+
+
+def get_render_cache():
+    """
+    Returns:
+        The RenderCache shared by the whole process (without spill
+        directory by default)
+    """
+    global _RENDER_CACHE
+    with _RENDER_CACHE_LOCK:
+        if _RENDER_CACHE is None:
+            _RENDER_CACHE = RenderCache()
+        return _RENDER_CACHE
@@ -0,0 +1,233 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+"More like this": finds the documents whose features (see
+BasicDoc.get_features()) are the closest to the ones of a given document.
+
+The features have millions of dimensions. They are reduced with a sparse
+random projection (which roughly preserves the cosine similarities), and
+normalized. The vectors of all the documents are kept in a single dense
+matrix, so the similarities with a document are computed with a few matrix
+products.
+"""
+
+import logging
+import os
+import threading
+
+import numpy
+from scipy import sparse
+from sklearn.externals import joblib
+from sklearn.random_projection import SparseRandomProjection
+
+
+logger = logging.getLogger(__name__)
+
+# number of dimensions of the reduced vectors
+NB_COMPONENTS = 256
+
+_PROJECTIONS = {}  # number of features --> SparseRandomProjection
+_PROJECTIONS_LOCK = threading.Lock()
+
+
+def _get_projection(nb_features):
+    with _PROJECTIONS_LOCK:
+        projection = _PROJECTIONS.get(nb_features)
+        if projection is None:
+            # fixed random state: the projection must always be the same
+            projection = SparseRandomProjection(n_components=NB_COMPONENTS,
+                                                dense_output=True,
+                                                random_state=0)
+            projection.fit(sparse.csr_matrix((1, nb_features)))
+            _PROJECTIONS[nb_features] = projection
+        return projection
+
+
+def get_similarity_vectors(features):
+    """
+    Reduce and normalize features
+
+    Arguments:
+        features --- sparse matrix, one row per document (see
+            BasicDoc.get_features())
+
+    Returns:
+        A dense matrix (float32), one row per document
+    """
+    vectors = _get_projection(features.shape[1]).transform(features)
+    vectors = numpy.asarray(vectors, dtype=numpy.float32)
+    norms = numpy.sqrt((vectors ** 2).sum(axis=1))
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, None]
+
+
+class SimilarityIndex(object):
+    """
+    Reduced feature vectors of all the documents. Stored beside the Whoosh
+    index.
+
+    Each vector is stored with the fingerprint of the document (see
+    catalog.get_doc_fingerprint()) it was computed from, so outdated vectors
+    can be detected.
+
+    Updates are kept apart until the next call to save(), where they are
+    merged into the main matrix.
+    """
+    FILENAME = "similarity.jbl"
+    VERSION = 1
+    # number of rows multiplied at once when searching (bounds the memory
+    # used by the intermediate results)
+    BLOCK_SIZE = 8192
+
+    def __init__(self, indexdir, features_version):
+        """
+        Arguments:
+            features_version --- see BasicDoc.FEATURES_VER. Vectors computed
+                from other versions of the features are dropped
+        """
+        self.path = os.path.join(indexdir, self.FILENAME)
+        self.features_version = features_version
+        self.__clear()
+
+    def __clear(self):
+        self.__docids = []  # row --> docid
+        self.__matrix = numpy.zeros((0, NB_COMPONENTS), dtype=numpy.float32)
+        self.__alive = numpy.zeros(0, dtype=numpy.bool_)  # row --> bool
+        self.__rows = {}  # docid --> row (only alive rows)
+        self.__pending = {}  # docid --> vector
+        self.fingerprints = {}  # docid --> fingerprint
+
+    def load(self):
+        self.__clear()
+        try:
+            content = joblib.load(self.path)
+        except Exception, exc:
+            logger.info("No similarity vectors loaded from '%s': %s"
+                        % (self.path, exc))
+            return
+        if (content.get('version') != self.VERSION
+                or content.get('features_version') != self.features_version
+                or content['vectors'].shape[1] != NB_COMPONENTS):
+            logger.info("Similarity vectors are not up to date")
+            return
+        self.__docids = list(content['docids'])
+        self.__matrix = content['vectors']
+        self.__alive = numpy.ones(len(self.__docids), dtype=numpy.bool_)
+        self.__rows = dict((docid, row)
+                           for (row, docid) in enumerate(self.__docids))
+        self.fingerprints = dict(zip(self.__docids, content['fingerprints']))
+        logger.info("Similarity vectors loaded: %d documents"
+                    % len(self.__docids))
+
+    def __compact(self):
+        """
+        Merge the pending vectors into the main matrix, and drop the rows of
+        the documents that have been updated or deleted.
+        """
+        if not self.__pending and self.__alive.all():
+            return
+        docids = [docid for (docid, alive)
+                  in zip(self.__docids, self.__alive) if alive]
+        matrices = [self.__matrix[self.__alive]]
+        if self.__pending:
+            docids += self.__pending.keys()
+            matrices.append(numpy.vstack(self.__pending.values()))
+        self.__docids = docids
+        self.__matrix = numpy.vstack(matrices)
+        self.__alive = numpy.ones(len(docids), dtype=numpy.bool_)
+        self.__rows = dict((docid, row) for (row, docid) in enumerate(docids))
+        self.__pending = {}
+
+    def save(self):
+        """
+        Write the vectors on the disk. The file is replaced atomically.
+        """
+        self.__compact()
+        content = {
+            'version': self.VERSION,
+            'features_version': self.features_version,
+            'docids': self.__docids,
+            'fingerprints': [self.fingerprints.get(docid)
+                             for docid in self.__docids],
+            'vectors': self.__matrix,
+        }
+        tmp_path = self.path + ".tmp"
+        # compressed: joblib then writes a single file, which can be renamed
+        joblib.dump(content, tmp_path, compress=3)
+        os.rename(tmp_path, self.path)
+
+    def destroy(self):
+        self.__clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __contains__(self, docid):
+        return docid in self.__rows or docid in self.__pending
+
+    def get_vector(self, docid):
+        if docid in self.__pending:
+            return self.__pending[docid]
+        if docid in self.__rows:
+            return self.__matrix[self.__rows[docid]]
+        return None
+
+    def set(self, docid, fingerprint, vector):
+        """
+        Arguments:
+            vector --- see get_similarity_vectors() (a single row)
+        """
+        self.remove(docid)
+        self.__pending[docid] = numpy.asarray(vector,
+                                              dtype=numpy.float32).ravel()
+        self.fingerprints[docid] = fingerprint
+
+    def remove(self, docid):
+        self.__pending.pop(docid, None)
+        self.fingerprints.pop(docid, None)
+        row = self.__rows.pop(docid, None)
+        if row is not None:
+            self.__alive[row] = False
+
+    def find_similar(self, vector, k, exclude=None):
+        """
+        Returns:
+            The 'k' most similar documents: [(docid, cosine similarity),
+            ...], most similar first
+        """
+        vector = numpy.asarray(vector, dtype=numpy.float32).ravel()
+        candidates = []  # [(docid, score), ...]
+        # the excluded document may be among the best ones of a block
+        nb_best = k + 1
+
+        for start in xrange(0, len(self.__docids), self.BLOCK_SIZE):
+            end = start + self.BLOCK_SIZE
+            scores = self.__matrix[start:end].dot(vector)
+            scores[~self.__alive[start:end]] = -numpy.inf
+            if len(scores) > nb_best:
+                best = numpy.argpartition(-scores, nb_best)[:nb_best]
+            else:
+                best = numpy.arange(len(scores))
+            candidates += [(self.__docids[start + idx], float(scores[idx]))
+                           for idx in best
+                           if scores[idx] != -numpy.inf]
+
+        for (docid, pending_vector) in self.__pending.iteritems():
+            candidates.append((docid, float(pending_vector.dot(vector))))
+
+        candidates = [candidate for candidate in candidates
+                      if candidate[0] != exclude]
+        candidates.sort(key=lambda x: x[1], reverse=True)
+        return candidates[:k]
@@ -15,10 +15,14 @@
 #    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>
 
 import array
+import collections
 import errno
+import hashlib
 import logging
+import math
 import os
 import re
+import stat
 import threading
 import unicodedata
 
@@ -26,6 +30,14 @@ import enchant
 import enchant.tokenize
 import Levenshtein
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 logger = logging.getLogger(__name__)
 FORCED_SPLIT_KEYWORDS_REGEX = re.compile("[ '()]", re.UNICODE)
 WISHED_SPLIT_KEYWORDS_REGEX = re.compile("[^\w!]", re.UNICODE)
@@ -182,6 +194,39 @@ def mkdir_p(path):
             raise
 
 
+def get_dir_stats(path):
+    """
+    Look at all the files of a directory in a single pass (using scandir()
+    when available).
+
+    Returns:
+        A dict: filename --> (mtime, size). Sub-directories are not
+        included. None if the path is not a directory.
+    """
+    stats = {}
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                if not entry.is_file():
+                    continue
+                file_stat = entry.stat()
+                stats[entry.name] = (file_stat.st_mtime, file_stat.st_size)
+        else:
+            for filename in os.listdir(path):
+                try:
+                    file_stat = os.stat(os.path.join(path, filename))
+                except OSError:
+                    continue
+                if not stat.S_ISREG(file_stat.st_mode):
+                    continue
+                stats[filename] = (file_stat.st_mtime, file_stat.st_size)
+    except OSError as exc:
+        if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+            return None
+        raise
+    return stats
+
+
 def rm_rf(path):
     """
     Act as 'rm -rf' in the shell
@@ -201,6 +246,134 @@ def rm_rf(path):
         os.rmdir(path)
 
 
+class LRUCache(object):
+    """
+    Thread-safe cache. When it's full, the least recently used entries are
+    dropped.
+
+    The size of each entry is computed by the function 'weigh' (1 per entry
+    by default). The total size of the entries is kept below 'max_size'.
+    """
+
+    def __init__(self, max_size, weigh=lambda value: 1, on_evict=None):
+        """
+        Arguments:
+            max_size --- maximum total size of the entries
+            weigh --- function returning the size of a value
+            on_evict --- if not None, called with (key, value) for each
+                entry dropped to make room for new ones
+        """
+        self.max_size = max_size
+        self.weigh = weigh
+        self.on_evict = on_evict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__entries = collections.OrderedDict()  # key --> (value, size)
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                (value, size) = self.__entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.__entries[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.weigh(value)
+        evicted = []
+        with self.__lock:
+            if key in self.__entries:
+                self.size -= self.__entries.pop(key)[1]
+            if size > self.max_size:
+                # would evict everything else for nothing
+                return
+            self.__entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                (old_key, (old_value, old_size)) = \
+                    self.__entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append((old_key, old_value))
+        if self.on_evict is not None:
+            for (old_key, old_value) in evicted:
+                self.on_evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        with self.__lock:
+            try:
+                (value, size) = self.__entries.pop(key)
+            except KeyError:
+                return default
+            self.size -= size
+            return value
+
+    def clear(self):
+        with self.__lock:
+            self.__entries = collections.OrderedDict()
+            self.size = 0
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_stats(self):
+        """
+        Returns:
+            A dict: number of entries, total size, hits and misses
+        """
+        with self.__lock:
+            return {
+                'entries': len(self.__entries),
+                'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+class BloomFilter(object):
+    """
+    Compact set-like structure. 'value in bloom_filter' may wrongly return
+    True for values never added (at a rate close to 'error_rate' as long as
+    no more than 'capacity' values are added), but never returns False for a
+    value that has been added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.nb_bits = int(math.ceil(-capacity * math.log(error_rate)
+                                     / (math.log(2) ** 2)))
+        self.nb_hashes = max(1, int(round(float(self.nb_bits) / capacity
+                                          * math.log(2))))
+        self.bits = bytearray((self.nb_bits + 7) / 8)
+
+    def __get_bit_indexes(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        digest = hashlib.sha1(value).hexdigest()
+        hash_a = int(digest[:16], 16)
+        hash_b = int(digest[16:32], 16) | 1
+        for idx in xrange(0, self.nb_hashes):
+            yield (hash_a + idx * hash_b) % self.nb_bits
+
+    def add(self, value):
+        for bit_idx in self.__get_bit_indexes(value):
+            self.bits[bit_idx / 8] |= (1 << (bit_idx % 8))
+
+    def __contains__(self, value):
+        for bit_idx in self.__get_bit_indexes(value):
+            if not self.bits[bit_idx / 8] & (1 << (bit_idx % 8)):
+                return False
+        return True
+
+
 def surface2image(surface):
     """
     Convert a cairo surface into a PIL image
@@ -0,0 +1,339 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Work directory watchers: they detect documents added, modified or deleted by
+other applications (file synchronization tools, etc), without having to
+re-examine the whole work directory.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from gi.repository import GLib
+from gi.repository import Gio
+
+from paperwork.backend.catalog import get_doc_fingerprint
+from paperwork.backend.docsearch import guess_doctype
+from paperwork.backend.util import get_dir_stats
+
+
+logger = logging.getLogger(__name__)
+
+# Above this number of document directories, the work directory is polled
+# instead of using file monitors: each monitored directory uses an inotify
+# watch, and their number is limited (fs.inotify.max_user_watches)
+MAX_MONITORED_DIRS = 4096
+
+
+class WorkdirWatcher(object):
+    """
+    Base class for work directory watchers.
+
+    Subclasses report the document ids that may have changed with
+    _notify(). Notifications are debounced: once nothing has changed for
+    'debounce' seconds, the documents are compared with the document catalog
+    and on_changes(new_docids, upd_docids, del_docids) is called (from the
+    watcher thread).
+    """
+
+    def __init__(self, docsearch, on_changes, debounce=5.0, interval=1.0):
+        """
+        Arguments:
+            docsearch --- provides the work directory and the document
+                catalog. Can be replaced later (see the attribute
+                'docsearch') when the index is reloaded.
+            on_changes --- callback
+            debounce --- seconds without changes before reporting them
+            interval --- how often the watcher thread wakes up (seconds)
+        """
+        self.docsearch = docsearch
+        self.rootdir = docsearch.rootdir
+        self.on_changes = on_changes
+        self.debounce = debounce
+        self.interval = interval
+
+        self.__lock = threading.Lock()
+        self.__pending = set()
+        self.__last_change = 0.0
+
+        # docid --> fingerprint, for the catalog entries whose fingerprint
+        # is unknown until the document is examined (see
+        # DocSearch.__rebuild_catalog()). The document directories are
+        # looked at now, so a change in them (thumbnails, features, etc
+        # written by Paperwork itself) isn't reported as a modification.
+        self.__seen_fingerprints = {}
+        for (docid, entry) in docsearch.catalog.iteritems():
+            if entry['fingerprint'] is not None:
+                continue
+            file_stats = get_dir_stats(os.path.join(self.rootdir, docid))
+            if file_stats is not None:
+                self.__seen_fingerprints[docid] = \
+                    get_doc_fingerprint(file_stats)
+
+        self.__cond = threading.Condition()
+        self.__thread = None
+        self.running = False
+
+    def _notify(self, docid):
+        """
+        Called by subclasses when something changed in a document directory
+        """
+        with self.__lock:
+            self.__pending.add(docid)
+            self.__last_change = time.time()
+
+    def _poll(self):
+        """
+        Called regularly from the watcher thread. Subclasses may override it.
+        """
+        pass
+
+    def _get_fingerprint(self, docid):
+        """
+        Returns:
+            The last known fingerprint of the document: the one in the
+            catalog, or the one seen when the watcher was created if the
+            catalog doesn't know it. None if the document is not in the
+            catalog.
+        """
+        catalog = self.docsearch.catalog
+        if docid not in catalog:
+            return None
+        fingerprint = catalog[docid]['fingerprint']
+        if fingerprint is None:
+            fingerprint = self.__seen_fingerprints.get(docid)
+        return fingerprint
+
+    def _classify(self, docids):
+        """
+        Compare the documents with the catalog
+
+        Returns:
+            (new_docids, upd_docids, del_docids)
+        """
+        catalog = self.docsearch.catalog
+        new_docids = set()
+        upd_docids = set()
+        del_docids = set()
+        for docid in docids:
+            docpath = os.path.join(self.rootdir, docid)
+            file_stats = get_dir_stats(docpath)
+            is_doc = (file_stats is not None
+                      and guess_doctype(file_stats.keys()) is not None)
+            if docid not in catalog:
+                if is_doc:
+                    new_docids.add(docid)
+                continue
+            if not is_doc:
+                del_docids.add(docid)
+                continue
+            fingerprint = get_doc_fingerprint(file_stats)
+            known_fingerprint = self._get_fingerprint(docid)
+            if known_fingerprint is None:
+                # not seen yet: can't tell if it has been modified
+                self.__seen_fingerprints[docid] = fingerprint
+            elif known_fingerprint != fingerprint:
+                if catalog[docid]['fingerprint'] is None:
+                    self.__seen_fingerprints[docid] = fingerprint
+                upd_docids.add(docid)
+        return (new_docids, upd_docids, del_docids)
+
+    def flush(self, force=False):
+        """
+        Report the pending changes if nothing has changed for long enough
+        (or immediately if 'force' is True).
+        """
+        with self.__lock:
+            if not self.__pending:
+                return
+            if (not force
+                    and time.time() - self.__last_change < self.debounce):
+                return
+            docids = self.__pending
+            self.__pending = set()
+
+        (new_docids, upd_docids, del_docids) = self._classify(docids)
+        if not new_docids and not upd_docids and not del_docids:
+            return
+        logger.info("Work directory changes: %d new, %d modified, %d deleted"
+                    % (len(new_docids), len(upd_docids), len(del_docids)))
+        self.on_changes(new_docids, upd_docids, del_docids)
+
+    def _run(self):
+        logger.info("Watching work directory '%s'" % self.rootdir)
+        while self.running:
+            self.__cond.acquire()
+            try:
+                self.__cond.wait(self.interval)
+            finally:
+                self.__cond.release()
+            if not self.running:
+                break
+            try:
+                self._poll()
+                self.flush()
+            except Exception, exc:
+                logger.exception("Work directory watcher: %s" % exc)
+        logger.info("Stopped watching work directory '%s'" % self.rootdir)
+
+    def start(self):
+        assert(not self.running)
+        self.running = True
+        self.__thread = threading.Thread(target=self._run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.__cond.acquire()
+        try:
+            self.__cond.notify_all()
+        finally:
+            self.__cond.release()
+        self.__thread.join()
+        self.__thread = None
+
+
+class PollingWorkdirWatcher(WorkdirWatcher):
+    """
+    Look regularly at the modification times and sizes of the files in the
+    work directory (see util.get_dir_stats()).
+    """
+
+    def __init__(self, docsearch, on_changes, poll_interval=30.0, **kwargs):
+        WorkdirWatcher.__init__(self, docsearch, on_changes, **kwargs)
+        self.poll_interval = poll_interval
+        self.__last_poll = 0.0
+        # docid --> fingerprint
+        self.__snapshot = {}
+        for docid in docsearch.catalog.entries.keys():
+            fingerprint = self._get_fingerprint(docid)
+            if fingerprint is not None:
+                self.__snapshot[docid] = fingerprint
+
+    def poll(self):
+        """
+        Look at the whole work directory now and report the documents
+        that changed since the last call.
+        """
+        snapshot = {}
+        for docid in os.listdir(self.rootdir):
+            file_stats = get_dir_stats(os.path.join(self.rootdir, docid))
+            if file_stats is None:
+                continue
+            snapshot[docid] = get_doc_fingerprint(file_stats)
+            if self.__snapshot.get(docid) != snapshot[docid]:
+                self._notify(docid)
+        for docid in self.__snapshot:
+            if docid not in snapshot:
+                self._notify(docid)
+        self.__snapshot = snapshot
+        self.__last_poll = time.time()
+
+    def _poll(self):
+        if time.time() - self.__last_poll >= self.poll_interval:
+            self.poll()
+
+
+class GioWorkdirWatcher(WorkdirWatcher):
+    """
+    Use Gio file monitors (inotify on Linux) on the work directory and on
+    each document directory.
+
+    Must be started from the thread running the GLib main loop.
+    """
+
+    def __init__(self, docsearch, on_changes, **kwargs):
+        WorkdirWatcher.__init__(self, docsearch, on_changes, **kwargs)
+        self.__monitors = {}  # path --> Gio.FileMonitor
+
+    def __monitor(self, path):
+        if path in self.__monitors:
+            return
+        gfile = Gio.File.new_for_path(path)
+        monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+        monitor.connect("changed", self.__on_changed)
+        self.__monitors[path] = monitor
+
+    def __on_changed(self, monitor, gfile, other_gfile, event_type):
+        path = gfile.get_path()
+        if path is None:
+            return
+        relpath = os.path.relpath(path, self.rootdir)
+        if relpath.startswith(os.pardir):
+            return
+        docid = relpath.split(os.sep)[0]
+        if docid == os.curdir:
+            return
+        docpath = os.path.join(self.rootdir, docid)
+        if (event_type == Gio.FileMonitorEvent.CREATED
+                and path == docpath and os.path.isdir(docpath)):
+            try:
+                self.__monitor(docpath)
+            except GLib.GError, exc:
+                logger.warning("Unable to watch '%s': %s" % (docpath, exc))
+        elif (event_type == Gio.FileMonitorEvent.DELETED
+                and path == docpath and docpath in self.__monitors):
+            self.__monitors.pop(docpath).cancel()
+        self._notify(docid)
+
+    def start(self):
+        self.__monitor(self.rootdir)
+        for docid in os.listdir(self.rootdir):
+            docpath = os.path.join(self.rootdir, docid)
+            if os.path.isdir(docpath):
+                self.__monitor(docpath)
+        WorkdirWatcher.start(self)
+
+    def stop(self):
+        WorkdirWatcher.stop(self)
+        for monitor in self.__monitors.values():
+            monitor.cancel()
+        self.__monitors = {}
+
+
+def start_workdir_watcher(docsearch, on_changes, **kwargs):
+    """
+    Start watching the work directory. Use file monitors if possible, or
+    fall back on polling.
+
+    Returns:
+        The watcher. Call stop() on it when done.
+    """
+    nb_dirs = len([docid for docid in os.listdir(docsearch.rootdir)
+                   if os.path.isdir(os.path.join(docsearch.rootdir, docid))])
+    if nb_dirs > MAX_MONITORED_DIRS:
+        logger.info("Too many documents to monitor them (%d > %d)."
+                    " Will poll the work directory instead"
+                    % (nb_dirs, MAX_MONITORED_DIRS))
+        watcher = PollingWorkdirWatcher(docsearch, on_changes, **kwargs)
+        watcher.start()
+        return watcher
+    try:
+        watcher = GioWorkdirWatcher(docsearch, on_changes, **kwargs)
+        watcher.start()
+        return watcher
+    except GLib.GError, exc:
+        logger.warning("Unable to monitor the work directory: %s" % exc)
+        logger.warning("Will poll it instead")
+        watcher.stop()
+    watcher = PollingWorkdirWatcher(docsearch, on_changes, **kwargs)
+    watcher.start()
+    return watcher
@@ -0,0 +1,241 @@
+#    Paperwork - Using OCR to grep dead trees the easy way
+#    Copyright (C) 2014  Jerome Flesch
+#
+#    Paperwork is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Paperwork is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Paperwork.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Pool of worker processes running a fresh Python interpreter.
+
+multiprocessing.Pool forks the current process. Forking a process running
+GLib threads (the frontend) is unsafe: the children may inherit locks held
+by threads that don't exist anymore. Here, the workers are new interpreters
+('python -m paperwork.backend.workerpool'), and tasks and results are
+pickled through their standard input and output.
+
+Only module-level functions can be run by the workers.
+"""
+
+import cPickle as pickle
+import errno
+import importlib
+import logging
+import os
+import select
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+# maximum number of tasks queued for each worker
+MAX_PENDING_PER_WORKER = 4
+
+_LENGTH_FORMAT = "<Q"
+_LENGTH_SIZE = struct.calcsize(_LENGTH_FORMAT)
+
+
+class WorkerError(Exception):
+    """
+    A task raised an exception in a worker, or a worker died
+    """
+    pass
+
+
+def _write_msg(fd, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    data = struct.pack(_LENGTH_FORMAT, len(data)) + data
+    while data:
+        written = os.write(fd, data)
+        data = data[written:]
+
+
+def _read_exactly(fd, length):
+    chunks = []
+    while length > 0:
+        chunk = os.read(fd, min(length, 1024 * 1024))
+        if chunk == "":
+            raise EOFError()
+        chunks.append(chunk)
+        length -= len(chunk)
+    return "".join(chunks)
+
+
+def _read_msg(fd):
+    (length,) = struct.unpack(_LENGTH_FORMAT, _read_exactly(fd, _LENGTH_SIZE))
+    return pickle.loads(_read_exactly(fd, length))
+
+
+class _Worker(object):
+    def __init__(self):
+        env = dict(os.environ)
+        # the worker must find the same modules
+        env['PYTHONPATH'] = os.pathsep.join([path for path in sys.path
+                                             if path != ""])
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", __name__], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, close_fds=True, env=env)
+        self.nb_pending = 0
+
+    def send(self, func_ref, arg):
+        _write_msg(self.process.stdin.fileno(), (func_ref, arg))
+        self.nb_pending += 1
+
+    def receive(self):
+        try:
+            (success, result) = _read_msg(self.process.stdout.fileno())
+        except (EOFError, OSError, struct.error), exc:
+            raise WorkerError("Worker %d died: %s"
+                              % (self.process.pid, exc))
+        self.nb_pending -= 1
+        if not success:
+            raise WorkerError(result)
+        return result
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        self.process.wait()
+
+
+class WorkerPool(object):
+    """
+    The workers are started on the first call to imap_unordered() and kept
+    until close() is called. Each call to imap_unordered() takes the idle
+    workers for itself (or starts new ones if they are all busy) and gives
+    them back once all the results have been returned.
+    """
+
+    def __init__(self, procs):
+        self.procs = procs
+        self.__workers = []  # idle workers
+        # incremented by close(): workers taken before must not be given
+        # back
+        self.__generation = 0
+        self.__lock = threading.Lock()
+
+    def __take_workers(self):
+        with self.__lock:
+            workers = self.__workers
+            self.__workers = []
+            generation = self.__generation
+        if not workers:
+            logger.info("Starting %d worker processes" % self.procs)
+            workers = [_Worker() for _ in xrange(0, self.procs)]
+        return (workers, generation)
+
+    def __give_back_workers(self, workers, generation):
+        with self.__lock:
+            if generation == self.__generation and not self.__workers:
+                self.__workers = workers
+                return
+        _stop_workers(workers)
+
+    def imap_unordered(self, func, iterable):
+        """
+        Run func(arg) for each element of 'iterable' in the workers.
+
+        Returns:
+            A generator returning the results, in the order they are
+            available. If it is not consumed entirely, it must be closed
+            (see generator.close()): its workers are then stopped.
+
+        Raises:
+            WorkerError if a task raised an exception or a worker died. The
+            workers are then stopped (they are started again by the next
+            call).
+        """
+        func_ref = (func.__module__, func.__name__)
+        # the lock is not held while the results are yielded: the caller
+        # may never resume this generator
+        (workers, generation) = self.__take_workers()
+        try:
+            args = iter(iterable)
+            exhausted = False
+            while True:
+                for worker in workers:
+                    while (not exhausted and worker.nb_pending
+                           < MAX_PENDING_PER_WORKER):
+                        try:
+                            arg = next(args)
+                        except StopIteration:
+                            exhausted = True
+                            break
+                        worker.send(func_ref, arg)
+                busy = dict((worker.process.stdout.fileno(), worker)
+                            for worker in workers
+                            if worker.nb_pending > 0)
+                if not busy:
+                    break
+                try:
+                    (readable, _, _) = select.select(busy.keys(), [], [])
+                except select.error, exc:
+                    if exc.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fd in readable:
+                    yield busy[fd].receive()
+        except BaseException:
+            # includes GeneratorExit: results may still be pending
+            _stop_workers(workers)
+            raise
+        self.__give_back_workers(workers, generation)
+
+    def close(self):
+        """
+        Stop the idle workers. Workers busy in imap_unordered() are stopped
+        once its generator is exhausted or closed.
+        """
+        with self.__lock:
+            workers = self.__workers
+            self.__workers = []
+            self.__generation += 1
+        _stop_workers(workers)
+
+
+def _stop_workers(workers):
+    for worker in workers:
+        worker.stop()
+
+
+def _worker_main():
+    """
+    Main loop of the workers: run the tasks until the standard input is
+    closed
+    """
+    fd_in = sys.stdin.fileno()
+    fd_out = os.dup(sys.stdout.fileno())
+    # anything printed by the tasks must not get mixed with the results
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    funcs = {}
+    while True:
+        try:
+            (func_ref, arg) = _read_msg(fd_in)
+        except EOFError:
+            break
+        try:
+            if func_ref not in funcs:
+                module = importlib.import_module(func_ref[0])
+                funcs[func_ref] = getattr(module, func_ref[1])
+            result = (True, funcs[func_ref](arg))
+        except Exception:
+            result = (False, traceback.format_exc())
+        _write_msg(fd_out, result)
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -17,6 +17,7 @@
 
 from copy import copy
 import gc
+import multiprocessing
 import os
 import sys
 import threading
@@ -63,6 +64,7 @@ from paperwork.backend.common.page import BasicPage, DummyPage
 from paperwork.backend.docsearch import DocSearch
 from paperwork.backend.docsearch import DummyDocSearch
 from paperwork.backend.img.doc import ImgDoc
+from paperwork.backend.watcher import start_workdir_watcher
 
 _ = gettext.gettext
 logger = logging.getLogger(__name__)
@@ -306,6 +308,11 @@ class JobIndexUpdater(Job):
     can_stop = True
     priority = 15
 
+    # above this number of documents to (re)index, their content is
+    # extracted by a pool of processes (see DocIndexUpdater.add_docs())
+    BULK_THRESHOLD = 50
+    BULK_CHUNK_SIZE = 200
+
     def __init__(self, factory, id, config, docsearch,
                  new_docs=set(), upd_docs=set(), del_docs=set(),
                  optimize=True):
@@ -351,13 +358,39 @@ class JobIndexUpdater(Job):
 
         if self.index_updater is None:
             self.emit('index-update-start')
+            procs = 1
+            if len(self.new_docs) + len(self.upd_docs) >= self.BULK_THRESHOLD:
+                procs = multiprocessing.cpu_count()
             self.index_updater = self.__docsearch.get_index_updater(
-                optimize=self.optimize)
+                optimize=self.optimize, procs=procs)
 
         if not self.can_run:
             self.emit('index-update-interrupted')
             return
 
+        if self.index_updater.procs > 1:
+            bulk_docs = [
+                (_("Indexing new documents ..."), self.new_docs),
+                (_("Reindexing modified documents ..."), self.upd_docs),
+            ]
+            for (op_name, doc_bunch) in bulk_docs:
+                self.__bulk_op_name = op_name
+                while len(doc_bunch) > 0:
+                    if not self.can_run:
+                        self.emit('index-update-interrupted')
+                        return
+                    chunk = set()
+                    while (len(doc_bunch) > 0
+                           and len(chunk) < self.BULK_CHUNK_SIZE):
+                        chunk.add(doc_bunch.pop())
+                    self.emit('index-update-progression',
+                              (self.progression * 0.75) / self.total,
+                              op_name)
+                    self.__wait()
+                    self.index_updater.add_docs(
+                        chunk, progress_cb=self.__bulk_progress_cb)
+                    self.progression += len(chunk)
+
         docs = [
             (_("Indexing new document ..."), self.new_docs,
              self.index_updater.add_doc),
@@ -396,6 +429,13 @@ class JobIndexUpdater(Job):
         self.emit('index-update-progression', 1.0, "")
         self.emit('index-update-end')
 
+    def __bulk_progress_cb(self, progression, total, step, doc=None):
+        if progression % 10 != 0:
+            return
+        self.emit('index-update-progression',
+                  ((self.progression + progression) * 0.75) / self.total,
+                  "%s (%s)" % (self.__bulk_op_name, str(doc)))
+
     def stop(self, will_resume=False):
         self.can_run = False
         if not will_resume:
@@ -463,12 +503,17 @@ class JobDocSearcher(Job):
         'search-start': (GObject.SignalFlags.RUN_LAST, None, ()),
         # user made a typo
         'search-invalid': (GObject.SignalFlags.RUN_LAST, None, ()),
-        # array of documents
+        # array of documents, total number of matching documents
         'search-results': (GObject.SignalFlags.RUN_LAST, None,
                            # XXX(Jflesch): TYPE_STRING would turn the Unicode
                            # object into a string object
                            (GObject.TYPE_PYOBJECT,
+                            GObject.TYPE_PYOBJECT,
                             GObject.TYPE_PYOBJECT,)),
+        # array of documents (next page of results)
+        'search-more-results': (GObject.SignalFlags.RUN_LAST, None,
+                                (GObject.TYPE_PYOBJECT,
+                                 GObject.TYPE_PYOBJECT,)),
         # array of suggestions
         'search-suggestions': (GObject.SignalFlags.RUN_LAST, None,
                                (GObject.TYPE_PYOBJECT,)),
@@ -477,25 +522,33 @@ class JobDocSearcher(Job):
     can_stop = True
     priority = 500
 
-    def __init__(self, factory, id, config, docsearch, sort_func, search):
+    # number of documents fetched at once
+    PAGE_LEN = ProgressiveList.NB_EL_DISPLAYED_INITIALLY
+
+    def __init__(self, factory, id, config, docsearch, sorting_name, search,
+                 page_nb=0):
         Job.__init__(self, factory, id)
         self.search = search
+        self.page_nb = page_nb
         self.__docsearch = docsearch
-        self.__sort_func = sort_func
+        self.__sorting_name = sorting_name
         self.__config = config
 
     def do(self):
         self.can_run = True
 
-        self._wait(0.5)
-        if not self.can_run:
-            return
-
-        self.emit('search-start')
+        if self.page_nb == 0:
+            self._wait(0.5)
+            if not self.can_run:
+                return
+            self.emit('search-start')
 
         try:
-            logger.info("Searching: [%s]" % self.search)
-            documents = self.__docsearch.find_documents(self.search)
+            logger.info("Searching: [%s] (page %d)"
+                        % (self.search, self.page_nb))
+            (documents, total) = self.__docsearch.find_documents_page(
+                self.search, page_nb=self.page_nb, page_len=self.PAGE_LEN,
+                sort=self.__sorting_name)
         except Exception, exc:
             logger.error("Invalid search: [%s]" % self.search)
             logger.error("Exception was: %s: %s" % (type(exc), str(exc)))
@@ -504,15 +557,10 @@ class JobDocSearcher(Job):
         if not self.can_run:
             return
 
-        if self.search == u"":
-            # when no specific search has been done, the sorting is always
-            # the same
-            sort_documents_by_date(documents)
-        else:
-            self.__sort_func(documents)
-        if not self.can_run:
+        if self.page_nb > 0:
+            self.emit('search-more-results', self.search, documents)
             return
-        self.emit('search-results', self.search, documents)
+        self.emit('search-results', self.search, documents, total)
 
         suggestions = self.__docsearch.find_suggestions(self.search)
         if not self.can_run:
@@ -533,14 +581,18 @@ class JobFactoryDocSearcher(JobFactory):
         self.__main_win = main_win
         self.__config = config
 
-    def make(self, docsearch, sort_func, search_sentence):
+    def make(self, docsearch, sorting_name, search_sentence, page_nb=0):
         job = JobDocSearcher(self, next(self.id_generator), self.__config,
-                             docsearch, sort_func, search_sentence)
+                             docsearch, sorting_name, search_sentence, page_nb)
         job.connect('search-start', lambda searcher:
                     GLib.idle_add(self.__main_win.on_search_start_cb))
         job.connect('search-results',
-                    lambda searcher, search, documents:
+                    lambda searcher, search, documents, total:
                     GLib.idle_add(self.__main_win.on_search_results_cb,
+                                  search, documents, total))
+        job.connect('search-more-results',
+                    lambda searcher, search, documents:
+                    GLib.idle_add(self.__main_win.on_search_more_results_cb,
                                   search, documents))
         job.connect('search-invalid',
                     lambda searcher: GLib.idle_add(
@@ -554,11 +606,13 @@ class JobFactoryDocSearcher(JobFactory):
 
 class JobLabelPredictor(Job):
     """
-    Predicts what labels should be on a document
+    Predicts what labels should be on documents. All the documents are
+    handled at once. The signal 'predicted-labels' is emitted for each of
+    them.
     """
 
     __gsignals__ = {
-        # array of labels (strings)
+        # array of labels (strings), best ones first
         'predicted-labels': (GObject.SignalFlags.RUN_LAST, None,
                              (
                                  GObject.TYPE_PYOBJECT,  # doc
@@ -569,10 +623,10 @@ class JobLabelPredictor(Job):
     can_stop = True
     priority = 10
 
-    def __init__(self, factory, id, docsearch, doc):
+    def __init__(self, factory, id, docsearch, docs):
         Job.__init__(self, factory, id)
         self.__docsearch = docsearch
-        self.doc = doc
+        self.docs = docs
 
     def _progress_cb(self, current, total):
         if not self.can_run:
@@ -581,9 +635,10 @@ class JobLabelPredictor(Job):
     def do(self):
         self.can_run = True
         try:
-            predicted_labels = self.__docsearch.predict_label_list(
-                self.doc, progress_cb=self._progress_cb)
-            self.emit('predicted-labels', self.doc, predicted_labels)
+            predicted_labels = self.__docsearch.predict_label_lists(
+                self.docs, progress_cb=self._progress_cb)
+            for (doc, labels) in zip(self.docs, predicted_labels):
+                self.emit('predicted-labels', doc, labels)
         except StopIteration:
             return
 
@@ -601,7 +656,7 @@ class JobFactoryLabelPredictorOnOpenDoc(JobFactory):
 
     def make(self, doc):
         job = JobLabelPredictor(self, next(self.id_generator),
-                                self.__main_win.docsearch, doc)
+                                self.__main_win.docsearch, [doc])
         job.connect('predicted-labels',
                     lambda predictor, doc, labels:
                     GLib.idle_add(self.__main_win.on_label_prediction_cb,
@@ -614,9 +669,9 @@ class JobFactoryLabelPredictorOnNewDoc(JobFactory):
         JobFactory.__init__(self, "Label predictor (on new doc)")
         self.__main_win = main_win
 
-    def make(self, doc):
+    def make(self, docs):
         job = JobLabelPredictor(self, next(self.id_generator),
-                                self.__main_win.docsearch, doc)
+                                self.__main_win.docsearch, docs)
         return job
 
 
@@ -636,14 +691,24 @@ class JobPageThumbnailer(Job):
     can_stop = True
     priority = 400
 
-    def __init__(self, factory, id, doc, search):
+    def __init__(self, factory, id, docsearch, doc, search):
         Job.__init__(self, factory, id)
+        self.__docsearch = docsearch
         self.__doc = doc
         self.__search = search
+        # page numbers (None if the document is not indexed)
+        self.__matching_pages = None
 
         self.__current_idx = -1
         self.done = False
 
+    def __is_matching(self, page):
+        if self.__search == u"":
+            return False
+        if self.__matching_pages is not None:
+            return page.page_nb in self.__matching_pages
+        return self.__search in page
+
     def do(self):
         if self.done:
             return
@@ -660,6 +725,9 @@ class JobPageThumbnailer(Job):
         if self.__current_idx < 0:
             self.emit('page-thumbnailing-start')
             self.__current_idx = 0
+            if self.__search != u"":
+                self.__matching_pages = self.__docsearch.find_pages(
+                    self.__search, self.__doc)
 
         for page_idx in xrange(self.__current_idx, nb_pages):
             page = pages[page_idx]
@@ -667,7 +735,7 @@ class JobPageThumbnailer(Job):
                                      BasicPage.DEFAULT_THUMB_HEIGHT)
             img = img.copy()
 
-            if self.__search != u"" and self.__search in page:
+            if self.__is_matching(page):
                 img = add_img_border(img, color="#009e00", width=3)
             else:
                 img = add_img_border(img)
@@ -701,7 +769,8 @@ class JobFactoryPageThumbnailer(JobFactory):
         self.__main_win = main_win
 
     def make(self, doc, search):
-        job = JobPageThumbnailer(self, next(self.id_generator), doc, search)
+        job = JobPageThumbnailer(self, next(self.id_generator),
+                                 self.__main_win.docsearch, doc, search)
         job.connect('page-thumbnailing-start',
                     lambda thumbnailer:
                     GLib.idle_add(
@@ -1237,16 +1306,15 @@ class JobImporter(Job):
                 self._docs_to_label_predict.add(doc)
 
         def _predict_labels(self):
-            for doc in self._docs_to_label_predict:
-                logger.info("Predicting labels on doc %s"
-                            % str(doc))
-                factory = self._main_win.job_factories[
-                    'label_predictor_on_new_doc'
-                ]
-                job = factory.make(doc)
-                job.connect("predicted-labels",
-                            self._on_predicted_labels)
-                self._main_win.schedulers['main'].schedule(job)
+            docs = list(self._docs_to_label_predict)
+            logger.info("Predicting labels on %d docs" % len(docs))
+            factory = self._main_win.job_factories[
+                'label_predictor_on_new_doc'
+            ]
+            job = factory.make(docs)
+            job.connect("predicted-labels",
+                        self._on_predicted_labels)
+            self._main_win.schedulers['main'].schedule(job)
 
         def _on_predicted_labels(self, predictor, doc, predicted_labels):
             GLib.idle_add(self._on_predicted_labels2, doc, predicted_labels)
@@ -2456,6 +2524,8 @@ class MainWindow(object):
         self.__scan_progress_job = None
 
         self.docsearch = DummyDocSearch()
+        self.workdir_watcher = None
+        self.__search_next_page = 1
         self.doc = ImgDoc(self.__config['workdir'].value)
         self.new_doc = self.doc
 
@@ -2510,6 +2580,9 @@ class MainWindow(object):
         self.lists['matches'].connect(
             'lines-shown',
             lambda x, docs: GLib.idle_add(self.__on_doc_lines_shown, docs))
+        self.lists['matches'].connect(
+            'more-needed',
+            lambda x, nb_docs: GLib.idle_add(self.__on_doc_list_more_needed))
 
         search_completion.set_model(self.lists['suggestions']['model'])
         search_completion.set_text_column(0)
@@ -3118,6 +3191,52 @@ class MainWindow(object):
         self.docsearch = docsearch
         self.refresh_doc_list()
         self.refresh_label_list()
+        self.__update_workdir_watcher(docsearch)
+
+    def __update_workdir_watcher(self, docsearch):
+        watcher = self.workdir_watcher
+        if watcher is not None and watcher.rootdir == docsearch.rootdir:
+            # the index has been reloaded: only the catalog changed
+            watcher.docsearch = docsearch
+            return
+        if watcher is not None:
+            watcher.stop()
+        self.workdir_watcher = start_workdir_watcher(
+            docsearch,
+            lambda new_docids, upd_docids, del_docids: GLib.idle_add(
+                self.on_workdir_changes_cb, new_docids, upd_docids,
+                del_docids))
+
+    def on_workdir_changes_cb(self, new_docids, upd_docids, del_docids):
+        """
+        Called when documents have been added, modified or deleted in the
+        work directory by another application (see backend.watcher)
+        """
+        docsearch = self.docsearch
+        new_docs = set()
+        upd_docs = set()
+        for docid in new_docids:
+            doc = docsearch.get_doc_from_docid(docid)
+            if doc is not None:
+                new_docs.add(doc)
+        for docid in upd_docids:
+            doc = docsearch.get_doc_from_docid(docid)
+            if doc is not None:
+                doc.drop_cache()
+                upd_docs.add(doc)
+
+        # the document list is reloaded from the catalog once the index is
+        # updated
+        job = self.job_factories['index_updater'].make(
+            docsearch=docsearch,
+            new_docs=new_docs,
+            upd_docs=upd_docs,
+            del_docs=set(del_docids),
+            optimize=False,
+            reload_all=True,
+            reload_thumbnails=True
+        )
+        self.schedulers['main'].schedule(job)
 
     def on_doc_examination_start_cb(self, src):
         self.set_progression(src, 0.0, None)
@@ -3154,15 +3273,18 @@ class MainWindow(object):
         self.lists['doclist'] = []
         self.lists['matches'].set_model([])
 
-    def on_search_results_cb(self, search, documents):
+    def on_search_results_cb(self, search, documents, total):
         self.schedulers['main'].cancel_all(
             self.job_factories['doc_thumbnailer'])
 
-        logger.debug("Got %d documents" % len(documents))
+        logger.debug("Got %d documents (out of %d)"
+                     % (len(documents), total))
+        self.__search_next_page = 1
 
         if search == u"":
             new_doc = self.get_new_doc()
             documents = [new_doc] + documents
+            total += 1
 
         doc_cp = []
         for doc in documents:
@@ -3184,9 +3306,30 @@ class MainWindow(object):
 
         self.lists['doclist'] = documents
         self.lists['matches'].set_model([self.__get_doc_model_line(doc)
-                                         for doc in documents])
+                                         for doc in documents], total)
         self.lists['matches'].select_idx(active_idx)
 
+    def on_search_more_results_cb(self, search, documents):
+        current_search = unicode(self.search_field.get_text(),
+                                 encoding='utf-8')
+        if search != current_search:
+            return
+        logger.debug("Got %d more documents" % len(documents))
+        self.__search_next_page += 1
+
+        doc_list = set(self.lists['doclist'])
+        documents = [doc for doc in documents if doc not in doc_list]
+        self.lists['doclist'].extend(documents)
+        self.lists['matches'].extend([self.__get_doc_model_line(doc)
+                                      for doc in documents])
+
+    def __on_doc_list_more_needed(self):
+        search = unicode(self.search_field.get_text(), encoding='utf-8')
+        job = self.job_factories['searcher'].make(
+            self.docsearch, self.get_doc_sorting()[0], search,
+            page_nb=self.__search_next_page)
+        self.schedulers['main'].schedule(job)
+
     def on_search_suggestions_cb(self, suggestions):
         logger.debug("Got %d suggestions" % len(suggestions))
         self.lists['suggestions']['gui'].freeze_child_notify()
@@ -3414,7 +3557,7 @@ class MainWindow(object):
         self.schedulers['main'].cancel_all(self.job_factories['searcher'])
         search = unicode(self.search_field.get_text(), encoding='utf-8')
         job = self.job_factories['searcher'].make(
-            self.docsearch, self.get_doc_sorting()[1], search)
+            self.docsearch, self.get_doc_sorting()[0], search)
         self.schedulers['main'].schedule(job)
 
     def __get_page_model_line(self, page):
@@ -3568,6 +3711,11 @@ class MainWindow(object):
 
         if doc.nb_pages > 0:
             page = doc.pages[0]
+            if search != u"":
+                # jump to the first page matching the search
+                matching_pages = self.docsearch.find_pages(search, doc)
+                if matching_pages and matching_pages[0] < doc.nb_pages:
+                    page = doc.pages[matching_pages[0]]
         else:
             page = DummyPage(self.doc)
         self.show_page(page)
@@ -3836,7 +3984,7 @@ class MainWindow(object):
         for (widget, sort_func, sorting_name) in self.sortings:
             if widget.get_active():
                 return (sorting_name, sort_func)
-        return (self.sortings[0][0], self.sortings[0][1])
+        return (self.sortings[0][2], self.sortings[0][1])
 
     def __get_show_all_boxes(self):
         return self.__show_all_boxes
@@ -3927,7 +4075,7 @@ class MainWindow(object):
 
         if new:
             factory = self.job_factories['label_predictor_on_new_doc']
-            job = factory.make(doc)
+            job = factory.make([doc])
             job.connect("predicted-labels", lambda predictor, d, predicted:
                         GLib.idle_add(self.__on_predicted_labels, doc,
                                       predicted))
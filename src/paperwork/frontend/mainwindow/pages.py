@@ -23,6 +23,7 @@ from gi.repository import PangoCairo
 import PIL.Image
 
 from paperwork.backend.util import image2surface
+from paperwork.backend.util import LRUCache
 from paperwork.backend.util import split_words
 from paperwork.frontend.util.canvas.animations import SpinnerAnimation
 from paperwork.frontend.util.canvas.drawers import Drawer
@@ -30,6 +31,10 @@ from paperwork.frontend.util.jobs import Job
 from paperwork.frontend.util.jobs import JobFactory
 
 
+# number of pages whose boxes are kept in memory (see JobPageBoxesLoader)
+BOX_INDEX_CACHE_SIZE = 64
+
+
 class JobPageImgLoader(Job):
     can_stop = False
     priority = 500
@@ -76,6 +81,46 @@ class JobFactoryPageImgLoader(JobFactory):
         return job
 
 
+class BoxIndex(object):
+    """
+    Inverted index of the word boxes of a page: keyword --> boxes.
+    Built once when the boxes are loaded, so highlighting the boxes matching
+    a sentence doesn't require splitting the content of all the boxes again.
+    """
+
+    def __init__(self, boxes):
+        self.__boxes = {}  # word --> set of boxes
+        self.__found = {}  # keyword --> set of boxes (see find())
+        for box in boxes:
+            for word in split_words(box.content):
+                if word not in self.__boxes:
+                    self.__boxes[word] = set()
+                self.__boxes[word].add(box)
+
+    def find(self, keyword):
+        """
+        Look for the boxes of the words containing the keyword. Only the
+        distinct words of the page are scanned, and the result is kept for
+        the next calls.
+
+        Returns:
+            The set of boxes found. Must not be modified.
+        """
+        if keyword in self.__found:
+            return self.__found[keyword]
+        output = set()
+        for (word, boxes) in self.__boxes.iteritems():
+            if keyword in word:
+                output.update(boxes)
+        self.__found[keyword] = output
+        return output
+
+
+# pageid --> (page last modification, boxes, BoxIndex), so the boxes of the
+# pages displayed again are not reloaded and indexed again
+_box_indexes = LRUCache(BOX_INDEX_CACHE_SIZE)
+
+
 class JobPageBoxesLoader(Job):
     can_stop = True
     priority = 100
@@ -85,6 +130,7 @@ class JobPageBoxesLoader(Job):
         'page-loading-boxes': (GObject.SignalFlags.RUN_LAST, None,
                                (
                                    GObject.TYPE_PYOBJECT,  # all boxes
+                                   GObject.TYPE_PYOBJECT,  # BoxIndex
                                )),
         'page-loading-done': (GObject.SignalFlags.RUN_LAST, None, ()),
     }
@@ -98,7 +144,16 @@ class JobPageBoxesLoader(Job):
         self.can_run = True
         self.emit('page-loading-start')
         try:
-            line_boxes = self.page.boxes
+            last_mod = self.page.last_mod
+            cached = _box_indexes.get(self.page.pageid)
+            if cached is None or cached[0] != last_mod:
+                line_boxes = self.page.boxes
+                boxes = []
+                for line in line_boxes:
+                    boxes += line.word_boxes
+                cached = (last_mod, boxes, BoxIndex(boxes))
+                _box_indexes.put(self.page.pageid, cached)
+            (_, boxes, box_index) = cached
 
             self.__cond.acquire()
             try:
@@ -108,11 +163,7 @@ class JobPageBoxesLoader(Job):
             if not self.can_run:
                 self.emit('page-loading-done')
 
-            boxes = []
-            for line in line_boxes:
-                boxes += line.word_boxes
-
-            self.emit('page-loading-boxes', boxes)
+            self.emit('page-loading-boxes', boxes, box_index)
         finally:
             self.emit('page-loading-done')
 
@@ -136,9 +187,9 @@ class JobFactoryPageBoxesLoader(JobFactory):
     def make(self, drawer, page):
         job = JobPageBoxesLoader(self, next(self.id_generator), page)
         job.connect('page-loading-boxes',
-                    lambda job, all_boxes:
+                    lambda job, all_boxes, box_index:
                     GLib.idle_add(drawer.on_page_loading_boxes,
-                                  job.page, all_boxes))
+                                  job.page, all_boxes, box_index))
         return job
 
 
@@ -160,6 +211,7 @@ class PageDrawer(Drawer):
         self.surface = None
         self.boxes = {
             'all': [],
+            'index': None,  # BoxIndex
             'highlighted': [],
             'mouse_over': None,
         }
@@ -256,16 +308,10 @@ class PageDrawer(Drawer):
             keywords = sentence
 
         output = set()
+        if self.boxes['index'] is None:
+            return output
         for keyword in keywords:
-            for box in self.boxes["all"]:
-                if keyword in box.content:
-                    output.add(box)
-                    continue
-                # unfold generator output
-                words = [x for x in split_words(box.content)]
-                if keyword in words:
-                    output.add(box)
-                    continue
+            output.update(self.boxes['index'].find(keyword))
         return output
 
     def reload_boxes(self, new_sentence=None):
@@ -274,10 +320,11 @@ class PageDrawer(Drawer):
         self.boxes["highlighted"] = self._get_highlighted_boxes(self.sentence)
         self.redraw()
 
-    def on_page_loading_boxes(self, page, all_boxes):
+    def on_page_loading_boxes(self, page, all_boxes, box_index):
         if not self.visible:
             return
         self.boxes['all'] = all_boxes
+        self.boxes['index'] = box_index
         self.reload_boxes()
 
     def unload_content(self):
@@ -289,6 +336,7 @@ class PageDrawer(Drawer):
             self.surface = None
         self.boxes = {
             'all': [],
+            'index': None,  # BoxIndex
             'highlighted': [],
             'mouse_over': None,
         }
@@ -73,6 +73,12 @@ class ProgressiveList(GObject.GObject):
 
     So instead, we display only X elements. When the user scroll down,
     we add Y elements to the list, etc.
+
+    The content of the list may itself be loaded progressively: if the
+    total number of elements given to set_model() is higher than the number
+    of elements actually provided, the signal 'more-needed' is emitted when
+    the user reaches the end of the list. The next elements must then be
+    provided with extend().
     """
 
     NB_EL_DISPLAYED_INITIALLY = 100
@@ -84,6 +90,8 @@ class ProgressiveList(GObject.GObject):
     __gsignals__ = {
         'lines-shown': (GObject.SignalFlags.RUN_LAST, None,
                         (GObject.TYPE_PYOBJECT, )),  # [(line_idx, obj), ... ]
+        'more-needed': (GObject.SignalFlags.RUN_LAST, None,
+                        (GObject.TYPE_INT, )),  # nb elements already provided
     }
 
     def __init__(self, name,
@@ -117,6 +125,8 @@ class ProgressiveList(GObject.GObject):
         self.model_nb_columns = model_nb_columns
 
         self.nb_displayed = 0
+        self.total = None
+        self.__more_needed = False
 
         self._vadjustment.connect(
             "value-changed",
@@ -124,8 +134,15 @@ class ProgressiveList(GObject.GObject):
 
         self.job_factory = JobFactoryProgressiveList(self)
 
-    def set_model(self, model_content):
+    def set_model(self, model_content, total=None):
+        """
+        Arguments:
+            total --- total number of elements in the list, if only the first
+                ones are provided in model_content (see extend())
+        """
         self.model_content = model_content
+        self.total = total
+        self.__more_needed = False
 
         self.widget_gui.freeze_child_notify()
         self.widget_gui.set_model(None)
@@ -137,6 +154,19 @@ class ProgressiveList(GObject.GObject):
             self.widget_gui.freeze_child_notify()
             self.widget_gui.set_model(self.model)
 
+    def extend(self, model_lines):
+        """
+        Provide the next elements of the list (see 'more-needed')
+        """
+        self.model_content.extend(model_lines)
+        self.__more_needed = False
+        self.display_extra()
+
+    def get_total(self):
+        if self.total is None:
+            return len(self.model_content)
+        return max(self.total, len(self.model_content))
+
     def display_extra(self):
         for action in self.actions:
             action.enabled = False
@@ -188,7 +218,7 @@ class ProgressiveList(GObject.GObject):
 
         self.emit('lines-shown', newly_displayed)
 
-        if nb_elements < len(self.model_content):
+        if self.nb_displayed < self.get_total():
             padding = [None] * (self.model_nb_columns - 2)
             model_line = [_("Loading ..."), self.default_thumbnail]
             model_line += padding
@@ -198,7 +228,7 @@ class ProgressiveList(GObject.GObject):
                     % (self.name, self.nb_displayed, len(newly_displayed)))
 
     def __on_scrollbar_moved(self):
-        if self.nb_displayed >= len(self.model_content):
+        if self.nb_displayed >= self.get_total():
             return
 
         lower = self._vadjustment.get_lower()
@@ -207,6 +237,11 @@ class ProgressiveList(GObject.GObject):
         proportion = (val - lower) / (upper - lower)
 
         if proportion > self.NB_EL_DISPLAY_EXTRA_WHEN_LOWER_THAN:
+            if self.nb_displayed >= len(self.model_content):
+                if not self.__more_needed:
+                    self.__more_needed = True
+                    self.emit('more-needed', len(self.model_content))
+                return
             self.scheduler.cancel_all(self.job_factory)
             job = self.job_factory.make()
             self.scheduler.schedule(job)
@@ -224,12 +259,16 @@ class ProgressiveList(GObject.GObject):
 
     def pop(self, idx):
         content = self.model_content.pop(idx)
+        if self.total is not None:
+            self.total -= 1
         itr = self.model.get_iter(idx)
         self.model.remove(itr)
         return content
 
     def insert(self, idx, line):
         self.model_content.insert(idx, line)
+        if self.total is not None:
+            self.total += 1
         self.model.insert(idx, line)
 
     def select_idx(self, idx=-1):
@@ -30,6 +30,8 @@ import signal
 
 from frontend.mainwindow import ActionRefreshIndex, MainWindow
 from frontend.util.config import load_config
+from paperwork.backend.pdf.rendercache import get_default_spill_dir
+from paperwork.backend.pdf.rendercache import get_render_cache
 
 
 logger = logging.getLogger(__name__)
@@ -103,6 +105,8 @@ def main():
                              Gtk.main_quit, None)
 
     try:
+        get_render_cache().set_spill_dir(get_default_spill_dir())
+
         config = load_config()
         config.read()
 
@@ -110,11 +114,14 @@ def main():
         ActionRefreshIndex(main_win, config).do()
         Gtk.main()
 
+        if main_win.workdir_watcher is not None:
+            main_win.workdir_watcher.stop()
         for scheduler in main_win.schedulers.values():
             scheduler.stop()
 
         config.write()
     finally:
+        get_render_cache().set_spill_dir(None)
         logger.info("Good bye")
 
 
@@ -0,0 +1,106 @@
+"""
+Tests of paperwork.backend.boxfile (binary copies of the box files)
+"""
+
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+import pyocr.builders
+
+from paperwork.backend import boxfile
+
+
+def make_line(words, y):
+    word_boxes = []
+    x = 0
+    for word in words:
+        word_box = pyocr.builders.Box(word, ((x, y), (x + 10, y + 10)))
+        word_box.confidence = 90
+        word_boxes.append(word_box)
+        x += 20
+    return pyocr.builders.LineBox(word_boxes, ((0, y), (x, y + 10)))
+
+
+LINES = [
+    make_line([u"Hello", u"world"], 0),
+    make_line([u"\xc9t\xe9", u"caf\xe9", u"na\xefve"], 20),
+    make_line([u"x"], 40),
+]
+
+
+class TestBoxFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.words_path = os.path.join(self.tmpdir, "paper.1.words")
+        self.box_path = os.path.join(self.tmpdir, "paper.1.boxes")
+        with codecs.open(self.words_path, 'w', encoding='utf-8') as fd:
+            pyocr.builders.LineBoxBuilder().write_file(fd, LINES)
+
+    def tearDown(self):
+        boxfile.forget_box_file(self.box_path)
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        words_stats = os.stat(self.words_path)
+        boxfile.write_box_file(self.box_path, LINES, words_stats)
+        box_file = boxfile.BoxFile(self.box_path)
+        self.assertTrue(box_file.matches(words_stats))
+
+        lines = box_file.get_boxes()
+        self.assertEqual(len(lines), len(LINES))
+        for (line, expected) in zip(lines, LINES):
+            self.assertEqual(line.position, expected.position)
+            self.assertEqual(
+                [(box.content, box.position, box.confidence)
+                 for box in line.word_boxes],
+                [(box.content, box.position, box.confidence)
+                 for box in expected.word_boxes])
+
+    def test_text(self):
+        boxfile.write_box_file(self.box_path, LINES,
+                               os.stat(self.words_path))
+        box_file = boxfile.BoxFile(self.box_path)
+        self.assertEqual(box_file.get_text(), [
+            u" Hello world",
+            u" \xc9t\xe9 caf\xe9 na\xefve",
+            u" x",
+        ])
+
+    def test_empty(self):
+        boxfile.write_box_file(self.box_path, [], os.stat(self.words_path))
+        box_file = boxfile.BoxFile(self.box_path)
+        self.assertEqual(box_file.get_boxes(), [])
+        self.assertEqual(box_file.get_text(), [])
+
+    def test_invalid(self):
+        with open(self.box_path, 'wb') as file_desc:
+            file_desc.write("not a box file at all, but long enough ....")
+        self.assertRaises(ValueError, boxfile.BoxFile, self.box_path)
+        with open(self.box_path, 'wb') as file_desc:
+            file_desc.write("PWBX")
+        self.assertRaises(ValueError, boxfile.BoxFile, self.box_path)
+
+    def test_get_box_file(self):
+        box_file = boxfile.get_box_file(self.words_path, self.box_path)
+        self.assertTrue(os.path.exists(self.box_path))
+        self.assertEqual(len(box_file.get_boxes()), len(LINES))
+
+        # the .words file changes: the binary copy must be regenerated
+        with codecs.open(self.words_path, 'w', encoding='utf-8') as fd:
+            pyocr.builders.LineBoxBuilder().write_file(fd, LINES[:1])
+        stats = os.stat(self.words_path)
+        os.utime(self.words_path, (stats.st_atime, stats.st_mtime + 10))
+        box_file = boxfile.get_box_file(self.words_path, self.box_path)
+        self.assertEqual(len(box_file.get_boxes()), 1)
+
+    def test_get_box_file_missing(self):
+        os.unlink(self.words_path)
+        self.assertEqual(
+            boxfile.get_box_file(self.words_path, self.box_path), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
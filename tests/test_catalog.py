@@ -0,0 +1,107 @@
+"""
+Tests of paperwork.backend.catalog
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from paperwork.backend.catalog import DocCatalog
+from paperwork.backend.catalog import get_doc_fingerprint
+
+
+class TestDocFingerprint(unittest.TestCase):
+    STATS = {
+        "paper.1.jpg": (1000.0, 200),
+        "paper.1.words": (1000.5, 50),
+        "labels": (1001.0, 10),
+    }
+
+    def test_stable(self):
+        self.assertEqual(get_doc_fingerprint(dict(self.STATS)),
+                         get_doc_fingerprint(dict(self.STATS)))
+
+    def test_modified_file(self):
+        stats = dict(self.STATS)
+        stats["paper.1.words"] = (1002.0, 50)
+        self.assertNotEqual(get_doc_fingerprint(stats),
+                            get_doc_fingerprint(self.STATS))
+        stats = dict(self.STATS)
+        stats["paper.1.words"] = (1000.5, 51)
+        self.assertNotEqual(get_doc_fingerprint(stats),
+                            get_doc_fingerprint(self.STATS))
+
+    def test_added_file(self):
+        stats = dict(self.STATS)
+        stats["extra.txt"] = (1003.0, 5)
+        self.assertNotEqual(get_doc_fingerprint(stats),
+                            get_doc_fingerprint(self.STATS))
+
+    def test_generated_files_ignored(self):
+        stats = dict(self.STATS)
+        stats["paper.1.thumb.jpg"] = (1003.0, 5)
+        stats["paper.1.boxes"] = (1003.0, 5)
+        stats["paper.1.txt"] = (1003.0, 5)
+        stats["doc.pdf.info"] = (1003.0, 5)
+        self.assertEqual(get_doc_fingerprint(stats),
+                         get_doc_fingerprint(self.STATS))
+
+
+class TestDocCatalog(unittest.TestCase):
+    ENTRY = {
+        'doctype': u"Img",
+        'date': u"2014-01-02",
+        'nb_pages': 3,
+        'labels': [[u"bills", u"#ff0000"]],
+        'last_mod': 1000.5,
+        'docfilehash': u"ABCD",
+        'fingerprint': u"0123",
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_load(self):
+        catalog = DocCatalog(self.tmpdir)
+        catalog[u"20140102_0000_01"] = dict(self.ENTRY)
+        catalog.save(5)
+
+        catalog = DocCatalog(self.tmpdir)
+        self.assertTrue(catalog.load(5))
+        self.assertEqual(len(catalog), 1)
+        self.assertEqual(catalog[u"20140102_0000_01"], self.ENTRY)
+        self.assertEqual(catalog.generation, 5)
+
+    def test_other_generation(self):
+        catalog = DocCatalog(self.tmpdir)
+        catalog[u"20140102_0000_01"] = dict(self.ENTRY)
+        catalog.save(5)
+
+        catalog = DocCatalog(self.tmpdir)
+        self.assertFalse(catalog.load(6))
+        self.assertEqual(len(catalog), 0)
+
+    def test_missing(self):
+        catalog = DocCatalog(self.tmpdir)
+        self.assertFalse(catalog.load(1))
+        self.assertEqual(len(catalog), 0)
+
+    def test_delete_destroy(self):
+        catalog = DocCatalog(self.tmpdir)
+        catalog[u"a"] = dict(self.ENTRY)
+        catalog[u"b"] = dict(self.ENTRY)
+        del catalog[u"a"]
+        self.assertFalse(u"a" in catalog)
+        self.assertTrue(u"b" in catalog)
+        catalog.save(1)
+        catalog.destroy()
+        self.assertEqual(len(catalog), 0)
+        self.assertFalse(os.path.exists(catalog.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Tests of paperwork.backend.docsearch helpers
+"""
+
+import unittest
+
+from paperwork.backend.docsearch import fuse_ranked_lists
+from paperwork.backend.docsearch import guess_doctype
+
+
+class TestFuseRankedLists(unittest.TestCase):
+    def test_single_list(self):
+        self.assertEqual(fuse_ranked_lists([["a", "b", "c"]]),
+                         ["a", "b", "c"])
+
+    def test_agreement_wins(self):
+        # 'b' is second in both lists, 'a' and 'c' first in only one
+        fused = fuse_ranked_lists([["a", "b", "d"], ["c", "b", "e"]])
+        self.assertEqual(fused[0], "b")
+        self.assertEqual(set(fused), set(["a", "b", "c", "d", "e"]))
+
+    def test_ties_keep_first_appearance(self):
+        self.assertEqual(fuse_ranked_lists([["a"], ["b"]]), ["a", "b"])
+        self.assertEqual(fuse_ranked_lists([["b"], ["a"]]), ["b", "a"])
+
+    def test_no_duplicates(self):
+        fused = fuse_ranked_lists([["a", "b"], ["b", "a"], ["a"]])
+        self.assertEqual(fused, ["a", "b"])
+
+    def test_limit(self):
+        fused = fuse_ranked_lists([["a", "b", "c", "d"], ["d", "c"]],
+                                  limit=2)
+        self.assertEqual(len(fused), 2)
+        self.assertEqual(fused,
+                         fuse_ranked_lists([["a", "b", "c", "d"],
+                                            ["d", "c"]])[:2])
+
+    def test_empty(self):
+        self.assertEqual(fuse_ranked_lists([]), [])
+        self.assertEqual(fuse_ranked_lists([[], []]), [])
+
+
+class TestGuessDoctype(unittest.TestCase):
+    def test_pdf(self):
+        self.assertEqual(guess_doctype(["doc.pdf", "labels"]), u"PDF")
+
+    def test_img(self):
+        self.assertEqual(guess_doctype(["paper.1.jpg", "paper.1.words"]),
+                         u"Img")
+
+    def test_thumbnails_only(self):
+        self.assertEqual(guess_doctype(["paper.1.thumb.jpg"]), None)
+        self.assertEqual(guess_doctype([]), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""
+Tests of paperwork.backend.duplicates (MinHash signatures and LSH index)
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from paperwork.backend.duplicates import compute_minhash
+from paperwork.backend.duplicates import estimate_similarity
+from paperwork.backend.duplicates import NearDuplicateIndex
+
+
+TEXT = (u"Dear customer, please find enclosed the invoice for the services"
+        u" provided during the month of March. The total amount is due"
+        u" within thirty days of the date of this letter. Thank you for"
+        u" your trust and best regards from the whole accounting team")
+# a single word changed
+NEAR_TEXT = TEXT.replace(u"March", u"April")
+OTHER_TEXT = (u"The quick brown fox jumps over the lazy dog while the cat"
+              u" sleeps peacefully on the warm windowsill of the old house"
+              u" near the river where children play every sunny afternoon")
+
+
+class TestMinHash(unittest.TestCase):
+    def test_too_short(self):
+        self.assertEqual(compute_minhash(u""), None)
+        self.assertEqual(compute_minhash(u"two words"), None)
+
+    def test_identical(self):
+        self.assertEqual(estimate_similarity(compute_minhash(TEXT),
+                                             compute_minhash(TEXT)), 1.0)
+
+    def test_case_and_spaces(self):
+        self.assertEqual(
+            estimate_similarity(compute_minhash(TEXT),
+                                compute_minhash(u"  " + TEXT.upper())),
+            1.0)
+
+    def test_similarity(self):
+        near = estimate_similarity(compute_minhash(TEXT),
+                                   compute_minhash(NEAR_TEXT))
+        other = estimate_similarity(compute_minhash(TEXT),
+                                    compute_minhash(OTHER_TEXT))
+        self.assertTrue(near > 0.7)
+        self.assertTrue(other < 0.2)
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.index = NearDuplicateIndex(self.tmpdir)
+        self.index.set(u"doc_a", u"fp_a", compute_minhash(TEXT))
+        self.index.set(u"doc_b", u"fp_b", compute_minhash(NEAR_TEXT))
+        self.index.set(u"doc_c", u"fp_c", compute_minhash(OTHER_TEXT))
+        self.index.set(u"doc_d", u"fp_d", None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_near_duplicates(self):
+        results = self.index.find_near_duplicates(compute_minhash(TEXT),
+                                                  threshold=0.7,
+                                                  exclude=u"doc_a")
+        self.assertEqual([docid for (docid, similarity) in results],
+                         [u"doc_b"])
+
+    def test_remove(self):
+        self.index.remove(u"doc_b")
+        results = self.index.find_near_duplicates(compute_minhash(TEXT),
+                                                  threshold=0.7,
+                                                  exclude=u"doc_a")
+        self.assertEqual(results, [])
+        self.assertEqual(self.index.get_fingerprint(u"doc_b"), None)
+
+    def test_find_clusters(self):
+        self.index.set(u"doc_e", u"fp_e", compute_minhash(TEXT))
+        clusters = self.index.find_clusters(threshold=0.7)
+        self.assertEqual(clusters, [set([u"doc_a", u"doc_b", u"doc_e"])])
+
+    def test_save_load(self):
+        self.index.save()
+        index = NearDuplicateIndex(self.tmpdir)
+        index.load()
+        self.assertEqual(sorted(index.entries.keys()),
+                         [u"doc_a", u"doc_b", u"doc_c", u"doc_d"])
+        self.assertEqual(index.get_fingerprint(u"doc_c"), u"fp_c")
+        self.assertEqual(index.get_signature(u"doc_d"), None)
+        self.assertEqual(
+            list(index.get_signature(u"doc_a")),
+            list(compute_minhash(TEXT)))
+        results = index.find_near_duplicates(compute_minhash(NEAR_TEXT),
+                                             threshold=0.7,
+                                             exclude=u"doc_b")
+        self.assertEqual([docid for (docid, similarity) in results],
+                         [u"doc_a"])
+
+    def test_destroy(self):
+        self.index.save()
+        self.index.destroy()
+        index = NearDuplicateIndex(self.tmpdir)
+        index.load()
+        self.assertEqual(index.entries, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Tests of paperwork.backend.similarity ("more like this")
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from scipy import sparse
+
+from paperwork.backend.similarity import get_similarity_vectors
+from paperwork.backend.similarity import NB_COMPONENTS
+from paperwork.backend.similarity import SimilarityIndex
+
+
+NB_FEATURES = 10000
+
+
+def make_features(nb_docs, seed):
+    return sparse.rand(nb_docs, NB_FEATURES, density=0.01, format='csr',
+                       random_state=seed)
+
+
+class TestSimilarityVectors(unittest.TestCase):
+    def test_normalized(self):
+        vectors = get_similarity_vectors(make_features(5, 0))
+        self.assertEqual(vectors.shape, (5, NB_COMPONENTS))
+        self.assertEqual(vectors.dtype, numpy.float32)
+        norms = numpy.sqrt((vectors ** 2).sum(axis=1))
+        self.assertTrue(numpy.allclose(norms, 1.0, atol=1e-5))
+
+    def test_deterministic(self):
+        features = make_features(3, 1)
+        self.assertTrue(numpy.array_equal(get_similarity_vectors(features),
+                                          get_similarity_vectors(features)))
+
+    def test_empty_features(self):
+        vectors = get_similarity_vectors(sparse.csr_matrix((1, NB_FEATURES)))
+        self.assertFalse(numpy.isnan(vectors).any())
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.vectors = get_similarity_vectors(make_features(20, 2))
+        self.index = SimilarityIndex(self.tmpdir, features_version=1)
+        for (idx, vector) in enumerate(self.vectors):
+            self.index.set(u"doc_%d" % idx, u"fp_%d" % idx, vector)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def __expected(self, idx, k):
+        scores = self.vectors.dot(self.vectors[idx])
+        scores[idx] = -numpy.inf
+        return [u"doc_%d" % other for other in numpy.argsort(-scores)[:k]]
+
+    def test_find_similar(self):
+        results = self.index.find_similar(self.vectors[3], 5,
+                                          exclude=u"doc_3")
+        self.assertEqual([docid for (docid, score) in results],
+                         self.__expected(3, 5))
+
+    def test_find_similar_after_save(self):
+        # saving merges the pending vectors into the main matrix
+        self.index.save()
+        self.index.BLOCK_SIZE = 7  # several blocks
+        results = self.index.find_similar(self.vectors[3], 5,
+                                          exclude=u"doc_3")
+        self.assertEqual([docid for (docid, score) in results],
+                         self.__expected(3, 5))
+
+    def test_remove_update(self):
+        self.index.save()
+        self.index.remove(u"doc_4")
+        self.index.set(u"doc_5", u"fp_5b", self.vectors[3])
+        results = self.index.find_similar(self.vectors[3], 19,
+                                          exclude=u"doc_3")
+        docids = [docid for (docid, score) in results]
+        self.assertFalse(u"doc_4" in docids)
+        self.assertEqual(docids[0], u"doc_5")
+        self.assertEqual(len(docids), 18)
+        self.assertEqual(self.index.fingerprints[u"doc_5"], u"fp_5b")
+
+    def test_save_load(self):
+        self.index.remove(u"doc_0")
+        self.index.save()
+        index = SimilarityIndex(self.tmpdir, features_version=1)
+        index.load()
+        self.assertFalse(u"doc_0" in index)
+        self.assertTrue(u"doc_1" in index)
+        self.assertEqual(index.fingerprints[u"doc_1"], u"fp_1")
+        self.assertTrue(numpy.allclose(index.get_vector(u"doc_1"),
+                                       self.vectors[1]))
+
+    def test_other_features_version(self):
+        self.index.save()
+        index = SimilarityIndex(self.tmpdir, features_version=2)
+        index.load()
+        self.assertFalse(u"doc_1" in index)
+
+
+if __name__ == "__main__":
+    unittest.main()
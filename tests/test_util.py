@@ -0,0 +1,117 @@
+"""
+Tests of paperwork.backend.util: LRUCache, BloomFilter, get_dir_stats()
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from paperwork.backend.util import BloomFilter
+from paperwork.backend.util import get_dir_stats
+from paperwork.backend.util import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = LRUCache(10)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("b", 42), 42)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_evicts_least_recently_used(self):
+        evicted = []
+        cache = LRUCache(2, on_evict=lambda key, value:
+                         evicted.append((key, value)))
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")  # 'b' is now the least recently used
+        cache.put("c", 3)
+        self.assertEqual(evicted, [("b", 2)])
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertTrue("c" in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_weigh(self):
+        cache = LRUCache(10, weigh=len)
+        cache.put("a", "xxxx")
+        cache.put("b", "xxxx")
+        self.assertEqual(cache.size, 8)
+        cache.put("c", "xxxx")
+        self.assertEqual(cache.size, 8)
+        self.assertFalse("a" in cache)
+
+    def test_replace_entry(self):
+        cache = LRUCache(10, weigh=len)
+        cache.put("a", "xxxx")
+        cache.put("a", "xx")
+        self.assertEqual(cache.size, 2)
+        self.assertEqual(cache.get("a"), "xx")
+
+    def test_too_big(self):
+        cache = LRUCache(4, weigh=len)
+        cache.put("a", "xx")
+        cache.put("b", "xxxxxxxx")
+        self.assertFalse("b" in cache)
+        self.assertTrue("a" in cache)
+
+    def test_pop_clear(self):
+        cache = LRUCache(10, weigh=len)
+        cache.put("a", "xxx")
+        cache.put("b", "xxx")
+        self.assertEqual(cache.pop("a"), "xxx")
+        self.assertEqual(cache.pop("a"), None)
+        self.assertEqual(cache.size, 3)
+        cache.clear()
+        self.assertEqual(cache.size, 0)
+        self.assertEqual(len(cache), 0)
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negative(self):
+        bloom = BloomFilter(1000)
+        values = [u"value %d" % idx for idx in xrange(0, 1000)]
+        for value in values:
+            bloom.add(value)
+        for value in values:
+            self.assertTrue(value in bloom)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for idx in xrange(0, 1000):
+            bloom.add("in %d" % idx)
+        false_positives = len([idx for idx in xrange(0, 10000)
+                               if ("out %d" % idx) in bloom])
+        # expected: ~1%
+        self.assertTrue(false_positives < 300)
+
+    def test_empty(self):
+        bloom = BloomFilter(0)
+        self.assertFalse("abc" in bloom)
+
+
+class TestGetDirStats(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_files_only(self):
+        with open(os.path.join(self.tmpdir, "a.txt"), "w") as file_desc:
+            file_desc.write("abc")
+        os.mkdir(os.path.join(self.tmpdir, "subdir"))
+        stats = get_dir_stats(self.tmpdir)
+        self.assertEqual(stats.keys(), ["a.txt"])
+        self.assertEqual(stats["a.txt"][1], 3)
+
+    def test_not_a_directory(self):
+        self.assertEqual(
+            get_dir_stats(os.path.join(self.tmpdir, "missing")), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+"""
+Tests of paperwork.backend.watcher. Only the polling watcher is used: it
+doesn't require inotify nor a GLib main loop.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from paperwork.backend.catalog import DocCatalog
+from paperwork.backend.catalog import get_doc_fingerprint
+from paperwork.backend.util import get_dir_stats
+from paperwork.backend.watcher import PollingWorkdirWatcher
+
+
+class FakeDocSearch(object):
+    def __init__(self, rootdir, indexdir):
+        self.rootdir = rootdir
+        self.catalog = DocCatalog(indexdir)
+
+
+class TestPollingWorkdirWatcher(unittest.TestCase):
+    def setUp(self):
+        self.rootdir = tempfile.mkdtemp()
+        self.indexdir = tempfile.mkdtemp()
+        self.docsearch = FakeDocSearch(self.rootdir, self.indexdir)
+        self.changes = []
+        for docid in ("doc_a", "doc_b"):
+            self.__write(docid, "paper.1.jpg", "img")
+            self.__add_to_catalog(docid)
+
+    def tearDown(self):
+        shutil.rmtree(self.rootdir)
+        shutil.rmtree(self.indexdir)
+
+    def __write(self, docid, filename, content):
+        docpath = os.path.join(self.rootdir, docid)
+        if not os.path.isdir(docpath):
+            os.mkdir(docpath)
+        with open(os.path.join(docpath, filename), "w") as file_desc:
+            file_desc.write(content)
+
+    def __add_to_catalog(self, docid, fingerprint=True):
+        if fingerprint:
+            fingerprint = get_doc_fingerprint(
+                get_dir_stats(os.path.join(self.rootdir, docid)))
+        else:
+            fingerprint = None
+        self.docsearch.catalog[docid] = {
+            'doctype': u"Img",
+            'date': u"2014-01-01",
+            'nb_pages': 1,
+            'labels': [],
+            'last_mod': 0.0,
+            'docfilehash': u"0",
+            'fingerprint': fingerprint,
+        }
+
+    def __make_watcher(self):
+        return PollingWorkdirWatcher(
+            self.docsearch,
+            lambda new, upd, deleted: self.changes.append(
+                (new, upd, deleted)))
+
+    def test_no_change(self):
+        watcher = self.__make_watcher()
+        watcher.poll()
+        watcher.flush(force=True)
+        self.assertEqual(self.changes, [])
+
+    def test_changes(self):
+        watcher = self.__make_watcher()
+        self.__write("doc_a", "paper.1.words", "<html/>")
+        self.__write("doc_c", "paper.1.jpg", "img")
+        shutil.rmtree(os.path.join(self.rootdir, "doc_b"))
+        watcher.poll()
+        watcher.flush(force=True)
+        self.assertEqual(self.changes,
+                         [(set(["doc_c"]), set(["doc_a"]), set(["doc_b"]))])
+
+    def test_not_a_doc(self):
+        watcher = self.__make_watcher()
+        self.__write("not_a_doc", "something.txt", "abc")
+        watcher.poll()
+        watcher.flush(force=True)
+        self.assertEqual(self.changes, [])
+
+    def test_debounce(self):
+        watcher = self.__make_watcher()
+        watcher.debounce = 3600
+        self.__write("doc_c", "paper.1.jpg", "img")
+        watcher.poll()
+        watcher.flush()
+        self.assertEqual(self.changes, [])
+        watcher.flush(force=True)
+        self.assertEqual(len(self.changes), 1)
+
+    def test_unknown_fingerprints(self):
+        # catalog rebuilt from the index: fingerprints are unknown until the
+        # documents are examined. They must not be reported as modified.
+        self.__add_to_catalog("doc_a", fingerprint=False)
+        self.__add_to_catalog("doc_b", fingerprint=False)
+        watcher = self.__make_watcher()
+        watcher.poll()
+        watcher.flush(force=True)
+        self.assertEqual(self.changes, [])
+
+    def test_classify_unknown_fingerprints(self):
+        # what the file monitors report: only the documents that had an
+        # event are classified
+        self.__add_to_catalog("doc_a", fingerprint=False)
+        watcher = self.__make_watcher()
+        self.__write("doc_a", "paper.1.thumb.jpg", "thumbnail")
+        self.assertEqual(watcher._classify(set(["doc_a"])),
+                         (set(), set(), set()))
+        self.__write("doc_a", "paper.2.jpg", "img")
+        self.assertEqual(watcher._classify(set(["doc_a"])),
+                         (set(), set(["doc_a"]), set()))
+        self.assertEqual(watcher._classify(set(["doc_a"])),
+                         (set(), set(), set()))
+
+    def test_classify(self):
+        watcher = self.__make_watcher()
+        self.__write("doc_b", "paper.2.jpg", "img")
+        self.__write("doc_c", "paper.1.jpg", "img")
+        (new, upd, deleted) = watcher._classify(
+            set(["doc_a", "doc_b", "doc_c", "doc_missing"]))
+        self.assertEqual(new, set(["doc_c"]))
+        self.assertEqual(upd, set(["doc_b"]))
+        self.assertEqual(deleted, set())
+
+
+if __name__ == "__main__":
+    unittest.main()